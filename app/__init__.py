@@ -10,7 +10,18 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
 
     setup_logging(app)
+    from app import sqlite
+    sqlite.apply_engine_options(app.config)
     db.init_app(app)
+    sqlite.init_app(app)
+
+    if app.config['RUN_JOBS']:
+        from app.jobs import job_runner
+        job_runner.init_app(app)
+    # Registers the session hooks that keep stock valuation, the catalog index and the change feed current
+    from app import valuation, catalog, changes  # noqa: F401
+    from app import profiling
+    profiling.init_app(app)
 
     @app.route('/health')
     def health():
@@ -21,11 +32,26 @@ def create_app(config_class=Config):
     from app.routes.suppliers import suppliers_bp
     from app.routes.transactions import transactions_bp
     from app.routes.analytics import analytics_bp
+    from app.routes.jobs import jobs_bp
+    from app.routes.metrics import metrics_bp
+    from app.routes.batch import batch_bp
+    from app.routes.profiles import profiles_bp
+    from app.routes.changes import changes_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(products_bp)
     app.register_blueprint(suppliers_bp)
     app.register_blueprint(transactions_bp)
     app.register_blueprint(analytics_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(batch_bp)
+    app.register_blueprint(profiles_bp)
+    app.register_blueprint(changes_bp)
+
+    from app.cli import init_db, ledger_cli, valuation_cli
+    app.cli.add_command(init_db)
+    app.cli.add_command(ledger_cli)
+    app.cli.add_command(valuation_cli)
 
     return app
@@ -0,0 +1,163 @@
+import asyncio
+import io
+import sys
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.engine import make_url
+from sqlalchemy.util import await_only, greenlet_spawn
+from werkzeug.exceptions import HTTPException
+from app import create_app, db
+from app.singleflight import SingleFlight, _Call
+
+# Async drivers used for each backend in the async serving mode
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+# Aggregates the NumPy engine serves from memory under a lock held across its
+# refresh query; with ANALYTICS_ENGINE=numpy they stay on the thread pool
+COLUMNAR_ENDPOINTS = frozenset((
+    'analytics.top_selling', 'analytics.low_stock', 'analytics.stock_value',
+    'analytics.stock_by_category', 'analytics.products_by_supplier',
+))
+
+
+def async_database_url(uri):
+    url = make_url(uri)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f'No async driver configured for {url.get_backend_name()}')
+    return url.set(drivername=f'{url.get_backend_name()}+{driver}').render_as_string(hide_password=False)
+
+
+class _LoopCall(_Call):
+    # Followers suspend their own greenlet on an asyncio event instead of
+    # blocking the thread, which would also stop the leader's request
+    __slots__ = ()
+
+    def __init__(self):
+        self.done = asyncio.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        await_only(self.done.wait())
+
+
+class LoopSingleFlight(SingleFlight):
+    call_class = _LoopCall
+
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class AsyncReadServer:
+    # ASGI entry point for the async serving mode. GET requests for the
+    # read-heavy endpoints run on the event loop against an app whose engine
+    # uses an async driver: each request runs in a greenlet that is
+    # suspended while its query is in flight, so one worker keeps many
+    # queries going. Everything else goes to the regular app on a thread
+    # pool, unchanged.
+    def __init__(self, read_app, wsgi_app, threads=10):
+        self.read_app = read_app
+        self.fallback = WSGIMiddleware(wsgi_app, workers=threads)
+        self.endpoints = set(read_app.config['ASYNC_READ_ENDPOINTS'])
+        if read_app.config['ANALYTICS_ENGINE'] == 'numpy':
+            self.endpoints -= COLUMNAR_ENDPOINTS
+        self._urls = read_app.url_map.bind('localhost')
+
+    def serves(self, scope):
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+            return False
+        try:
+            endpoint, _ = self._urls.match(scope['path'], method=scope['method'])
+        except HTTPException:
+            return False
+        return endpoint in self.endpoints
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if not self.serves(scope):
+            return await self.fallback(scope, receive, send)
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        def handle():
+            chunks = self.read_app(wsgi_environ(scope, body), start_response)
+            try:
+                return b''.join(chunks)
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+
+        content = await greenlet_spawn(handle)
+        await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else content})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await greenlet_spawn(self.dispose)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def dispose(self):
+        with self.read_app.app_context():
+            db.engine.dispose()
+
+
+def create_asgi_app(wsgi_app):
+    # `wsgi_app` serves every request the async app does not; the read app
+    # is a second instance with the same config, bound to the async driver.
+    config = wsgi_app.config
+    with wsgi_app.app_context():
+        # The engine's URL, with relative SQLite paths already resolved
+        url = db.engine.url
+    engine_options = dict(config['SQLALCHEMY_ENGINE_OPTIONS'])
+    if 'poolclass' not in engine_options:
+        engine_options['pool_size'] = config['ASYNC_POOL_SIZE']
+    read_config = type('AsyncReadConfig', (), dict(
+        {key: value for key, value in config.items() if key.isupper()},
+        SQLALCHEMY_DATABASE_URI=config['ASYNC_DATABASE_URL'] or async_database_url(url),
+        SQLALCHEMY_ENGINE_OPTIONS=engine_options,
+        # Jobs, their heartbeat and periodic tasks stay on the WSGI app: on the
+        # async driver they would fail outside a request's greenlet
+        RUN_JOBS=False,
+    ))
+    read_app = create_app(read_config)
+    read_app.extensions['singleflight'] = LoopSingleFlight()
+    return AsyncReadServer(read_app, wsgi_app, threads=config['ASYNC_FALLBACK_THREADS'])
@@ -0,0 +1,309 @@
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import uuid
+import zlib
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, insert, select
+from app import db
+from app.models import ArchiveFile, InventoryTransaction, Product
+
+# Archive files (*.ilc) are columnar: fixed-width numeric columns are stored
+# raw and 8-byte aligned so a reader can mmap the file and cast memoryviews
+# over them without copying. Rows are grouped into one run per product, and
+# each run carries its IN/OUT totals so product-level aggregates never touch
+# the row columns. Notes are rarely read and are zlib-compressed as a block.
+# Size comes from the layout: the product id is stored once per run, and the
+# IN/OUT type is folded into the sign of the quantity.
+MAGIC = b'ILCA'
+VERSION = 1
+EXTENSION = '.ilc'
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+FLAG_BIG_ENDIAN = 1
+HEADER = struct.Struct('<4sHHqqq')      # magic, version, flags, rows, runs, cutoff
+COLUMN = struct.Struct('<16sBc6xqqq')   # name, codec, typecode, offset, length, raw length
+EPOCH = datetime(1970, 1, 1)
+ARCHIVE_OPENING_NOTE = 'Opening balance (archived ledger)'
+# Files written before archives were registered had no unique suffix
+LEGACY_NAME = re.compile(r'ledger-\d{8}-\d{10}-\d{10}\.ilc')
+
+RAW_COLUMNS = [
+    ('run_product', 'i'),   # product id of each run, ascending
+    ('run_offset', 'q'),    # first row of each run, plus a final end offset
+    ('run_in', 'q'),        # total IN quantity per run
+    ('run_out', 'q'),       # total OUT quantity per run
+    ('id', 'q'),
+    ('qty', 'i'),           # signed: IN positive, OUT negative
+    ('ts', 'q'),            # microseconds since the epoch (naive UTC)
+]
+
+
+def to_micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=value)
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def write_archive(path, rows, cutoff):
+    # rows: (id, product_id, signed_qty, transaction_date, notes) ordered by product, date, id
+    cols = {name: array(code) for name, code in RAW_COLUMNS}
+    notes = []
+    current = None
+    for trans_id, product_id, qty, when, note in rows:
+        if product_id != current:
+            cols['run_product'].append(product_id)
+            cols['run_offset'].append(len(cols['id']))
+            cols['run_in'].append(0)
+            cols['run_out'].append(0)
+            current = product_id
+        if qty >= 0:
+            cols['run_in'][-1] += qty
+        else:
+            cols['run_out'][-1] -= qty
+        cols['id'].append(trans_id)
+        cols['qty'].append(qty)
+        cols['ts'].append(to_micros(when))
+        notes.append(note)
+    cols['run_offset'].append(len(cols['id']))
+
+    blobs = [(name, CODEC_RAW, code, cols[name].tobytes(), None) for name, code in RAW_COLUMNS]
+    notes_raw = json.dumps(notes).encode()
+    blobs.append(('notes', CODEC_ZLIB, 'B', zlib.compress(notes_raw, 9), len(notes_raw)))
+
+    offset = _align(HEADER.size + COLUMN.size * len(blobs))
+    directory = []
+    for name, codec, code, data, raw_length in blobs:
+        directory.append(COLUMN.pack(name.encode(), codec, code.encode(), offset, len(data),
+                                     raw_length if raw_length is not None else len(data)))
+        offset = _align(offset + len(data))
+
+    flags = FLAG_BIG_ENDIAN if sys.byteorder == 'big' else 0
+    # Never replaces an existing file; a partial one is ignored by readers
+    # until it is registered
+    with open(path, 'xb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, flags, len(cols['id']), len(cols['run_product']), to_micros(cutoff)))
+        f.write(b''.join(directory))
+        for _, _, _, data, _ in blobs:
+            f.write(b'\0' * (_align(f.tell()) - f.tell()))
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(cols['id'])
+
+
+class LedgerArchive:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, self.row_count, self.run_count, cutoff = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a ledger archive')
+        if bool(flags & FLAG_BIG_ENDIAN) != (sys.byteorder == 'big'):
+            raise ValueError(f'{path} was written on a machine with a different byte order')
+        self.cutoff = from_micros(cutoff)
+        self._columns = {}
+        for i in range(len(RAW_COLUMNS) + 1):
+            name, codec, code, offset, length, _ = COLUMN.unpack_from(self._mmap, HEADER.size + i * COLUMN.size)
+            self._columns[name.rstrip(b'\0').decode()] = (codec, code.decode(), offset, length)
+        self._views = {}
+        self._notes = None
+
+    def column(self, name):
+        # Raw columns are zero-copy views over the mapped file
+        if name not in self._views:
+            codec, code, offset, length = self._columns[name]
+            self._views[name] = memoryview(self._mmap)[offset:offset + length].cast(code)
+        return self._views[name]
+
+    def notes(self):
+        if self._notes is None:
+            _, _, offset, length = self._columns['notes']
+            self._notes = json.loads(zlib.decompress(self._mmap[offset:offset + length]))
+        return self._notes
+
+    def product_totals(self):
+        # {product_id: (in_qty, out_qty)} straight from the per-run summaries
+        products, ins, outs = self.column('run_product'), self.column('run_in'), self.column('run_out')
+        return {products[i]: (ins[i], outs[i]) for i in range(self.run_count)}
+
+    def movements(self, product_id):
+        products = self.column('run_product')
+        i = bisect_left(products, product_id)
+        if i == self.run_count or products[i] != product_id:
+            return []
+        offsets = self.column('run_offset')
+        ids, qtys, stamps = self.column('id'), self.column('qty'), self.column('ts')
+        notes = self.notes()
+        return [(ids[r], from_micros(stamps[r]), qtys[r], notes[r]) for r in range(offsets[i], offsets[i + 1])]
+
+    def close(self):
+        for view in self._views.values():
+            view.release()
+        self._views = {}
+        self._mmap.close()
+
+
+_cache_lock = threading.Lock()
+_cache = {}
+
+def archive_dir(app=None):
+    app = app or current_app
+    path = app.config.get('LEDGER_ARCHIVE_DIR') or os.path.join(app.instance_path, 'archive')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def register_legacy_archives():
+    # Registers files written before the archive_files table existed; new
+    # files carry a unique suffix, so a file left by a failed archive is
+    # never picked up here
+    directory = archive_dir()
+    known = set(db.session.execute(select(ArchiveFile.name)).scalars())
+    added = 0
+    for name in sorted(os.listdir(directory)):
+        if LEGACY_NAME.fullmatch(name) and name not in known:
+            archive = LedgerArchive(os.path.join(directory, name))
+            db.session.add(ArchiveFile(name=name, cutoff=archive.cutoff, rows=archive.row_count))
+            archive.close()
+            added += 1
+    db.session.commit()
+    return added
+
+def open_archives():
+    # Only registered files are read: one whose rows were never deleted from
+    # the ledger would count them twice. Readers stay mapped for the life of
+    # the worker and are reopened when a file changes.
+    directory = archive_dir()
+    names = db.session.execute(select(ArchiveFile.name).order_by(ArchiveFile.id)).scalars().all()
+    paths = [os.path.join(directory, name) for name in names]
+    archives = []
+    with _cache_lock:
+        for path in paths:
+            mtime = os.stat(path).st_mtime_ns
+            cached = _cache.get(path)
+            if cached is None or cached[0] != mtime:
+                if cached is not None:
+                    cached[1].close()
+                cached = _cache[path] = (mtime, LedgerArchive(path))
+            archives.append(cached[1])
+    return archives
+
+def archived_totals():
+    totals = {}
+    for archive in open_archives():
+        for product_id, (ins, outs) in archive.product_totals().items():
+            prev_in, prev_out = totals.get(product_id, (0, 0))
+            totals[product_id] = (prev_in + ins, prev_out + outs)
+    return totals
+
+def archived_movements(product_id):
+    rows = []
+    for archive in open_archives():
+        rows.extend(archive.movements(product_id))
+    rows.sort(key=lambda r: (r[1], r[0]))
+    return rows
+
+
+def fold_movements(rows, prices, method):
+    # Valuation state per product after `rows`, given as (product_id,
+    # quantity, transaction_type, unit_cost) in (product, date, id) order
+    from app.valuation import ProductValuation
+    states = {}
+    for product_id, quantity, trans_type, unit_cost in rows:
+        state = states.get(product_id)
+        if state is None:
+            state = states[product_id] = ProductValuation()
+        if trans_type == 'IN':
+            state.receive(quantity, unit_cost if unit_cost is not None else prices.get(product_id, 0))
+        else:
+            state.issue(quantity, method)
+    return states
+
+def opening_rows(states, cutoff):
+    # Ledger rows dated at `cutoff` that carry each product's balance forward,
+    # one IN row per open cost layer so the cost basis carries forward too.
+    # They are written with Core inserts, so the stored valuation (which
+    # already includes the balance) is left alone.
+    rows = []
+    for product_id, state in states.items():
+        if state.quantity > 0:
+            rows.extend({'product_id': product_id, 'quantity': quantity, 'transaction_type': 'IN',
+                         'transaction_date': cutoff, 'notes': ARCHIVE_OPENING_NOTE, 'unit_cost': unit_cost,
+                         'is_opening': True}
+                        for quantity, unit_cost in state.opening_layers())
+        elif state.quantity < 0:
+            rows.append({'product_id': product_id, 'quantity': -state.quantity, 'transaction_type': 'OUT',
+                         'transaction_date': cutoff, 'notes': ARCHIVE_OPENING_NOTE, 'unit_cost': None,
+                         'is_opening': True})
+    return rows
+
+def archive_transactions(cutoff, batch_products=10000, progress=None):
+    # Moves every movement dated before `cutoff` into archive files, one file
+    # per batch of products, and replaces it with a carried-forward opening
+    # balance. Earlier opening balances are folded in rather than archived,
+    # so archives plus the live ledger always replay to the same stock. The
+    # balance is split into one opening row per open cost layer, so the cost
+    # basis carries forward and a valuation replay still matches.
+    from app.valuation import valuation_method
+    t = InventoryTransaction
+    method = valuation_method()
+    directory = archive_dir()
+    old = t.transaction_date < cutoff
+    product_ids = db.session.execute(
+        select(t.product_id).where(old).distinct().order_by(t.product_id)
+    ).scalars().all()
+
+    summary = {'files': [], 'rows': 0, 'products': len(product_ids)}
+    for start in range(0, len(product_ids), batch_products):
+        batch = product_ids[start:start + batch_products]
+        rows = db.session.execute(
+            select(t.id, t.product_id, t.quantity, t.transaction_type, t.transaction_date, t.notes, t.unit_cost,
+                   t.is_opening)
+            .where(old, t.product_id.in_(batch))
+            .order_by(t.product_id, t.transaction_date, t.id)
+        ).all()
+
+        prices = dict(db.session.execute(select(Product.id, Product.unit_price).where(Product.id.in_(batch))).all())
+        states = fold_movements(((r.product_id, r.quantity, r.transaction_type, r.unit_cost) for r in rows),
+                                prices, method)
+        history = [(trans_id, product_id, quantity if trans_type == 'IN' else -quantity, when, note)
+                   for trans_id, product_id, quantity, trans_type, when, note, _, is_opening in rows
+                   if not is_opening]
+
+        # Unique per run: re-archiving with the same cutoff adds a file
+        name = f'ledger-{cutoff:%Y%m%d}-{batch[0]:010d}-{batch[-1]:010d}-{uuid.uuid4().hex[:12]}{EXTENSION}'
+        path = os.path.join(directory, name)
+        written = write_archive(path, history, cutoff) if history else 0
+        try:
+            db.session.execute(delete(t).where(old, t.product_id.in_(batch)))
+            opening = opening_rows(states, cutoff)
+            if opening:
+                db.session.execute(insert(t), opening)
+            if written:
+                db.session.add(ArchiveFile(name=name, cutoff=cutoff, rows=written))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Only this run's own, never registered, file
+            if written:
+                os.remove(path)
+            raise
+
+        if written:
+            summary['files'].append(path)
+        summary['rows'] += written
+        if progress:
+            progress(start + len(batch), len(product_ids))
+    return summary
@@ -11,9 +11,31 @@ def generate_token(user_id):
     }
     return jwt.encode(payload, current_app.config['JWT_SECRET_KEY'], algorithm='HS256')
 
+
+def bearer_user():
+    # The user of a valid bearer token on this request, or None; for hooks
+    # that run before the view's token_required check
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    try:
+        data = jwt.decode(auth_header.split(" ")[1], current_app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
+    except jwt.PyJWTError:
+        return None
+    return User.query.get(data.get('user_id'))
+
+
+# Set by POST /api/batch on its sub-requests: the user it already authenticated
+BATCH_USER_KEY = 'inventory.batch_user'
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
+        # WSGI environ keys can't be sent by clients, only set in-process
+        batch_user = request.environ.get(BATCH_USER_KEY)
+        if batch_user is not None:
+            return f(batch_user, *args, **kwargs)
+        
         token = None
         if 'Authorization' in request.headers:
             auth_header = request.headers['Authorization']
@@ -34,3 +56,16 @@ def token_required(f):
         return f(current_user, *args, **kwargs)
     
     return decorated
+
+def is_admin(user):
+    return user.username in current_app.config['ADMIN_USERNAMES']
+
+def admin_required(f):
+    # Goes below token_required: only users listed in ADMIN_USERNAMES pass
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        if not is_admin(current_user):
+            return jsonify({'message': 'Admin access required'}), 403
+        return f(current_user, *args, **kwargs)
+    
+    return decorated
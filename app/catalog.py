@@ -0,0 +1,156 @@
+import threading
+import time
+from decimal import Decimal
+from flask import current_app, has_app_context
+from sqlalchemy import event, select
+from app import db
+from app.models import Product
+
+products = Product.__table__
+SUMMARY_COLUMNS = (products.c.id, products.c.sku, products.c.name, products.c.unit_price, products.c.is_active)
+
+
+class ProductSummary:
+    # Compact per-product record; the price is kept in integer cents so no
+    # Decimal object is held per entry.
+    __slots__ = ('id', 'sku', 'name', 'price_cents', 'is_active')
+
+    def __init__(self, id, sku, name, unit_price, is_active):
+        self.id = id
+        self.sku = sku
+        self.name = name
+        self.price_cents = int((Decimal(str(unit_price)) * 100).to_integral_value())
+        self.is_active = bool(is_active)
+
+    @property
+    def unit_price(self):
+        return Decimal(self.price_cents).scaleb(-2)
+
+
+class CatalogIndex:
+    # Per-worker id -> summary and sku -> id maps for the write path.
+    # Writes in this worker update it on commit; writes in other workers are
+    # picked up by a full reload every CATALOG_TTL seconds. Misses fall back
+    # to the database, so new products are always found, and a SKU that the
+    # index reports as taken is confirmed against the database.
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._by_id = {}
+        self._by_sku = {}
+        self._loaded_at = None
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def load(self):
+        by_id = {}
+        by_sku = {}
+        for row in db.session.execute(select(*SUMMARY_COLUMNS)):
+            summary = ProductSummary(*row)
+            by_id[summary.id] = summary
+            by_sku[summary.sku] = summary.id
+        with self._lock:
+            self._by_id, self._by_sku = by_id, by_sku
+            self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.ttl:
+            return
+        # The first load blocks; later reloads run in one request while the
+        # others keep reading the previous maps.
+        if self._reload_lock.acquire(blocking=loaded_at is None):
+            try:
+                if self._loaded_at is loaded_at:
+                    self.load()
+            finally:
+                self._reload_lock.release()
+
+    def _fetch(self, *where):
+        row = db.session.execute(select(*SUMMARY_COLUMNS).where(*where)).first()
+        if row is None:
+            return None
+        summary = ProductSummary(*row)
+        self.put(summary)
+        return summary
+
+    def get(self, product_id):
+        self._ensure_fresh()
+        summary = self._by_id.get(product_id)
+        if summary is None:
+            summary = self._fetch(products.c.id == product_id)
+        return summary
+
+    def sku_owner(self, sku):
+        # Id of the product holding `sku`, or None. An index miss is trusted;
+        # the unique constraint still guards a SKU taken by another worker.
+        self._ensure_fresh()
+        if sku not in self._by_sku:
+            return None
+        summary = self._fetch(products.c.sku == sku)
+        if summary is None:
+            with self._lock:
+                self._by_sku.pop(sku, None)
+            return None
+        return summary.id
+
+    def put(self, summary):
+        with self._lock:
+            previous = self._by_id.get(summary.id)
+            if previous is not None and previous.sku != summary.sku and self._by_sku.get(previous.sku) == summary.id:
+                del self._by_sku[previous.sku]
+            self._by_id[summary.id] = summary
+            self._by_sku[summary.sku] = summary.id
+
+    def discard(self, product_ids):
+        with self._lock:
+            for product_id in product_ids:
+                summary = self._by_id.pop(product_id, None)
+                if summary is not None and self._by_sku.get(summary.sku) == product_id:
+                    del self._by_sku[summary.sku]
+
+
+def catalog():
+    app = current_app
+    index = app.extensions.get('catalog')
+    if index is None:
+        index = app.extensions.setdefault('catalog', CatalogIndex(app.config['CATALOG_TTL']))
+    return index
+
+def warm_catalog(app):
+    # Loads the index at startup (before forking when gunicorn preloads)
+    with app.app_context():
+        catalog().load()
+        db.session.remove()
+
+
+# ORM writes are applied once their transaction commits. Core statements
+# that change products (bulk updates, purges) call catalog().discard().
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_product_writes(session, flush_context):
+    pending = session.info.setdefault('catalog_pending', [])
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Product):
+            pending.append(('put', ProductSummary(obj.id, obj.sku, obj.name, obj.unit_price, obj.is_active)))
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            pending.append(('discard', obj.id))
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_product_writes(session):
+    pending = session.info.pop('catalog_pending', None)
+    if not pending or not has_app_context():
+        return
+    index = catalog()
+    for action, value in pending:
+        if action == 'put':
+            index.put(value)
+        else:
+            index.discard([value])
+
+@event.listens_for(db.session, 'after_rollback')
+def _drop_product_writes(session):
+    session.info.pop('catalog_pending', None)
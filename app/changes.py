@@ -0,0 +1,221 @@
+from datetime import datetime
+from sqlalchemy import event, select, insert, update, delete, and_, bindparam
+from app import db
+from app.models import Product, Supplier, InventoryTransaction, InventoryValuation, Change, ChangeCounter, \
+    PendingChange
+from app.projections import PRODUCT_FIELDS, SUPPLIER_FIELDS, SUPPLIER_DEFAULT_FIELDS, select_fields, serialize_rows
+
+changes = Change.__table__
+counter = ChangeCounter.__table__
+pending_changes = PendingChange.__table__
+products = Product.__table__
+suppliers = Supplier.__table__
+valuations = InventoryValuation.__table__
+
+# Product fields sent in the feed; stock is its own entity so a sale does
+# not resend the product
+CHANGE_PRODUCT_FIELDS = ['id', 'name', 'sku', 'category', 'supplier_id', 'unit_price', 'is_active']
+
+
+# ==================== TRACKING ====================
+
+# Writers never take a shared lock: at commit each records its changed rows
+# in change_pending, one row per entity, inside its own transaction. Sequence
+# numbers are handed out later, to committed rows only, by stamp_pending().
+# Stampers take the counter row in turn and hold it until they commit, so
+# seq N+1 never becomes visible before seq N and a cursor cannot skip an
+# entry; a row still locked by an in-flight writer is left for the next stamp.
+
+def track_changes(session, entity, ids, deleted=False):
+    # Marks rows written by Core statements; ORM writes are picked up by the
+    # flush hook below. All of them are recorded when the transaction commits.
+    pending = session.info.setdefault('changes_pending', {})
+    for entity_id in ids:
+        pending[(entity, entity_id)] = deleted
+
+def _dialect_insert(conn):
+    # Dialect modules are imported here so workers only load the one they use
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as upsert
+        return upsert
+    if conn.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as upsert
+        return upsert
+    return None
+
+def _upsert(conn, table, entries, columns):
+    upsert = _dialect_insert(conn)
+    if upsert is not None:
+        stmt = upsert(table)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.entity, table.c.entity_id],
+            set_={name: stmt.excluded[name] for name in columns}
+        ), entries)
+        return
+    for entry in entries:
+        conn.execute(delete(table).where(table.c.entity == entry['entity'], table.c.entity_id == entry['entity_id']))
+    conn.execute(insert(table), entries)
+
+def record_changes(conn, pending):
+    now = datetime.utcnow()
+    _upsert(conn, pending_changes, [
+        {'entity': entity, 'entity_id': entity_id, 'deleted': deleted, 'changed_at': now}
+        for (entity, entity_id), deleted in sorted(pending.items())
+    ], ('deleted', 'changed_at'))
+
+def seed_counter(conn):
+    # Creates the counter row if missing; concurrent first stamps must not
+    # both insert it (schema.sql and init-db seed it up front)
+    upsert = _dialect_insert(conn)
+    if upsert is not None:
+        conn.execute(upsert(counter).values(id=1, value=0).on_conflict_do_nothing(index_elements=[counter.c.id]))
+    elif conn.execute(select(counter.c.id).where(counter.c.id == 1)).first() is None:
+        conn.execute(insert(counter).values(id=1, value=0))
+
+def _lock_counter(conn):
+    # Last seq handed out; the row stays locked until this stamp commits
+    lock = update(counter).where(counter.c.id == 1).values(value=counter.c.value).returning(counter.c.value)
+    last = conn.execute(lock).scalar()
+    if last is None:
+        seed_counter(conn)
+        last = conn.execute(lock).scalar()
+    return last
+
+def _has_pending():
+    with db.engine.connect() as conn:
+        return conn.execute(select(pending_changes.c.entity).limit(1)).first() is not None
+
+def stamp_pending(batch_size=10000):
+    # Moves committed pending changes into the journal with the next
+    # sequence numbers, oldest first, and returns how many. Runs on its own
+    # connection once the caller's transaction has ended: on SQLite an open
+    # read would keep it from committing.
+    db.session.rollback()
+    p = pending_changes.c
+    stamped = 0
+    while _has_pending():
+        with db.engine.begin() as conn:
+            last = _lock_counter(conn)
+            rows = conn.execute(
+                select(p.entity, p.entity_id, p.deleted, p.changed_at)
+                .order_by(p.changed_at, p.entity, p.entity_id).limit(batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if rows:
+                _upsert(conn, changes, [
+                    {'entity': entity, 'entity_id': entity_id, 'seq': last + i + 1, 'deleted': deleted,
+                     'changed_at': changed_at}
+                    for i, (entity, entity_id, deleted, changed_at) in enumerate(rows)
+                ], ('seq', 'deleted', 'changed_at'))
+                conn.execute(update(counter).where(counter.c.id == 1).values(value=last + len(rows)))
+                conn.execute(delete(pending_changes).where(p.entity == bindparam('e'), p.entity_id == bindparam('i')),
+                             [{'e': entity, 'i': entity_id} for entity, entity_id, _, _ in rows])
+        stamped += len(rows)
+        # Rows skipped as locked belong to writers still committing
+        if len(rows) < batch_size:
+            break
+    return stamped
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changes(session, flush_context):
+    for obj in session.new | session.dirty:
+        if obj not in session.new and not session.is_modified(obj):
+            continue
+        if isinstance(obj, Product):
+            track_changes(session, 'product', [obj.id])
+        elif isinstance(obj, Supplier):
+            track_changes(session, 'supplier', [obj.id])
+        elif isinstance(obj, InventoryTransaction):
+            track_changes(session, 'stock', [obj.product_id])
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            track_changes(session, 'product', [obj.id], deleted=True)
+            track_changes(session, 'stock', [obj.id], deleted=True)
+        elif isinstance(obj, Supplier):
+            track_changes(session, 'supplier', [obj.id], deleted=True)
+        elif isinstance(obj, InventoryTransaction):
+            track_changes(session, 'stock', [obj.product_id])
+
+@event.listens_for(db.session, 'before_commit')
+def _stamp_pending_changes(session):
+    # Flush first so the ORM writes of this commit are collected too
+    session.flush()
+    pending = session.info.pop('changes_pending', None)
+    if pending:
+        record_changes(session.connection(), pending)
+
+@event.listens_for(db.session, 'after_rollback')
+def _drop_pending_changes(session):
+    session.info.pop('changes_pending', None)
+
+
+# ==================== FEED ====================
+
+def _load_products(ids):
+    query = select_fields(CHANGE_PRODUCT_FIELDS, PRODUCT_FIELDS, products).where(products.c.id.in_(ids))
+    rows = db.session.execute(query).all()
+    return {item['id']: item for item in serialize_rows(rows, CHANGE_PRODUCT_FIELDS, PRODUCT_FIELDS)}
+
+def _load_suppliers(ids):
+    fields = ['id'] + [f for f in SUPPLIER_DEFAULT_FIELDS if f != 'id']
+    query = select_fields(fields, SUPPLIER_FIELDS, suppliers).where(suppliers.c.id.in_(ids))
+    rows = db.session.execute(query).all()
+    return {item['id']: item for item in serialize_rows(rows, fields, SUPPLIER_FIELDS)}
+
+def _load_stock(ids):
+    rows = db.session.execute(
+        select(valuations.c.product_id, valuations.c.quantity, valuations.c.total_value)
+        .where(valuations.c.product_id.in_(ids))
+    )
+    return {product_id: {'product_id': product_id, 'quantity': quantity, 'value': float(value)}
+            for product_id, quantity, value in rows}
+
+
+LOADERS = {'product': _load_products, 'supplier': _load_suppliers, 'stock': _load_stock}
+
+
+def changes_since(since, limit):
+    # Entities whose latest change is after `since`, oldest first, with
+    # their current state. A row deleted after its journal entry was read
+    # is reported as deleted; its tombstone follows with a later seq.
+    stamp_pending()
+    c = changes.c
+    entries = db.session.execute(
+        select(c.seq, c.entity, c.entity_id, c.deleted).where(c.seq > since).order_by(c.seq).limit(limit + 1)
+    ).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    current = {}
+    for entity, load in LOADERS.items():
+        ids = [entity_id for _, kind, entity_id, deleted in entries if kind == entity and not deleted]
+        current[entity] = load(ids) if ids else {}
+    feed = []
+    for seq, entity, entity_id, deleted in entries:
+        data = None if deleted else current[entity].get(entity_id)
+        feed.append({'seq': seq, 'entity': entity, 'id': entity_id, 'deleted': data is None, 'data': data})
+    return feed, entries[-1][0] if entries else since, has_more
+
+def backfill_changes(batch_size=5000):
+    # Journals rows that predate change tracking, so a client syncing from
+    # an empty cursor receives the whole catalog, and seeds the counter row.
+    # Returns the number added.
+    c = changes.c
+    sources = (
+        ('product', products.c.id),
+        ('supplier', suppliers.c.id),
+        ('stock', valuations.c.product_id),
+    )
+    with db.engine.begin() as conn:
+        seed_counter(conn)
+    added = 0
+    for entity, id_column in sources:
+        missing = db.session.execute(
+            select(id_column).outerjoin(changes, and_(c.entity == entity, c.entity_id == id_column))
+            .where(c.entity_id.is_(None)).order_by(id_column)
+        ).scalars().all()
+        for start in range(0, len(missing), batch_size):
+            record_changes(db.session.connection(), {(entity, i): False for i in missing[start:start + batch_size]})
+            added += len(missing[start:start + batch_size])
+    db.session.commit()
+    stamp_pending()
+    return added
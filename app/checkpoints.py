@@ -0,0 +1,190 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import select, insert, delete, func, case
+from app import db
+from app.archive import open_archives
+from app.models import Product, InventoryTransaction, StockCheckpoint
+from app.valuation import ProductValuation, valuation_method, ZERO, _money
+
+products = Product.__table__
+transactions = InventoryTransaction.__table__
+checkpoints = StockCheckpoint.__table__
+
+
+def archive_cutoff():
+    # Movements dated before this live only in archive files. The opening
+    # rows archiving leaves behind are dated at the cutoff, so they are the
+    # earliest live rows (and still mark it when a re-archive wrote no file).
+    t = transactions.c
+    cutoffs = [archive.cutoff for archive in open_archives()]
+    first = db.session.execute(select(func.min(t.transaction_date))).scalar()
+    if first is not None and db.session.execute(
+        select(t.id).where(t.transaction_date == first, t.is_opening).limit(1)
+    ).first() is not None:
+        cutoffs.append(first)
+    return max(cutoffs, default=None)
+
+def latest_checkpoint(at, method):
+    c = checkpoints.c
+    return db.session.execute(select(func.max(c.as_of)).where(c.as_of <= at, c.method == method)).scalar()
+
+def list_checkpoints():
+    c = checkpoints.c
+    return db.session.execute(
+        select(c.as_of, c.method, func.count(), func.sum(c.total_value)).group_by(c.as_of, c.method).order_by(c.as_of)
+    ).all()
+
+def _load_checkpoint(as_of, method):
+    c = checkpoints.c
+    rows = db.session.execute(
+        select(c.product_id, c.quantity, c.total_value, c.last_unit_cost, c.layers)
+        .where(c.as_of == as_of, c.method == method)
+    )
+    return {
+        product_id: ProductValuation(quantity, value, last_cost,
+                                     [[None, Decimal(cost), remaining] for cost, remaining in json.loads(layers)])
+        for product_id, quantity, value, last_cost, layers in rows
+    }
+
+def _choose_base(at, method):
+    # The newest checkpoint at or before `at` whose later movements are all
+    # still in the live ledger. Archiving replaces older history with opening
+    # rows dated at the cutoff, so a checkpoint from before the newest cutoff
+    # would count that history twice; a full replay is used instead.
+    base = latest_checkpoint(at, method)
+    cutoff = archive_cutoff()
+    if cutoff is None or (base is not None and base >= cutoff):
+        return base, None
+    if at >= cutoff:
+        return None, cutoff
+    if base == at:
+        return base, None
+    raise ValueError(f'Movements before {cutoff.isoformat()} are archived and no checkpoint was taken at '
+                     f'{at.isoformat()}')
+
+def _window(at, method):
+    # Movements after the chosen starting point, up to and including `at`
+    base, replay_from = _choose_base(at, method)
+    t = transactions.c
+    window = t.transaction_date <= at
+    if base is not None:
+        window = db.and_(window, t.transaction_date > base)
+    elif replay_from is not None:
+        window = db.and_(window, t.transaction_date >= replay_from)
+    return base, window
+
+def _movement_totals(window):
+    # One set-based pass over the window: per product, the net quantity, the
+    # value of costed receipts, the units received without a cost (valued at
+    # list price) and the number of issues
+    t = transactions.c
+    is_in = t.transaction_type == 'IN'
+    return db.session.execute(
+        select(t.product_id,
+               func.sum(case((is_in, t.quantity), else_=-t.quantity)),
+               func.sum(case((db.and_(is_in, t.unit_cost.isnot(None)), t.quantity * t.unit_cost), else_=0)),
+               func.sum(case((db.and_(is_in, t.unit_cost.is_(None)), t.quantity), else_=0)),
+               func.sum(case((is_in, 0), else_=1)))
+        .where(window).group_by(t.product_id)
+    ).all()
+
+def _replay(states, window, product_ids, prices, method, batch_products, progress):
+    # Row-by-row FIFO/average replay of these products' movements in the
+    # window. Opening rows stand for everything before their cutoff, so they
+    # go ahead of movements recorded at the cutoff itself.
+    t = transactions.c
+    seen = 0
+    for start in range(0, len(product_ids), batch_products):
+        rows = db.session.execute(
+            select(t.product_id, t.transaction_type, t.quantity, t.unit_cost)
+            .where(window, t.product_id.in_(product_ids[start:start + batch_products]))
+            .order_by(t.product_id, t.transaction_date, t.is_opening.desc(), t.id)
+        ).all()
+        for product_id, trans_type, quantity, unit_cost in rows:
+            state = states.get(product_id)
+            if state is None:
+                state = states[product_id] = ProductValuation()
+            if trans_type == 'IN':
+                state.receive(quantity, unit_cost if unit_cost is not None else prices.get(product_id, ZERO))
+            else:
+                state.issue(quantity, method)
+        seen += len(rows)
+        if progress:
+            progress(seen)
+
+def replay_as_of(at, with_layers=False, batch_products=1000, progress=None):
+    # Valuation state of every product with history at `at`: the chosen
+    # checkpoint plus the movements after it. Quantities come from one
+    # grouped aggregate; receipts only add to a product's value, so only
+    # products with an issue in the window are replayed row by row to cost
+    # it. with_layers replays every product that moved, for checkpoints
+    # that must carry the open cost layers forward.
+    method = valuation_method()
+    base, window = _window(at, method)
+    states = _load_checkpoint(base, method) if base is not None else {}
+    prices = dict(db.session.execute(select(products.c.id, products.c.unit_price)).all())
+    totals = _movement_totals(window)
+    replayed = [row[0] for row in totals if with_layers or row[4]]
+    _replay(states, window, replayed, prices, method, batch_products, progress)
+    replayed = set(replayed)
+    for product_id, quantity, costed, uncosted, _ in totals:
+        if product_id in replayed:
+            continue
+        state = states.get(product_id)
+        if state is None:
+            state = states[product_id] = ProductValuation()
+        state.quantity += int(quantity)
+        state.value = _money(state.value + Decimal(costed or 0) + int(uncosted) * prices.get(product_id, ZERO))
+    return method, base, states
+
+def stock_as_of(at, progress=None):
+    method, base, states = replay_as_of(at, progress=progress)
+    rows = []
+    total_quantity, total_value = 0, ZERO
+    for product_id, sku, name in db.session.execute(
+        select(products.c.id, products.c.sku, products.c.name).order_by(products.c.id)
+    ):
+        state = states.get(product_id)
+        quantity, value = (state.quantity, state.value) if state is not None else (0, ZERO)
+        total_quantity += quantity
+        total_value += value
+        rows.append({'product_id': product_id, 'sku': sku, 'name': name, 'quantity': quantity,
+                     'value': float(_money(value))})
+    return {
+        'as_of': at.isoformat(),
+        'method': method,
+        'checkpoint': base.isoformat() if base is not None else None,
+        'total_quantity': total_quantity,
+        'total_value': float(_money(total_value)),
+        'products': rows,
+    }
+
+def build_checkpoint(at, batch_size=5000, progress=None):
+    # Stores the state of every product at `at`, replacing an earlier
+    # checkpoint at the same time. Movements are dated when written, so a
+    # checkpoint in the past stays valid; one in the future is refused.
+    if at > datetime.utcnow():
+        raise ValueError('A checkpoint cannot be taken in the future')
+    method, base, states = replay_as_of(at, with_layers=True, progress=progress)
+    c = checkpoints.c
+    db.session.execute(delete(checkpoints).where(c.as_of == at, c.method == method))
+    known = set(db.session.execute(select(products.c.id)).scalars())
+    values = [{
+        'as_of': at,
+        'product_id': product_id,
+        'method': method,
+        'quantity': state.quantity,
+        'total_value': state.value,
+        'last_unit_cost': state.last_cost,
+        'layers': json.dumps([[str(layer[1]), layer[2]] for layer in state.layers]),
+    } for product_id, state in states.items() if product_id in known]
+    for start in range(0, len(values), batch_size):
+        db.session.execute(insert(checkpoints), values[start:start + batch_size])
+    db.session.commit()
+    return {'as_of': at, 'method': method, 'base': base, 'products': len(values)}
+
+def prune_checkpoints(before):
+    result = db.session.execute(delete(checkpoints).where(checkpoints.c.as_of < before))
+    db.session.commit()
+    return result.rowcount
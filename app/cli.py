@@ -0,0 +1,159 @@
+import click
+from datetime import datetime
+from flask.cli import AppGroup
+from app import db, jobs, partitions
+from app.archive import archive_transactions, register_legacy_archives
+from app.changes import backfill_changes
+from app.checkpoints import build_checkpoint, list_checkpoints, prune_checkpoints
+from app.reconcile import reconcile
+from app.valuation import audit_valuation, ensure_schema
+
+ledger_cli = AppGroup('ledger', help='Inventory ledger maintenance.')
+valuation_cli = AppGroup('valuation', help='Stock valuation maintenance.')
+
+@click.command('init-db')
+def init_db():
+    """Create missing tables; run once per deploy instead of at worker boot."""
+    db.create_all()
+    ensure_schema()
+    jobs.ensure_schema()
+    registered = register_legacy_archives()
+    if registered:
+        click.echo(f'Registered {registered} existing archive files')
+    backfilled = backfill_changes()
+    if backfilled:
+        click.echo(f'Added {backfilled} existing rows to the change feed')
+    click.echo('Database tables ready')
+
+def parse_date(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise click.BadParameter('expected YYYY-MM-DD')
+
+def parse_month(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m')
+    except ValueError:
+        raise click.BadParameter('expected YYYY-MM')
+
+@ledger_cli.command('partition-init')
+@click.option('--months-ahead', default=3, show_default=True, help='Future monthly partitions to create.')
+def partition_init(months_ahead):
+    """Convert the ledger to monthly range partitions (PostgreSQL)."""
+    try:
+        created = partitions.convert_to_partitioned(months_ahead)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Ledger partitioned into {len(created)} monthly partitions')
+
+@ledger_cli.command('create-partitions')
+@click.option('--months-ahead', default=3, show_default=True, help='Future monthly partitions to create.')
+def create_partitions(months_ahead):
+    """Create missing monthly partitions ahead of time."""
+    created = partitions.create_partitions(months_ahead)
+    for name in created:
+        click.echo(f'Created {name}')
+    click.echo(f'{len(created)} partitions created')
+
+@ledger_cli.command('detach-partitions')
+@click.option('--before', required=True, callback=parse_month, help='First month to keep (YYYY-MM).')
+@click.option('--drop', is_flag=True, help='Drop detached periods instead of keeping them.')
+def detach_partitions(before, drop):
+    """Detach (or drop) ledger periods older than --before."""
+    try:
+        detached = partitions.detach_partitions(before, drop=drop)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    for name in detached:
+        click.echo(f"{'Dropped' if drop else 'Detached'} {name}")
+    click.echo(f'{len(detached)} periods detached')
+
+@ledger_cli.command('drop-periods')
+@click.option('--before', required=True, callback=parse_month, help='First month to keep (YYYY-MM).')
+def drop_periods(before):
+    """Drop detached SQLite period tables older than --before."""
+    try:
+        dropped = partitions.drop_detached(before)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'{len(dropped)} periods dropped')
+
+@ledger_cli.command('list-partitions')
+def list_partitions():
+    """List ledger partitions (or detached SQLite periods)."""
+    for name in partitions.list_partitions():
+        click.echo(name)
+
+@ledger_cli.command('archive')
+@click.option('--before', required=True, callback=parse_date, help='Archive movements dated before this (YYYY-MM-DD).')
+@click.option('--batch-products', default=10000, show_default=True, help='Products per archive file.')
+def archive(before, batch_products):
+    """Move old movements into compressed columnar archive files."""
+    summary = archive_transactions(before, batch_products=batch_products)
+    for path in summary['files']:
+        click.echo(f'Wrote {path}')
+    click.echo(f"Archived {summary['rows']} transactions across {summary['products']} products")
+    # As-of reports after the cutoff start from here instead of the opening rows
+    if summary['rows'] and before <= datetime.utcnow():
+        checkpoint = build_checkpoint(before)
+        click.echo(f"Checkpoint {before.isoformat()}: {checkpoint['products']} products")
+
+
+@ledger_cli.command('reconcile')
+@click.option('--workers', type=int, help='Worker processes (default: CPU count; 0 runs in-process).')
+@click.option('--partitions', type=int, help='Product ranges to split the ledger into (default: 2 per worker).')
+@click.option('--chunk-size', default=10000, show_default=True, help='Rows fetched per round trip.')
+def reconcile_ledger(workers, partitions, chunk_size):
+    """Check the ledger for negative balances, orphans and drift from stored totals."""
+    report = reconcile(workers=workers, partitions=partitions, chunk_size=chunk_size)
+    for kind in ('negative_balances', 'orphans', 'invalid_rows', 'mismatches'):
+        for entry in report[kind]:
+            click.echo(f"{kind}: {', '.join(f'{k}={v}' for k, v in entry.items())}")
+    counts = ', '.join(f'{n} {kind}' for kind, n in report['counts'].items())
+    click.echo(f"Checked {report['rows']} transactions for {report['products']} products in "
+               f"{report['elapsed']:.2f}s ({report['rows_per_sec']} rows/sec, {report['workers']} workers, "
+               f"{len(report['partitions'])} partitions): {counts}")
+    if report['issue_count']:
+        raise SystemExit(1)
+
+@ledger_cli.command('checkpoint')
+@click.option('--at', callback=parse_date,
+              help='Checkpoint time (YYYY-MM-DD[THH:MM]; default: midnight UTC today).')
+@click.option('--prune-before', callback=parse_date,
+              help='Also delete checkpoints older than this (YYYY-MM-DD).')
+def checkpoint(at, prune_before):
+    """Store every product's stock and value at a point in time for as-of reports."""
+    if at is None:
+        at = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    try:
+        summary = build_checkpoint(at)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    base = summary['base'].isoformat() if summary['base'] else 'a full replay'
+    click.echo(f"Checkpoint {at.isoformat()} ({summary['method']}): {summary['products']} products, "
+               f"built from {base}")
+    if prune_before:
+        click.echo(f'Pruned {prune_checkpoints(prune_before)} checkpoint rows')
+    for as_of, method, count, value in list_checkpoints():
+        click.echo(f'{as_of.isoformat()} {method}: {count} products, value {float(value or 0):.2f}')
+
+
+@valuation_cli.command('check')
+@click.option('--fix', is_flag=True, help='Rebuild cost layers and valuations from the ledger.')
+def valuation_check(fix):
+    """Recompute valuations from the live ledger and report drift."""
+    ensure_schema()
+    report = audit_valuation(fix=fix)
+    for mismatch in report['mismatches']:
+        click.echo(f"Product {mismatch['product_id']}: stored {mismatch['stored_quantity']} units "
+                   f"/ {mismatch['stored_value']:.4f}, expected {mismatch['expected_quantity']} units "
+                   f"/ {mismatch['expected_value']:.4f}")
+    click.echo(f"Checked {report['products_checked']} products ({report['method']}): "
+               f"{report['mismatch_count']} mismatches{' rebuilt' if fix else ''}")
+    if report['mismatch_count'] and not fix:
+        raise SystemExit(1)
@@ -0,0 +1,208 @@
+import threading
+import time
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select
+from app import db
+from app.models import Product, Supplier, InventoryTransaction, InventoryValuation
+
+products = Product.__table__
+suppliers = Supplier.__table__
+transactions = InventoryTransaction.__table__
+valuations = InventoryValuation.__table__
+
+EPOCH = np.datetime64('1970-01-01T00:00:00', 'us')
+LOW_STOCK_THRESHOLD = 20
+
+
+class LedgerColumns:
+    # Append-only columnar copy of the ledger: int32 product ids, signed
+    # int32 quantities (IN positive, OUT negative) and int64 microsecond
+    # timestamps, 16 bytes per row. Capacity doubles as rows are appended.
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.product_ids = np.empty(capacity, dtype=np.int32)
+        self.quantities = np.empty(capacity, dtype=np.int32)
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+
+    def append(self, rows):
+        if not rows:
+            return
+        needed = self.size + len(rows)
+        if needed > len(self.product_ids):
+            capacity = max(needed, 2 * len(self.product_ids))
+            for name in ('product_ids', 'quantities', 'timestamps'):
+                grown = np.empty(capacity, dtype=getattr(self, name).dtype)
+                grown[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, grown)
+        product_ids, quantities, dates = zip(*rows)
+        end = self.size + len(rows)
+        self.product_ids[self.size:end] = product_ids
+        self.quantities[self.size:end] = quantities
+        self.timestamps[self.size:end] = (np.array(dates, dtype='datetime64[us]') - EPOCH).astype(np.int64)
+        self.size = end
+
+    def view(self):
+        # Arrays up to the current size; later appends never touch them
+        return self.product_ids[:self.size], self.quantities[:self.size], self.timestamps[:self.size]
+
+
+class ProductColumns:
+    # Product attributes aligned by position, reloaded in full on each refresh
+    def __init__(self, rows, supplier_rows):
+        self.ids = np.array([r[0] for r in rows], dtype=np.int64)
+        self.names = [r[1] for r in rows]
+        self.skus = [r[2] for r in rows]
+        codes = {}
+        self.category_codes = np.array([codes.setdefault(r[3], len(codes)) for r in rows], dtype=np.int64)
+        self.categories = list(codes)
+        self.supplier_ids = np.array([r[4] for r in rows], dtype=np.int64)
+        self.is_active = np.array([bool(r[5]) for r in rows], dtype=bool)
+        self.valued_quantity = np.array([r[6] or 0 for r in rows], dtype=np.int64)
+        self.value = np.array([float(r[7] or 0) for r in rows], dtype=np.float64)
+        self.suppliers = supplier_rows
+
+
+class LedgerSnapshot:
+    # Per-worker in-memory analytics engine. Each refresh appends ledger rows
+    # with an id above the last one loaded and reloads the (much smaller)
+    # product attributes. A row count that no longer matches means rows were
+    # deleted (purges, archiving) or committed out of id order, and the
+    # ledger is reloaded in full. Within `interval` seconds of a refresh the
+    # same arrays are served again.
+    def __init__(self, interval=0, chunk_size=50000):
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self.ledger = LedgerColumns()
+        self.last_id = 0
+        self._state = None
+        self._refreshed_at = None
+
+    def _load_ledger(self):
+        t = transactions.c
+        signed = db.case((t.transaction_type == 'IN', t.quantity), else_=-t.quantity)
+        while True:
+            rows = db.session.execute(
+                select(t.id, t.product_id, signed, t.transaction_date)
+                .where(t.id > self.last_id).order_by(t.id).limit(self.chunk_size)
+            ).all()
+            if not rows:
+                return
+            self.ledger.append([r[1:] for r in rows])
+            self.last_id = rows[-1][0]
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and self._state is not None and time.monotonic() - self._refreshed_at < self.interval:
+                return self._state
+            self._load_ledger()
+            # Rows added since the load above are picked up next time
+            loaded = db.session.execute(
+                select(func.count()).select_from(transactions).where(transactions.c.id <= self.last_id)
+            ).scalar()
+            if loaded != self.ledger.size:
+                self.ledger = LedgerColumns(max(1024, loaded))
+                self.last_id = 0
+                self._load_ledger()
+            product_rows = db.session.execute(
+                select(products.c.id, products.c.name, products.c.sku, products.c.category, products.c.supplier_id,
+                       products.c.is_active, valuations.c.quantity, valuations.c.total_value)
+                .select_from(products.outerjoin(valuations, valuations.c.product_id == products.c.id))
+                .order_by(products.c.id)
+            ).all()
+            supplier_rows = db.session.execute(select(suppliers.c.id, suppliers.c.name)).all()
+            self._state = (self.ledger.view(), ProductColumns(product_rows, supplier_rows))
+            self._refreshed_at = time.monotonic()
+            return self._state
+
+    # Each query works on one refresh's arrays, so a concurrent refresh
+    # cannot change the data underneath it.
+
+    @staticmethod
+    def _per_product(ledger_ids, weights, product_ids):
+        # Sums weights per product id with a dense bincount, then picks out
+        # the known products (rows for deleted products are dropped, as the
+        # SQL joins do)
+        size = int(max(product_ids.max(initial=0), ledger_ids.max(initial=0))) + 1
+        return np.bincount(ledger_ids, weights=weights, minlength=size)[product_ids]
+
+    def stock_levels(self):
+        (ledger_ids, quantities, _), catalog = self.refresh()
+        stock = self._per_product(ledger_ids, quantities, catalog.ids).astype(np.int64)
+        return catalog, stock
+
+    def top_selling(self, archived=None, limit=10):
+        (ledger_ids, quantities, _), catalog = self.refresh()
+        outs = np.where(quantities < 0, -quantities, 0)
+        sold = self._per_product(ledger_ids, outs, catalog.ids).astype(np.int64)
+        has_outs = self._per_product(ledger_ids, (quantities < 0).astype(np.int64), catalog.ids) > 0
+        if archived:
+            positions = {product_id: i for i, product_id in enumerate(catalog.ids.tolist())}
+            extra = {}
+            for product_id, (_, archived_outs) in archived.items():
+                if not archived_outs:
+                    continue
+                if product_id in positions:
+                    sold[positions[product_id]] += archived_outs
+                    has_outs[positions[product_id]] = True
+                else:
+                    extra[product_id] = archived_outs
+        candidates = np.flatnonzero(has_outs)
+        order = candidates[np.argsort(-sold[candidates], kind='stable')][:limit]
+        top = [{'name': catalog.names[i], 'total_sold': int(sold[i])} for i in order]
+        if archived and extra:
+            # Archived products no longer in the catalog keep their totals
+            top += [{'name': None, 'total_sold': n} for n in extra.values()]
+            top = sorted(top, key=lambda item: item['total_sold'], reverse=True)[:limit]
+        return top
+
+    def low_stock(self, threshold=LOW_STOCK_THRESHOLD):
+        catalog, stock = self.stock_levels()
+        picked = np.flatnonzero(catalog.is_active & (stock < threshold))
+        picked = picked[np.argsort(stock[picked], kind='stable')]
+        return [{'name': catalog.names[i], 'sku': catalog.skus[i], 'stock': int(stock[i])} for i in picked]
+
+    def stock_value(self):
+        _, catalog = self.refresh()
+        return float(catalog.value.sum())
+
+    def stock_by_category(self):
+        _, catalog = self.refresh()
+        active = catalog.is_active
+        codes = catalog.category_codes[active]
+        size = len(catalog.categories)
+        counts = np.bincount(codes, minlength=size)
+        units = np.bincount(codes, weights=catalog.valued_quantity[active], minlength=size)
+        values = np.bincount(codes, weights=catalog.value[active], minlength=size)
+        order = [code for code in np.argsort(-values, kind='stable') if counts[code]]
+        return [{
+            'category': catalog.categories[code],
+            'product_count': int(counts[code]),
+            'total_units': int(units[code]),
+            'total_value': float(values[code])
+        } for code in order]
+
+    def products_by_supplier(self):
+        catalog, stock = self.stock_levels()
+        active = catalog.is_active
+        supplier_ids = catalog.supplier_ids[active]
+        size = int(max(supplier_ids.max(initial=0), max((s[0] for s in catalog.suppliers), default=0))) + 1
+        counts = np.bincount(supplier_ids, minlength=size)
+        totals = np.bincount(supplier_ids, weights=stock[active], minlength=size)
+        rows = [(supplier_id, name) for supplier_id, name in catalog.suppliers if counts[supplier_id]]
+        rows.sort(key=lambda row: counts[row[0]], reverse=True)
+        return [{
+            'supplier': name,
+            'product_count': int(counts[supplier_id]),
+            'total_stock': int(totals[supplier_id])
+        } for supplier_id, name in rows]
+
+
+def ledger_snapshot():
+    app = current_app
+    snapshot = app.extensions.get('ledger_snapshot')
+    if snapshot is None:
+        snapshot = app.extensions.setdefault('ledger_snapshot',
+                                             LedgerSnapshot(app.config['ANALYTICS_REFRESH_INTERVAL']))
+    return snapshot
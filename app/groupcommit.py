@@ -0,0 +1,193 @@
+import os
+import queue
+import threading
+import time
+from flask import current_app
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.catalog import catalog
+from app.idempotency import defer_key, complete_key, hold_key, store_key
+from app.metrics import metrics
+from app.models import InventoryTransaction
+from app.sqlite import IMMEDIATE_OPTION
+
+
+class PendingWrite:
+    __slots__ = ('values', 'enqueued', 'done', 'result', 'error', 'claim')
+
+    def __init__(self, values, claim):
+        self.values = values
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # The request's Idempotency-Key, completed by the flusher; cleared
+        # once its response is stored
+        self.claim = claim
+
+
+class GroupCommitter:
+    # Per-worker group commit for ledger inserts. Request threads queue a
+    # validated movement and wait; one flusher thread takes up to
+    # `max_batch` of them, waiting at most `max_wait` seconds after the
+    # first, and writes the batch in one transaction with one commit. The
+    # stock check for OUT movements runs inside that transaction, in queue
+    # order, so a batch can never oversell. The flusher does not survive a
+    # fork, so it is started lazily in each process.
+    def __init__(self, app, max_batch, max_wait):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_flusher(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.queue = queue.Queue()
+                threading.Thread(target=self._run, daemon=True, name='group-commit').start()
+                self._pid = os.getpid()
+
+    def submit(self, values, timeout):
+        # Returns (status, body) once the batch holding this write committed
+        self._ensure_flusher()
+        # End the request's own transaction first: on SQLite a write request
+        # begins IMMEDIATE and would hold the lock the flusher needs
+        db.session.rollback()
+        write = PendingWrite(values, defer_key())
+        self.queue.put(write)
+        if not write.done.wait(timeout):
+            if write.claim is None:
+                # Without a key no retry can learn whether it was recorded
+                return 503, {'message': 'Transaction not confirmed in time and may still be recorded; '
+                                        'send an Idempotency-Key to retry safely'}
+            # Not a 5xx: the write may still commit, and a retry with the
+            # same Idempotency-Key gets its outcome instead of a duplicate
+            return 202, {'message': 'Transaction queued but not yet confirmed; retry with the same '
+                                    'Idempotency-Key for the result'}
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = batch[0].enqueued + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Nothing may end this thread: every write must still be answered
+            try:
+                with self.app.app_context():
+                    self._flush(batch)
+            except Exception as e:
+                self.app.logger.exception('Group commit of %d transactions failed', len(batch))
+                for write in batch:
+                    if write.result is None and write.error is None:
+                        write.error = e
+            try:
+                with self.app.app_context():
+                    self._finish(batch)
+            except Exception:
+                self.app.logger.exception('Completing idempotency keys of a group commit failed')
+
+    def _finish(self, batch):
+        # Keys of writes that committed nothing; stored before the requests
+        # are released, so an immediate retry is replayed rather than refused
+        try:
+            for write in batch:
+                if write.claim is not None:
+                    complete_key(write.claim, *(write.result if write.error is None else (500, None)))
+        finally:
+            for write in batch:
+                write.done.set()
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            self._commit(batch)
+        except IntegrityError:
+            # A product was deleted after validation; retry one by one so
+            # only its writes fail
+            db.session.rollback()
+            if len(batch) == 1:
+                catalog().discard([batch[0].values['product_id']])
+                batch[0].result = (404, {'message': 'Product not found'})
+            else:
+                for write in batch:
+                    self._flush([write])
+                return
+        except Exception as e:
+            db.session.rollback()
+            self.app.logger.exception('Group commit of %d transactions failed', len(batch))
+            metrics().incr('group_commit.failed_batches')
+            for write in batch:
+                write.error = e
+        finally:
+            db.session.remove()
+
+        done = time.perf_counter()
+        stats = metrics()
+        stats.observe('group_commit.batch_size', len(batch))
+        stats.observe('group_commit.commit_ms', round((done - started) * 1000, 3))
+        for write in batch:
+            # Time from queueing to acknowledgement, the latency group commit adds
+            stats.observe('group_commit.wait_ms', round((done - write.enqueued) * 1000, 3))
+
+    def _commit(self, batch):
+        t = InventoryTransaction
+        db.session.connection(execution_options={IMMEDIATE_OPTION: True})
+        outs = {w.values['product_id'] for w in batch if w.values['transaction_type'] == 'OUT'}
+        stock = {}
+        if outs:
+            signed = db.case((t.transaction_type == 'IN', t.quantity), else_=-t.quantity)
+            stock = dict(db.session.execute(
+                select(t.product_id, func.sum(signed)).where(t.product_id.in_(outs)).group_by(t.product_id)
+            ).all())
+        accepted = []
+        for write in batch:
+            if write.claim is not None and not hold_key(write.claim):
+                # A retry took the key over after its lease ran out; it owns the write now
+                write.claim = None
+                write.result = (409, {'message': 'A request with this Idempotency-Key is still in progress'})
+                continue
+            values = write.values
+            product_id, quantity = values['product_id'], values['quantity']
+            if values['transaction_type'] == 'OUT':
+                if (stock.get(product_id) or 0) < quantity:
+                    write.result = (400, {'message': 'Insufficient stock'})
+                    metrics().incr('group_commit.rejected')
+                    continue
+                stock[product_id] = (stock.get(product_id) or 0) - quantity
+            elif product_id in outs:
+                stock[product_id] = (stock.get(product_id) or 0) + quantity
+            trans = t(**values)
+            db.session.add(trans)
+            accepted.append((write, trans))
+        db.session.flush()
+        results = [(write, (201, {'message': 'Transaction recorded', 'id': trans.id})) for write, trans in accepted]
+        results += [(write, write.result) for write in batch if write.result is not None and write.claim is not None]
+        # Responses are committed with the rows, so a retry never writes twice
+        for write, result in results:
+            if write.claim is not None:
+                store_key(write.claim, *result)
+        db.session.commit()
+        for write, result in results:
+            write.result = result
+            write.claim = None
+
+
+def group_committer():
+    app = current_app._get_current_object()
+    committer = app.extensions.get('group_commit')
+    if committer is None:
+        committer = app.extensions.setdefault('group_commit', GroupCommitter(
+            app, app.config['GROUP_COMMIT_MAX_BATCH'], app.config['GROUP_COMMIT_MAX_WAIT_MS'] / 1000))
+    return committer
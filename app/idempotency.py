@@ -0,0 +1,174 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, jsonify, current_app, make_response, g
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+_prune_lock = threading.Lock()
+_last_prune = [0.0]
+
+def prune_keys():
+    # Drop expired keys, then trim the oldest rows beyond IDEMPOTENCY_MAX_KEYS
+    now = datetime.utcnow()
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now))
+    cutoff = db.session.execute(
+        select(IdempotencyKey.id).order_by(IdempotencyKey.id.desc())
+        .offset(current_app.config['IDEMPOTENCY_MAX_KEYS']).limit(1)
+    ).scalar()
+    if cutoff is not None:
+        db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id <= cutoff))
+    db.session.commit()
+
+def _maybe_prune():
+    interval = current_app.config['IDEMPOTENCY_PRUNE_INTERVAL']
+    with _prune_lock:
+        if time.monotonic() - _last_prune[0] < interval:
+            return
+        _last_prune[0] = time.monotonic()
+    prune_keys()
+
+def _replay(record):
+    response = make_response(record.response_body, record.response_code)
+    response.mimetype = 'application/json'
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def _existing_response(record, request_hash):
+    if record.request_hash != request_hash:
+        return jsonify({'message': 'Idempotency-Key was already used with a different request'}), 422
+    if record.status != 'completed':
+        return jsonify({'message': 'A request with this Idempotency-Key is still in progress'}), 409
+    return _replay(record)
+
+def _take_over(record, request_hash):
+    # A claim older than the lease was left by a worker that died mid-request;
+    # re-claim it so retries do not get 409 until the key expires. The old
+    # claimant, if still alive, can no longer store its response, and so
+    # cannot commit its write either (see commit_response).
+    lease = timedelta(seconds=current_app.config['IDEMPOTENCY_LEASE_SECONDS'])
+    now = datetime.utcnow()
+    if record.status != 'in_progress' or record.request_hash != request_hash or record.created_at > now - lease:
+        return None
+    claimed = db.session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.id == record.id, IdempotencyKey.status == 'in_progress',
+               IdempotencyKey.created_at == record.created_at)
+        .values(created_at=now)
+    ).rowcount
+    db.session.commit()
+    return now if claimed else None
+
+def _store(claim, status, response_body):
+    # Writes the response onto the key in the caller's transaction, as long
+    # as the claim still belongs to this request; returns whether it did
+    key_id, claimed_at = claim
+    if status >= 500:
+        # Server errors are not replayed so the client can retry for real
+        return db.session.execute(delete(IdempotencyKey).where(
+            IdempotencyKey.id == key_id, IdempotencyKey.created_at == claimed_at)).rowcount
+    return db.session.execute(update(IdempotencyKey).where(
+        IdempotencyKey.id == key_id, IdempotencyKey.created_at == claimed_at
+    ).values(status='completed', response_code=status, response_body=response_body)).rowcount
+
+def commit_response(body, status):
+    # Commits the handler's write together with the response stored on the
+    # request's Idempotency-Key, so a crash cannot leave one without the other
+    claim = g.get('idempotency_claim')
+    if claim is not None:
+        if not _store(claim, status, json.dumps(body)):
+            db.session.rollback()
+            return jsonify({'message': 'A request with this Idempotency-Key is still in progress'}), 409
+        g.idempotency_completed = True
+    db.session.commit()
+    return jsonify(body), status
+
+def defer_key():
+    # Hands the current request's key to a background writer that finishes
+    # after the response is sent; it must call store_key() or complete_key().
+    # Returns the key's claim, or None when the request carried no key.
+    claim = g.get('idempotency_claim')
+    if claim is not None:
+        g.idempotency_deferred = True
+    return claim
+
+def hold_key(claim):
+    # Locks a deferred request's key for the writer's transaction, before it
+    # writes anything; False if a retry has taken the claim over since
+    key_id, claimed_at = claim
+    return bool(db.session.execute(update(IdempotencyKey).where(
+        IdempotencyKey.id == key_id, IdempotencyKey.created_at == claimed_at,
+        IdempotencyKey.status == 'in_progress'
+    ).values(created_at=claimed_at)).rowcount)
+
+def store_key(claim, status, body):
+    # Stores the final response of a deferred request in the writer's open
+    # transaction; the writer commits it with its own rows
+    return _store(claim, status, json.dumps(body))
+
+def complete_key(claim, status, body):
+    # Same, for a deferred request that wrote nothing
+    store_key(claim, status, body)
+    db.session.commit()
+
+def idempotent(f):
+    # Must sit below token_required: keys are scoped to the authenticated user
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return f(current_user, *args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'message': 'Idempotency-Key is too long'}), 400
+
+        _maybe_prune()
+        scope = f'{request.method} {request.path}'
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+        lookup = dict(user_id=current_user.id, scope=scope, key=key)
+
+        record = IdempotencyKey.query.filter_by(**lookup).first()
+        if record is not None and record.expires_at <= datetime.utcnow():
+            db.session.delete(record)
+            db.session.commit()
+            record = None
+        if record is not None:
+            claimed_at = _take_over(record, request_hash)
+            if claimed_at is None:
+                return _existing_response(record, request_hash)
+        else:
+            ttl = timedelta(seconds=current_app.config['IDEMPOTENCY_TTL_SECONDS'])
+            claimed_at = datetime.utcnow()
+            record = IdempotencyKey(request_hash=request_hash, status='in_progress', created_at=claimed_at,
+                                    expires_at=claimed_at + ttl, **lookup)
+            db.session.add(record)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another worker claimed the key between our lookup and insert
+                db.session.rollback()
+                return _existing_response(IdempotencyKey.query.filter_by(**lookup).first(), request_hash)
+        claim = g.idempotency_claim = (record.id, claimed_at)
+
+        try:
+            response = make_response(f(current_user, *args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            _store(claim, 500, None)
+            db.session.commit()
+            raise
+
+        if g.get('idempotency_deferred') or g.get('idempotency_completed'):
+            # Stored with the write, or left to the writer that took it over
+            return response
+        _store(claim, response.status_code, response.get_data(as_text=True))
+        db.session.commit()
+        return response
+
+    return decorated
@@ -0,0 +1,306 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, update, inspect, text
+from app import db
+from app.models import Job
+
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+ORPHANED_ERROR = 'Worker stopped before the job finished'
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    def __init__(self, runner, app, job_id, params):
+        self.runner = runner
+        self.app = app
+        self.job_id = job_id
+        self.params = params
+        self.result_path = None
+        self.result_mimetype = None
+        self._last_write = 0.0
+
+    def progress(self, done, total=None, message=None, force=False):
+        # Progress goes through its own connection so handlers can keep
+        # a transaction open; writes are throttled to JOB_PROGRESS_INTERVAL.
+        self.check_cancelled()
+        now = time.monotonic()
+        if not force and now - self._last_write < self.app.config['JOB_PROGRESS_INTERVAL']:
+            return
+        self._last_write = now
+        values = {'progress': min(float(done) / total, 1.0) if total else 0.0}
+        if message is not None:
+            values['message'] = message[:255]
+        with db.engine.begin() as conn:
+            conn.execute(update(Job).where(Job.id == self.job_id).values(**values))
+            cancelled = conn.execute(
+                db.select(Job.cancel_requested).where(Job.id == self.job_id)
+            ).scalar()
+        if cancelled:
+            self.runner._cancel_events[self.job_id].set()
+            self.check_cancelled()
+
+    def check_cancelled(self):
+        if self.runner._cancel_events[self.job_id].is_set():
+            raise JobCancelled()
+
+    def open_result(self, extension, mimetype, mode='w'):
+        self.result_path = os.path.join(self.runner.results_dir(self.app), f'{self.job_id}.{extension}')
+        self.result_mimetype = mimetype
+        return open(self.result_path, mode, newline='' if 'b' not in mode else None)
+
+
+class JobRunner:
+    def __init__(self, app=None):
+        self._types = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._worker_id = None
+        self._monitor_pid = None
+        self._monitor_app = None
+        self._running = defaultdict(int)
+        self._queued = defaultdict(deque)
+        self._cancel_events = defaultdict(threading.Event)
+        self._periodic = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOB_WORKERS', 4)
+        app.config.setdefault('JOB_CONCURRENCY_LIMITS', {})
+        app.config.setdefault('JOB_PROGRESS_INTERVAL', 0.5)
+        app.config.setdefault('JOB_RESULTS_DIR', None)
+        app.config.setdefault('JOB_HEARTBEAT_INTERVAL', 10)
+        app.config.setdefault('JOB_LEASE_TIMEOUT', 60)
+        app.extensions['job_runner'] = self
+        app.before_request(self._start)
+
+    def job_type(self, name, limit=1):
+        def decorator(f):
+            self._types[name] = (f, limit)
+            return f
+        return decorator
+
+    def periodic(self, f):
+        # f(app) runs in every worker's heartbeat thread, after the leases
+        self._periodic.append(f)
+        return f
+
+    def has_type(self, name):
+        return name in self._types
+
+    def limit_for(self, app, job_type):
+        return app.config['JOB_CONCURRENCY_LIMITS'].get(job_type, self._types[job_type][1])
+
+    def results_dir(self, app):
+        path = app.config['JOB_RESULTS_DIR'] or os.path.join(app.instance_path, 'job_results')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _get_executor(self, app):
+        # Pools don't survive fork, so each worker process builds its own lazily
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'],
+                                                thread_name_prefix='job')
+            self._pid = os.getpid()
+            # The pid alone could be reused by a later process on the same host
+            self._worker_id = f'{socket.gethostname()[:40]}:{self._pid}:{uuid.uuid4().hex[:8]}'
+            self._running.clear()
+            self._queued.clear()
+        return self._executor
+
+    def submit(self, job_type, params=None, user_id=None):
+        if job_type not in self._types:
+            raise KeyError(job_type)
+        app = current_app._get_current_object()
+        with self._lock:
+            self._get_executor(app)
+        job = Job(
+            id=uuid.uuid4().hex,
+            job_type=job_type,
+            status='queued',
+            params=json.dumps(params or {}),
+            created_by=user_id,
+            worker=self._worker_id,
+            heartbeat_at=datetime.utcnow()
+        )
+        db.session.add(job)
+        db.session.commit()
+        self._enqueue(app, job.id, job_type)
+        return job
+
+    def _enqueue(self, app, job_id, job_type):
+        with self._lock:
+            executor = self._get_executor(app)
+            if self._running[job_type] < self.limit_for(app, job_type):
+                self._running[job_type] += 1
+                executor.submit(self._run, app, job_id, job_type)
+            else:
+                self._queued[job_type].append((app, job_id))
+
+    def cancel(self, job_id):
+        job = db.session.get(Job, job_id)
+        if job is None or job.status in FINISHED_STATUSES:
+            return job
+        # Queued jobs are cancelled outright; running ones stop at their next progress check
+        result = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'queued')
+            .values(status='cancelled', cancel_requested=True, finished_at=datetime.utcnow())
+        )
+        if result.rowcount == 0:
+            job.cancel_requested = True
+        db.session.commit()
+        event = self._cancel_events.get(job_id)
+        if event is not None:
+            event.set()
+        db.session.refresh(job)
+        return job
+
+    # ==================== LEASES ====================
+
+    # Queued jobs live only in the deque of the process that took them, so
+    # every process renews a lease on its jobs. A job whose lease ran out
+    # was left behind by a stopped worker: a queued one is claimed and run
+    # here, a running one is failed since its handler may have stopped
+    # half-way. JOB_LEASE_TIMEOUT must be well above JOB_HEARTBEAT_INTERVAL.
+
+    def _start(self):
+        # Runs before each request; the first one in a process recovers what
+        # earlier workers left and starts the heartbeat (threads don't
+        # survive fork, so this happens per process)
+        app = current_app._get_current_object()
+        if self._monitor_pid == os.getpid() and self._monitor_app is app:
+            return
+        with self._lock:
+            self._get_executor(app)
+            self._monitor_app = app
+            if self._monitor_pid != os.getpid():
+                threading.Thread(target=self._monitor, daemon=True, name='job-heartbeat').start()
+                self._monitor_pid = os.getpid()
+        self.recover(app)
+
+    def _monitor(self):
+        while True:
+            app = self._monitor_app
+            time.sleep(app.config['JOB_HEARTBEAT_INTERVAL'])
+            try:
+                with app.app_context():
+                    self.heartbeat()
+                    self.recover(app)
+            except Exception:
+                app.logger.exception('Job heartbeat failed')
+            for task in self._periodic:
+                try:
+                    with app.app_context():
+                        task(app)
+                except Exception:
+                    app.logger.exception(f'Periodic task {task.__name__} failed')
+
+    def heartbeat(self):
+        with db.engine.begin() as conn:
+            conn.execute(update(Job).where(Job.worker == self._worker_id, Job.status.in_(('queued', 'running')))
+                         .values(heartbeat_at=datetime.utcnow()))
+
+    def recover(self, app):
+        # Returns (requeued, failed) job counts
+        now = datetime.utcnow()
+        expired = db.or_(Job.heartbeat_at.is_(None),
+                         Job.heartbeat_at < now - timedelta(seconds=app.config['JOB_LEASE_TIMEOUT']))
+        with db.engine.begin() as conn:
+            failed = conn.execute(
+                update(Job).where(Job.status == 'running', expired)
+                .values(status='failed', error=ORPHANED_ERROR, finished_at=now)
+            ).rowcount
+            orphans = conn.execute(select(Job.id, Job.job_type).where(Job.status == 'queued', expired)).all()
+        requeued = 0
+        for job_id, job_type in orphans:
+            values = {'worker': self._worker_id, 'heartbeat_at': now}
+            if job_type not in self._types:
+                values.update(status='failed', error=f'Unknown job type: {job_type}', finished_at=now)
+            # Only one process wins the claim when several recover at once
+            with db.engine.begin() as conn:
+                claimed = conn.execute(
+                    update(Job).where(Job.id == job_id, Job.status == 'queued', expired).values(**values)
+                ).rowcount
+            if claimed and job_type in self._types:
+                self._enqueue(app, job_id, job_type)
+                requeued += 1
+            elif claimed:
+                failed += 1
+        if requeued or failed:
+            app.logger.warning('Recovered jobs left by stopped workers: %d requeued, %d failed', requeued, failed)
+        return requeued, failed
+
+    def _release(self, job_type):
+        with self._lock:
+            self._running[job_type] -= 1
+            if self._queued[job_type]:
+                app, job_id = self._queued[job_type].popleft()
+                self._running[job_type] += 1
+                self._executor.submit(self._run, app, job_id, job_type)
+
+    def _run(self, app, job_id, job_type):
+        try:
+            with app.app_context():
+                try:
+                    self._execute(app, job_id, job_type)
+                finally:
+                    db.session.remove()
+        finally:
+            self._cancel_events.pop(job_id, None)
+            self._release(job_type)
+
+    def _execute(self, app, job_id, job_type):
+        started = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'queued', Job.cancel_requested.is_(False))
+            .values(status='running', started_at=datetime.utcnow(), worker=self._worker_id,
+                    heartbeat_at=datetime.utcnow())
+        )
+        db.session.commit()
+        if started.rowcount == 0:
+            return
+
+        job = db.session.get(Job, job_id)
+        handler = self._types[job_type][0]
+        ctx = JobContext(self, app, job_id, json.loads(job.params or '{}'))
+        values = {}
+        try:
+            result = handler(ctx, ctx.params)
+            if result is not None and ctx.result_path is None:
+                with ctx.open_result('json', 'application/json') as f:
+                    json.dump(result, f, default=str)
+            values.update(status='succeeded', progress=1.0, result_path=ctx.result_path,
+                          result_mimetype=ctx.result_mimetype)
+        except JobCancelled:
+            db.session.rollback()
+            values.update(status='cancelled')
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception(f'Job {job_id} ({job_type}) failed')
+            values.update(status='failed', error=str(e))
+        values['finished_at'] = datetime.utcnow()
+        db.session.execute(update(Job).where(Job.id == job_id).values(**values))
+        db.session.commit()
+
+
+def ensure_schema():
+    # Databases created before job leases lack the jobs' lease columns
+    columns = {c['name'] for c in inspect(db.engine).get_columns(Job.__tablename__)}
+    for name, kind in (('worker', 'VARCHAR(64)'), ('heartbeat_at', 'TIMESTAMP')):
+        if name not in columns:
+            db.session.execute(text(f'ALTER TABLE {Job.__tablename__} ADD COLUMN {name} {kind}'))
+    db.session.commit()
+
+
+job_runner = JobRunner()
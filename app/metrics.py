@@ -0,0 +1,32 @@
+import threading
+from flask import current_app
+
+
+class Metrics:
+    # Per-worker counters; each gunicorn worker reports its own numbers
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        # Running count, sum and max of a measurement, e.g. a batch size
+        with self._lock:
+            self._counters[f'{name}.count'] = self._counters.get(f'{name}.count', 0) + 1
+            self._counters[f'{name}.sum'] = self._counters.get(f'{name}.sum', 0) + value
+            self._counters[f'{name}.max'] = max(self._counters.get(f'{name}.max', value), value)
+
+    def get(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+
+def metrics():
+    return current_app.extensions.setdefault('metrics', Metrics())
@@ -30,17 +30,139 @@ class Product(db.Model):
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    transactions = db.relationship('InventoryTransaction', backref='product', lazy=True)
+    # The database cascades ledger rows on delete; the ORM must never load them to do it
+    transactions = db.relationship('InventoryTransaction', backref='product', lazy=True, passive_deletes=True)
 
 class InventoryTransaction(db.Model):
     __tablename__ = 'inventory_transactions'
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     transaction_type = db.Column(db.String(3), nullable=False)
     transaction_date = db.Column(db.DateTime, default=datetime.utcnow)
     notes = db.Column(db.Text)
+    unit_cost = db.Column(db.Numeric(12, 4))
+    # Opening balance carried forward by an archive or detach; the API never sets it
+    is_opening = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     
     __table_args__ = (
         db.CheckConstraint("transaction_type IN ('IN', 'OUT')", name='check_transaction_type'),
+        db.Index('idx_transactions_product', 'product_id'),
+        db.Index('idx_transactions_date', 'transaction_date'),
+        db.Index('idx_transactions_prod_date', 'product_id', 'transaction_date'),
     )
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = db.Column(db.String(32), primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    params = db.Column(db.Text)
+    progress = db.Column(db.Float, default=0.0, nullable=False)
+    message = db.Column(db.String(255))
+    cancel_requested = db.Column(db.Boolean, default=False, nullable=False)
+    result_path = db.Column(db.String(255))
+    result_mimetype = db.Column(db.String(100))
+    error = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # Process that holds the job and when it last renewed its lease
+    worker = db.Column(db.String(64))
+    heartbeat_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('idx_jobs_status', 'status'),
+    )
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    scope = db.Column(db.String(120), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='in_progress')
+    response_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'scope', 'key', name='uq_idempotency_key'),
+    )
+
+class CostLayer(db.Model):
+    __tablename__ = 'cost_layers'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    # No FK: a partitioned ledger's primary key also includes transaction_date
+    transaction_id = db.Column(db.Integer)
+    received_at = db.Column(db.DateTime, nullable=False)
+    unit_cost = db.Column(db.Numeric(12, 4), nullable=False)
+    quantity_received = db.Column(db.Integer, nullable=False)
+    quantity_remaining = db.Column(db.Integer, nullable=False)
+    
+    __table_args__ = (
+        db.Index('idx_cost_layers_open', 'product_id', 'quantity_remaining', 'received_at'),
+    )
+
+class InventoryValuation(db.Model):
+    __tablename__ = 'inventory_valuations'
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    total_value = db.Column(db.Numeric(16, 4), nullable=False, default=0)
+    last_unit_cost = db.Column(db.Numeric(12, 4))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StockCheckpoint(db.Model):
+    __tablename__ = 'stock_checkpoints'
+    # Per-product valuation state at `as_of`; as-of reports start from the
+    # latest checkpoint and replay only the movements after it
+    as_of = db.Column(db.DateTime, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    method = db.Column(db.String(10), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    total_value = db.Column(db.Numeric(16, 4), nullable=False)
+    last_unit_cost = db.Column(db.Numeric(12, 4))
+    # JSON [[unit_cost, remaining], ...] of the open cost layers, oldest first
+    layers = db.Column(db.Text, nullable=False, default='[]')
+
+class ArchiveFile(db.Model):
+    __tablename__ = 'archive_files'
+    # Ledger archive files, registered in the transaction that deletes their
+    # rows from the ledger; readers ignore any file not listed here
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False, unique=True)
+    cutoff = db.Column(db.DateTime, nullable=False)
+    rows = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Change(db.Model):
+    __tablename__ = 'changes'
+    # Latest change of each synced row ('product', 'supplier' or 'stock');
+    # seq is assigned after commit, in order, and deleted rows stay as tombstones
+    entity = db.Column(db.String(20), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+    seq = db.Column(db.BigInteger, nullable=False)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_changes_seq', 'seq', unique=True),
+    )
+
+class ChangeCounter(db.Model):
+    __tablename__ = 'change_counter'
+    # Single row holding the last change sequence number handed out
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+class PendingChange(db.Model):
+    __tablename__ = 'change_pending'
+    # Committed changes not yet given a seq; moved into `changes` in order
+    entity = db.Column(db.String(20), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
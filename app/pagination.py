@@ -0,0 +1,95 @@
+import base64
+import json
+import math
+import threading
+import time
+from flask import current_app
+from sqlalchemy import text, select, func
+from app import db
+
+COUNT_MODES = ('exact', 'cached', 'estimate', 'none')
+
+
+class CountCache:
+    # Per-worker TTL cache of exact COUNT(*) results, keyed by list + filter
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+
+    def invalidate(self, prefix):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == prefix]:
+                del self._entries[key]
+
+
+def count_cache():
+    return current_app.extensions.setdefault('count_cache', CountCache())
+
+def invalidate_counts(name):
+    count_cache().invalidate(name)
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+def _estimate(stmt, table_name, filtered):
+    # Planner estimates on Postgres: table statistics when unfiltered, the
+    # top plan node's row estimate otherwise. Returns None when unavailable.
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    if not filtered:
+        rows = db.session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = :name"), {'name': table_name}
+        ).scalar()
+        return int(rows) if rows is not None and rows >= 0 else None
+    statement = stmt.order_by(None).compile(
+        dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}
+    )
+    plan = db.session.execute(text(f'EXPLAIN (FORMAT JSON) {statement}')).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def count_rows(stmt, mode, cache_key):
+    # `stmt` is the filtered Core select. Returns (total, mode actually used);
+    # total is None when mode is 'none'.
+    if mode == 'none':
+        return None, 'none'
+    if mode == 'estimate':
+        estimate = _estimate(stmt, cache_key[0], filtered=any(cache_key[1:]))
+        if estimate is not None:
+            return estimate, 'estimate'
+        mode = 'cached'
+    if mode == 'cached':
+        cached = count_cache().get(cache_key)
+        if cached is not None:
+            return cached, 'cached'
+    total = db.session.execute(select(func.count()).select_from(stmt.order_by(None).subquery())).scalar()
+    if mode == 'cached':
+        count_cache().set(cache_key, total, current_app.config['COUNT_CACHE_TTL'])
+    return total, mode
+
+def page_count(total, per_page):
+    if total is None:
+        return None
+    return math.ceil(total / per_page) if per_page else 0
@@ -0,0 +1,253 @@
+import re
+from datetime import datetime
+from sqlalchemy import text, bindparam, select, insert, delete
+from app import db
+from app.archive import fold_movements, opening_rows
+from app.models import Product, InventoryTransaction
+from app.valuation import valuation_method
+
+LEDGER_TABLE = 'inventory_transactions'
+PARTITION_PREFIX = f'{LEDGER_TABLE}_p'
+PARTITION_PATTERN = re.compile(rf'^{PARTITION_PREFIX}(\d{{4}})_(\d{{2}})$')
+LEDGER_COLUMNS = 'id, product_id, quantity, transaction_type, transaction_date, notes, unit_cost, is_opening'
+
+# Monthly range partitioning on Postgres. The primary key has to include the
+# partition key, and the id sequence is handed over from the old table.
+PG_PARTITIONED_DDL = f"""
+    CREATE TABLE {LEDGER_TABLE} (
+        id INTEGER NOT NULL DEFAULT nextval('{LEDGER_TABLE}_id_seq'),
+        product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+        quantity INTEGER NOT NULL,
+        transaction_type VARCHAR(3) NOT NULL,
+        transaction_date TIMESTAMP NOT NULL DEFAULT NOW(),
+        notes TEXT,
+        unit_cost NUMERIC(12, 4),
+        is_opening BOOLEAN NOT NULL DEFAULT FALSE,
+        CONSTRAINT {LEDGER_TABLE}_part_pkey PRIMARY KEY (id, transaction_date),
+        CONSTRAINT check_transaction_type CHECK (transaction_type IN ('IN', 'OUT'))
+    ) PARTITION BY RANGE (transaction_date)
+"""
+
+LEDGER_INDEXES = [
+    f'CREATE INDEX IF NOT EXISTS idx_transactions_product ON {LEDGER_TABLE}(product_id)',
+    f'CREATE INDEX IF NOT EXISTS idx_transactions_date ON {LEDGER_TABLE}(transaction_date)',
+    f'CREATE INDEX IF NOT EXISTS idx_transactions_prod_date ON {LEDGER_TABLE}(product_id, transaction_date)',
+]
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(month):
+    return f'{PARTITION_PREFIX}{month.year:04d}_{month.month:02d}'
+
+def partition_month(name):
+    match = PARTITION_PATTERN.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+def _is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+def is_partitioned():
+    if not _is_postgres():
+        return False
+    relkind = db.session.execute(
+        text("SELECT relkind FROM pg_class WHERE relname = :name AND relkind IN ('r', 'p')"),
+        {'name': LEDGER_TABLE}
+    ).scalar()
+    return relkind == 'p'
+
+def list_partitions():
+    # Attached partitions on Postgres, detached period tables on SQLite
+    if _is_postgres():
+        sql = text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = :name
+        """)
+        names = db.session.execute(sql, {'name': LEDGER_TABLE}).scalars()
+    else:
+        sql = text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :prefix")
+        names = db.session.execute(sql, {'prefix': f'{PARTITION_PREFIX}%'}).scalars()
+    return sorted(name for name in names if partition_month(name))
+
+def _create_pg_partition(month):
+    name = partition_name(month)
+    db.session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {LEDGER_TABLE} "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    ))
+    return name
+
+# Rebuilds the ledger as a range-partitioned table in one transaction (Postgres only)
+def convert_to_partitioned(months_ahead=3):
+    if not _is_postgres():
+        raise RuntimeError('Ledger partitioning requires PostgreSQL')
+    if is_partitioned():
+        return []
+
+    earliest = db.session.execute(text(f"SELECT MIN(transaction_date) FROM {LEDGER_TABLE}")).scalar()
+    first = month_start(earliest or datetime.utcnow())
+    last = add_months(month_start(datetime.utcnow()), months_ahead)
+
+    legacy = f'{LEDGER_TABLE}_legacy'
+    db.session.execute(text(f"ALTER SEQUENCE {LEDGER_TABLE}_id_seq OWNED BY NONE"))
+    db.session.execute(text(f"ALTER TABLE {LEDGER_TABLE} RENAME TO {legacy}"))
+    db.session.execute(text(f"ALTER TABLE {legacy} RENAME CONSTRAINT {LEDGER_TABLE}_pkey TO {legacy}_pkey"))
+    db.session.execute(text(
+        "DROP INDEX IF EXISTS idx_transactions_product, idx_transactions_date, idx_transactions_prod_date"
+    ))
+    db.session.execute(text(PG_PARTITIONED_DDL))
+
+    created = []
+    month = first
+    while month <= last:
+        created.append(_create_pg_partition(month))
+        month = add_months(month, 1)
+    # Rows outside every monthly range land here instead of failing the insert
+    db.session.execute(text(f"CREATE TABLE {LEDGER_TABLE}_default PARTITION OF {LEDGER_TABLE} DEFAULT"))
+
+    db.session.execute(text(f"""
+        INSERT INTO {LEDGER_TABLE} ({LEDGER_COLUMNS})
+        SELECT id, product_id, quantity, transaction_type, COALESCE(transaction_date, NOW()), notes, unit_cost,
+               is_opening
+        FROM {legacy}
+    """))
+    db.session.execute(text(f"ALTER SEQUENCE {LEDGER_TABLE}_id_seq OWNED BY {LEDGER_TABLE}.id"))
+    db.session.execute(text(f"DROP TABLE {legacy}"))
+    for ddl in LEDGER_INDEXES:
+        db.session.execute(text(ddl))
+    db.session.commit()
+    return created
+
+# SQLite keeps every open period in the main ledger table, so there is
+# nothing to pre-create there.
+def create_partitions(months_ahead=3):
+    if not is_partitioned():
+        return []
+    existing = set(list_partitions())
+    created = []
+    month = month_start(datetime.utcnow())
+    for _ in range(months_ahead + 1):
+        if partition_name(month) not in existing:
+            created.append(_create_pg_partition(month))
+        month = add_months(month, 1)
+    db.session.commit()
+    return created
+
+# Detaches every whole month that ends on or before `before`. Each product's
+# balance and cost basis at the cutoff are first written to the live ledger as
+# opening rows (as `ledger archive` does), so stock, valuation, reconcile and
+# as-of reports read the same after the detach. On Postgres the old months are
+# then removed with a metadata-only DETACH PARTITION, in the same transaction.
+# SQLite has no partitions: the live ledger stays one table and each closed
+# month is copied into its own period table and DELETEd from the ledger, so the
+# detach itself costs a DELETE of those rows; only dropping the period tables
+# later is cheap.
+def detach_partitions(before, drop=False, batch_products=10000):
+    cutoff = month_start(before)
+    if _is_postgres():
+        if not is_partitioned():
+            raise RuntimeError('Ledger is not partitioned; run `flask ledger partition-init` first')
+        detached = [name for name in list_partitions() if add_months(partition_month(name), 1) <= cutoff]
+        if detached:
+            for batch in _product_batches(cutoff, batch_products):
+                _carry_forward(cutoff, batch)
+        for name in detached:
+            db.session.execute(text(f"ALTER TABLE {LEDGER_TABLE} DETACH PARTITION {name}"))
+            if drop:
+                db.session.execute(text(f"DROP TABLE {name}"))
+        if detached:
+            # Older rows outside the monthly ranges (in the default partition)
+            # were carried forward as well
+            t = InventoryTransaction
+            db.session.execute(delete(t).where(t.transaction_date < cutoff))
+        db.session.commit()
+        return detached
+    return _detach_sqlite_periods(cutoff, drop, batch_products)
+
+def _product_batches(cutoff, batch_products):
+    t = InventoryTransaction
+    product_ids = db.session.execute(
+        select(t.product_id).where(t.transaction_date < cutoff).distinct().order_by(t.product_id)
+    ).scalars().all()
+    return [product_ids[i:i + batch_products] for i in range(0, len(product_ids), batch_products)]
+
+def _carry_forward(cutoff, product_ids):
+    # Adds the opening rows at `cutoff` for these products; the caller removes
+    # the older rows in the same transaction
+    t = InventoryTransaction
+    rows = db.session.execute(
+        select(t.product_id, t.quantity, t.transaction_type, t.unit_cost)
+        .where(t.transaction_date < cutoff, t.product_id.in_(product_ids))
+        .order_by(t.product_id, t.transaction_date, t.id)
+    )
+    prices = dict(db.session.execute(select(Product.id, Product.unit_price).where(Product.id.in_(product_ids))).all())
+    opening = opening_rows(fold_movements(rows, prices, valuation_method()), cutoff)
+    if opening:
+        db.session.execute(insert(t), opening)
+
+def _detach_sqlite_periods(cutoff, drop, batch_products):
+    earliest = db.session.execute(
+        text(f"SELECT MIN(transaction_date) FROM {LEDGER_TABLE} WHERE transaction_date < :cutoff")
+        .bindparams(bindparam('cutoff', type_=db.DateTime)),
+        {'cutoff': cutoff}
+    ).scalar()
+    if earliest is None:
+        return []
+    if isinstance(earliest, str):
+        earliest = datetime.fromisoformat(earliest)
+
+    # Opening rows of an earlier detach or archive are folded in, not copied
+    params = [bindparam('start', type_=db.DateTime), bindparam('end', type_=db.DateTime)]
+    where = "transaction_date >= :start AND transaction_date < :end AND NOT is_opening"
+    periods = []
+    month = month_start(earliest)
+    while month < cutoff:
+        period_range = {'start': month, 'end': add_months(month, 1)}
+        has_rows = db.session.execute(
+            text(f"SELECT 1 FROM {LEDGER_TABLE} WHERE {where} LIMIT 1").bindparams(*params), period_range
+        ).first()
+        if has_rows:
+            periods.append((partition_name(month), period_range))
+            if not drop:
+                db.session.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {partition_name(month)} AS "
+                    f"SELECT {LEDGER_COLUMNS} FROM {LEDGER_TABLE} WHERE 0"
+                ))
+        month = add_months(month, 1)
+
+    # Copy, delete and carry forward one batch of products per transaction,
+    # so every product's stock stays whole at each commit
+    in_batch = bindparam('ids', expanding=True)
+    for batch in _product_batches(cutoff, batch_products):
+        if not drop:
+            for name, period_range in periods:
+                db.session.execute(
+                    text(f"INSERT INTO {name} ({LEDGER_COLUMNS}) SELECT {LEDGER_COLUMNS} FROM {LEDGER_TABLE} "
+                         f"WHERE {where} AND product_id IN :ids").bindparams(*params, in_batch),
+                    dict(period_range, ids=batch)
+                )
+        _carry_forward(cutoff, batch)
+        t = InventoryTransaction
+        db.session.execute(delete(t).where(t.transaction_date < cutoff, t.product_id.in_(batch)))
+        db.session.commit()
+    return [name for name, _ in periods]
+
+def drop_detached(before):
+    if _is_postgres():
+        raise RuntimeError('Use detach with --drop on PostgreSQL')
+    cutoff = month_start(before)
+    dropped = []
+    for name in list_partitions():
+        if add_months(partition_month(name), 1) <= cutoff:
+            db.session.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    db.session.commit()
+    return dropped
@@ -0,0 +1,221 @@
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.auth import bearer_user
+
+MODES = ('cprofile', 'sample')
+CAPTURE_ID = re.compile(r'^[0-9a-f]{32}$')
+# cProfile allows one active profiler per process, so one capture at a time
+_capture_lock = threading.Lock()
+
+
+class StackSampler(threading.Thread):
+    # Samples one thread's Python stack at a fixed interval and counts the
+    # collapsed stacks (root;...;leaf), the input format of flamegraph tools.
+    # While the thread waits on the database the running statement is
+    # added as a leaf frame, so SQL time shows up in the graph.
+    def __init__(self, thread_id, interval, capture):
+        super().__init__(daemon=True, name='profile-sampler')
+        self.thread_id = thread_id
+        self.interval = interval
+        self.capture = capture
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            stack.reverse()
+            statement = self.capture.current_sql
+            if statement is not None:
+                stack.append('SQL ' + ' '.join(statement.split())[:80].replace(';', ','))
+            if stack:
+                self.stacks[';'.join(stack)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class Capture:
+    def __init__(self, mode, trigger, interval):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.trigger = trigger
+        self.sql_seconds = 0.0
+        self.sql_count = 0
+        self.statements = Counter()
+        self.current_sql = None
+        self.profiler = cProfile.Profile() if mode == 'cprofile' else None
+        self.sampler = StackSampler(threading.get_ident(), interval, self) if mode == 'sample' else None
+        self.started = None
+        self.elapsed = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        else:
+            self.sampler.start()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        else:
+            self.sampler.stop()
+        self.elapsed = time.perf_counter() - self.started
+
+    def save(self, directory, meta):
+        files = {'json': f'{self.id}.json'}
+        if self.profiler is not None:
+            files['pstats'] = f'{self.id}.pstats'
+            self.profiler.dump_stats(os.path.join(directory, files['pstats']))
+        else:
+            files['collapsed'] = f'{self.id}.collapsed'
+            with open(os.path.join(directory, files['collapsed']), 'w') as f:
+                for stack, count in self.sampler.stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+        meta = dict(meta, **{
+            'id': self.id,
+            'mode': self.mode,
+            'trigger': self.trigger,
+            'created_at': datetime.utcnow().isoformat(),
+            'duration_ms': round(self.elapsed * 1000, 2),
+            'sql_ms': round(self.sql_seconds * 1000, 2),
+            'sql_count': self.sql_count,
+            'sql_by_statement': [{'statement': s, 'ms': round(t * 1000, 2)}
+                                 for s, t in self.statements.most_common(10)],
+            'files': sorted(files),
+        })
+        with open(os.path.join(directory, files['json']), 'w') as f:
+            json.dump(meta, f)
+        return meta
+
+
+def profiles_dir(app):
+    path = app.config['PROFILE_DIR'] or os.path.join(app.instance_path, 'profiles')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def list_captures(app):
+    captures = []
+    directory = profiles_dir(app)
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    captures.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    captures.sort(key=lambda meta: meta['created_at'], reverse=True)
+    return captures
+
+def prune_captures(app):
+    limit = app.config['PROFILE_MAX_CAPTURES']
+    directory = profiles_dir(app)
+    for meta in list_captures(app)[limit:]:
+        for kind in meta['files']:
+            try:
+                os.remove(os.path.join(directory, f"{meta['id']}.{kind}"))
+            except OSError:
+                pass
+
+def requested_mode(app):
+    # (mode, trigger) when this request should be profiled, else None. The
+    # header is honoured for admins only; sampling needs no user.
+    value = request.headers.get(app.config['PROFILE_HEADER'])
+    if value is not None:
+        mode = value if value in MODES else app.config['PROFILE_MODE']
+        user = bearer_user()
+        if user is not None and user.username in app.config['ADMIN_USERNAMES']:
+            return mode, 'header'
+        return None
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        return app.config['PROFILE_MODE'], 'sample-rate'
+    return None
+
+
+def _start_capture():
+    app = current_app
+    wanted = requested_mode(app)
+    if wanted is None or not _capture_lock.acquire(blocking=False):
+        return
+    capture = Capture(*wanted, interval=app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000)
+    try:
+        capture.start()
+    except ValueError:
+        # Another profiler (e.g. a debugger or coverage tool) is active
+        _capture_lock.release()
+        return
+    g.profile_capture = capture
+
+def _record_status(response):
+    capture = g.get('profile_capture')
+    if capture is not None:
+        g.profile_status = response.status_code
+        response.headers['X-Profile-Id'] = capture.id
+    return response
+
+def _finish_capture(exc):
+    capture = g.pop('profile_capture', None)
+    if capture is None:
+        return
+    try:
+        capture.stop()
+    finally:
+        _capture_lock.release()
+    app = current_app
+    try:
+        capture.save(profiles_dir(app), {
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': g.pop('profile_status', 500),
+        })
+        prune_captures(app)
+    except OSError:
+        app.logger.exception('Could not save profile %s', capture.id)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _sql_started(conn, cursor, statement, parameters, context, executemany):
+    capture = g.get('profile_capture') if has_app_context() else None
+    if capture is not None:
+        capture.current_sql = statement
+        conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('profile_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    capture = g.get('profile_capture') if has_app_context() else None
+    if capture is not None:
+        capture.current_sql = None
+        capture.sql_seconds += elapsed
+        capture.sql_count += 1
+        capture.statements[' '.join(statement.split())[:200]] += elapsed
+
+
+def init_app(app):
+    app.before_request(_start_capture)
+    app.after_request(_record_status)
+    app.teardown_request(_finish_capture)
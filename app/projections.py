@@ -0,0 +1,94 @@
+from sqlalchemy import select, func, case
+from app.models import Product, Supplier, InventoryTransaction
+
+# Core-level read path for list endpoints. Each resource maps public field
+# names to (column expression, converter, join); a `fields=` request selects
+# only those columns and rows come back as plain tuples, so no ORM objects
+# are built or tracked in the identity map.
+products = Product.__table__
+suppliers = Supplier.__table__
+transactions = InventoryTransaction.__table__
+
+stock_expr = select(
+    func.coalesce(func.sum(case(
+        (transactions.c.transaction_type == 'IN', transactions.c.quantity),
+        else_=-transactions.c.quantity
+    )), 0)
+).where(transactions.c.product_id == products.c.id).scalar_subquery()
+
+
+def _iso(value):
+    return value.isoformat()
+
+
+PRODUCT_FIELDS = {
+    'id': (products.c.id, None, None),
+    'name': (products.c.name, None, None),
+    'sku': (products.c.sku, None, None),
+    'category': (products.c.category, None, None),
+    'supplier_id': (products.c.supplier_id, None, None),
+    'supplier': (suppliers.c.name, None, 'supplier'),
+    'unit_price': (products.c.unit_price, float, None),
+    'stock': (stock_expr, int, None),
+    'is_active': (products.c.is_active, bool, None),
+    'created_at': (products.c.created_at, _iso, None),
+}
+PRODUCT_DEFAULT_FIELDS = ['id', 'name', 'sku', 'category', 'supplier', 'unit_price', 'stock', 'is_active']
+PRODUCT_JOINS = {'supplier': (suppliers, suppliers.c.id == products.c.supplier_id)}
+
+SUPPLIER_FIELDS = {
+    'id': (suppliers.c.id, None, None),
+    'name': (suppliers.c.name, None, None),
+    'contact_email': (suppliers.c.contact_email, None, None),
+    'phone': (suppliers.c.phone, None, None),
+    'address': (suppliers.c.address, None, None),
+    'created_at': (suppliers.c.created_at, _iso, None),
+}
+SUPPLIER_DEFAULT_FIELDS = ['id', 'name', 'contact_email', 'phone', 'address']
+
+TRANSACTION_FIELDS = {
+    'id': (transactions.c.id, None, None),
+    'product_id': (transactions.c.product_id, None, None),
+    'product_name': (products.c.name, None, 'product'),
+    'sku': (products.c.sku, None, 'product'),
+    'quantity': (transactions.c.quantity, None, None),
+    'type': (transactions.c.transaction_type, None, None),
+    'date': (transactions.c.transaction_date, _iso, None),
+    'notes': (transactions.c.notes, None, None),
+}
+TRANSACTION_DEFAULT_FIELDS = ['id', 'product_name', 'quantity', 'type', 'date', 'notes']
+TRANSACTION_JOINS = {'product': (products, products.c.id == transactions.c.product_id)}
+
+
+def parse_fields(value, available, default):
+    # Returns the requested field list, or raises ValueError naming the bad ones
+    if not value:
+        return list(default)
+    fields = [f.strip() for f in value.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in available]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(available)}")
+    return list(dict.fromkeys(fields))
+
+def select_fields(fields, available, base, joins=None, extra=()):
+    # `extra` columns (e.g. cursor keys) are selected after the requested
+    # fields and are not part of the serialized rows.
+    columns = [available[f][0].label(f) for f in fields]
+    columns += [column.label(f'_{i}') for i, column in enumerate(extra)]
+    stmt = select(*columns).select_from(base)
+    for join in dict.fromkeys(available[f][2] for f in fields if available[f][2]):
+        table, on = joins[join]
+        stmt = stmt.join(table, on)
+    return stmt
+
+def serialize_rows(rows, fields, available):
+    converters = [available[f][1] for f in fields]
+    output = []
+    for row in rows:
+        item = {}
+        for i, field in enumerate(fields):
+            value = row[i]
+            convert = converters[i]
+            item[field] = convert(value) if convert is not None and value is not None else value
+        output.append(item)
+    return output
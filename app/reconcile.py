@@ -0,0 +1,141 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.pool import NullPool
+from app import db
+from app.models import Product, InventoryTransaction, InventoryValuation
+
+products = Product.__table__
+transactions = InventoryTransaction.__table__
+valuations = InventoryValuation.__table__
+
+ISSUE_KINDS = ('negative_balances', 'orphans', 'invalid_rows', 'mismatches')
+# Issues kept per kind and partition; the counts always cover everything
+SAMPLE_LIMIT = 100
+MIN_ID, MAX_ID = -2 ** 31, 2 ** 31 - 1
+
+
+def plan_partitions(partitions):
+    # Splits the product id space into contiguous ranges of roughly equal
+    # ledger rows. The outer ranges are open-ended so orphaned product ids
+    # outside the products table are still covered.
+    counts = db.session.execute(
+        select(transactions.c.product_id, func.count()).group_by(transactions.c.product_id)
+        .order_by(transactions.c.product_id)
+    ).all()
+    target = max(1, -(-sum(n for _, n in counts) // max(1, partitions)))
+    ranges = []
+    start, rows = MIN_ID, 0
+    for product_id, n in counts:
+        rows += n
+        if rows >= target and len(ranges) < partitions - 1:
+            ranges.append((start, product_id))
+            start, rows = product_id + 1, 0
+    ranges.append((start, MAX_ID))
+    return ranges
+
+def check_partition(url, low, high, chunk_size=10000):
+    # Entry point in a worker process, which needs its own engine
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        return scan_partition(engine, low, high, chunk_size)
+    finally:
+        engine.dispose()
+
+def scan_partition(engine, low, high, chunk_size):
+    # Streams the partition's ledger in (product, date, id) order and checks
+    # each product's running balance against its stored total.
+    started = time.perf_counter()
+    report = {'range': [low, high], 'rows': 0, 'products': 0, 'counts': dict.fromkeys(ISSUE_KINDS, 0),
+              **{kind: [] for kind in ISSUE_KINDS}}
+
+    def issue(kind, entry):
+        report['counts'][kind] += 1
+        if len(report[kind]) < SAMPLE_LIMIT:
+            report[kind].append(entry)
+
+    def finish(product_id, balance):
+        # Orphans are reported once, not again as drift from a missing total
+        if product_id not in known:
+            return
+        report['products'] += 1
+        stored_quantity = stored.pop(product_id, 0)
+        if stored_quantity != balance:
+            issue('mismatches', {'product_id': product_id, 'ledger': balance, 'stored': stored_quantity})
+
+    with engine.connect() as conn:
+        in_range = products.c.id.between(low, high)
+        known = set(conn.execute(select(products.c.id).where(in_range)).scalars())
+        stored = dict(conn.execute(
+            select(valuations.c.product_id, valuations.c.quantity).where(valuations.c.product_id.between(low, high))
+        ).all())
+        t = transactions.c
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(
+            select(t.product_id, t.transaction_date, t.id, t.transaction_type, t.quantity)
+            .where(t.product_id.between(low, high))
+            .order_by(t.product_id, t.transaction_date, t.id)
+        )
+        current, balance, went_negative = None, 0, False
+        for product_id, when, trans_id, trans_type, quantity in result:
+            report['rows'] += 1
+            if product_id != current:
+                if current is not None:
+                    finish(current, balance)
+                current, balance, went_negative = product_id, 0, False
+                if product_id not in known:
+                    issue('orphans', {'product_id': product_id, 'transaction_id': trans_id})
+            if trans_type not in ('IN', 'OUT') or quantity is None or quantity <= 0:
+                issue('invalid_rows', {'transaction_id': trans_id, 'type': trans_type, 'quantity': quantity})
+                continue
+            balance += quantity if trans_type == 'IN' else -quantity
+            # Only the first dip below zero per product is reported
+            if balance < 0 and not went_negative:
+                went_negative = True
+                issue('negative_balances', {'product_id': product_id, 'transaction_id': trans_id,
+                                            'date': when.isoformat() if when else None, 'balance': balance})
+        if current is not None:
+            finish(current, balance)
+        # Stored totals for products with no ledger rows at all
+        for product_id, quantity in stored.items():
+            if quantity:
+                issue('mismatches', {'product_id': product_id, 'ledger': 0, 'stored': quantity})
+    report['elapsed'] = time.perf_counter() - started
+    return report
+
+def reconcile(workers=None, partitions=None, chunk_size=10000):
+    # workers=0 checks every partition in this process (needed for in-memory SQLite)
+    url = db.engine.url
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        workers = 0
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    ranges = plan_partitions(partitions or max(1, workers) * 2)
+    url_string = url.render_as_string(hide_password=False)
+
+    started = time.perf_counter()
+    if workers:
+        # spawn: children must not inherit this process's open connections
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            parts = list(pool.map(check_partition, [url_string] * len(ranges), *zip(*ranges),
+                                  [chunk_size] * len(ranges)))
+    else:
+        db.session.close()
+        parts = [scan_partition(db.engine, low, high, chunk_size) for low, high in ranges]
+    elapsed = time.perf_counter() - started
+
+    rows = sum(part['rows'] for part in parts)
+    report = {
+        'workers': workers,
+        'partitions': [{'range': part['range'], 'rows': part['rows'], 'elapsed': round(part['elapsed'], 3)}
+                       for part in parts],
+        'products': sum(part['products'] for part in parts),
+        'rows': rows,
+        'elapsed': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed) if elapsed else None,
+        'counts': {kind: sum(part['counts'][kind] for part in parts) for kind in ISSUE_KINDS},
+    }
+    for kind in ISSUE_KINDS:
+        report[kind] = [entry for part in parts for entry in part[kind]][:SAMPLE_LIMIT]
+    report['issue_count'] = sum(report['counts'].values())
+    return report
@@ -1,194 +1,368 @@
-from flask import Blueprint, jsonify
+import csv
+from datetime import datetime
+from flask import Blueprint, current_app, jsonify, request
 from sqlalchemy import text
 from app import db
+from app.models import Product, Job
 from app.auth import token_required
+from app.jobs import job_runner
+from app.archive import archived_totals, archived_movements
+from app.valuation import valuation_method, audit_valuation
+from app.checkpoints import stock_as_of, build_checkpoint, latest_checkpoint
+from app.singleflight import coalesce
 
 analytics_bp = Blueprint('analytics', __name__)
 
+# Raw SQL to get top selling products (most OUT quantity)
+TOP_SELLING_SQL = text("""
+    SELECT p.name, SUM(t.quantity) as total_sold
+    FROM inventory_transactions t
+    JOIN products p ON t.product_id = p.id
+    WHERE t.transaction_type = 'OUT'
+    GROUP BY p.id, p.name
+    ORDER BY total_sold DESC
+    LIMIT 10
+""")
+
+# Same totals for every product, merged with archived totals when cold storage exists
+SOLD_BY_PRODUCT_SQL = text("""
+    SELECT p.id, p.name, SUM(t.quantity) as total_sold
+    FROM inventory_transactions t
+    JOIN products p ON t.product_id = p.id
+    WHERE t.transaction_type = 'OUT'
+    GROUP BY p.id, p.name
+""")
+
+# Raw SQL to calculate stock and filter by threshold (e.g., < 20)
+# PostgreSQL requires repeating the aggregate expression in HAVING, or using a subquery/CTE.
+LOW_STOCK_SQL = text("""
+    SELECT p.name, p.sku,
+           (COALESCE(SUM(CASE WHEN t.transaction_type = 'IN' THEN t.quantity ELSE 0 END), 0) -
+            COALESCE(SUM(CASE WHEN t.transaction_type = 'OUT' THEN t.quantity ELSE 0 END), 0)) as current_stock
+    FROM products p
+    LEFT JOIN inventory_transactions t ON p.id = t.product_id
+    WHERE p.is_active = TRUE
+    GROUP BY p.id, p.name, p.sku
+    HAVING (COALESCE(SUM(CASE WHEN t.transaction_type = 'IN' THEN t.quantity ELSE 0 END), 0) -
+            COALESCE(SUM(CASE WHEN t.transaction_type = 'OUT' THEN t.quantity ELSE 0 END), 0)) < 20
+    ORDER BY current_stock ASC
+""")
+
+# Total value comes from the incrementally maintained valuations, not a ledger scan
+STOCK_VALUE_SQL = text("""
+    SELECT SUM(total_value) as total_value
+    FROM inventory_valuations
+""")
+
+RECENT_PRODUCTS_SQL = text("""
+    SELECT p.name, p.sku, p.unit_price, s.name as supplier
+    FROM products p
+    JOIN suppliers s ON p.supplier_id = s.id
+    WHERE p.is_active = TRUE
+    ORDER BY p.id DESC
+    LIMIT 5
+""")
+
+STOCK_BY_CATEGORY_SQL = text("""
+    SELECT
+        p.category,
+        COUNT(p.id) as product_count,
+        SUM(COALESCE(v.quantity, 0)) as total_units,
+        SUM(COALESCE(v.total_value, 0)) as total_value
+    FROM products p
+    LEFT JOIN inventory_valuations v ON p.id = v.product_id
+    WHERE p.is_active = TRUE
+    GROUP BY p.category
+    ORDER BY total_value DESC
+""")
+
+# One pass over the active products' movements through idx_transactions_product;
+# aggregating the ledger in subqueries first read every movement twice,
+# including those of archived products
+PRODUCTS_BY_SUPPLIER_SQL = text("""
+    SELECT
+        s.name as supplier_name,
+        COUNT(DISTINCT p.id) as product_count,
+        COALESCE(SUM(CASE WHEN t.transaction_type = 'IN' THEN t.quantity ELSE -t.quantity END), 0) as total_stock
+    FROM suppliers s
+    JOIN products p ON s.id = p.supplier_id AND p.is_active = TRUE
+    LEFT JOIN inventory_transactions t ON p.id = t.product_id
+    GROUP BY s.id, s.name
+    ORDER BY product_count DESC
+""")
+
+STOCK_MOVEMENT_SQL = text("""
+    SELECT
+        t.id,
+        t.transaction_date,
+        t.transaction_type,
+        t.quantity,
+        t.notes,
+        SUM(CASE
+            WHEN t2.transaction_type = 'IN' THEN t2.quantity
+            ELSE -t2.quantity
+        END) as running_stock,
+        t.is_opening
+    FROM inventory_transactions t
+    LEFT JOIN inventory_transactions t2 ON t2.product_id = t.product_id
+        AND t2.transaction_date <= t.transaction_date
+        AND (t2.transaction_date < t.transaction_date OR t2.id <= t.id)
+    WHERE t.product_id = :product_id
+    GROUP BY t.id, t.transaction_date, t.transaction_type, t.quantity, t.notes, t.is_opening
+    ORDER BY t.transaction_date ASC, t.id ASC
+""").columns(transaction_date=db.DateTime)
+
+# Per-product balances over the full ledger, one chunk of product ids at a time
+STOCK_SNAPSHOT_SQL = text("""
+    SELECT p.id, p.sku, p.name,
+           COALESCE(SUM(CASE WHEN t.transaction_type = 'IN' THEN t.quantity ELSE -t.quantity END), 0) as stock
+    FROM products p
+    LEFT JOIN inventory_transactions t ON p.id = t.product_id
+    WHERE p.id > :after_id
+    GROUP BY p.id, p.sku, p.name
+    ORDER BY p.id ASC
+    LIMIT :limit
+""")
+
+
+def columnar():
+    # The in-memory NumPy engine when ANALYTICS_ENGINE=numpy, else None (SQL)
+    if current_app.config['ANALYTICS_ENGINE'] != 'numpy':
+        return None
+    from app.columnar import ledger_snapshot
+    return ledger_snapshot()
+
+@coalesce('analytics.top_selling')
+def top_selling_data():
+    archived = archived_totals()
+    snapshot = columnar()
+    if snapshot is not None:
+        return snapshot.top_selling(archived)
+    if not archived:
+        result = db.session.execute(TOP_SELLING_SQL)
+        return [{'name': row[0], 'total_sold': int(row[1])} for row in result]
+
+    totals = {product_id: int(outs) for product_id, (_, outs) in archived.items() if outs}
+    names = {}
+    for product_id, name, sold in db.session.execute(SOLD_BY_PRODUCT_SQL):
+        totals[product_id] = totals.get(product_id, 0) + int(sold)
+        names[product_id] = name
+    top = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:10]
+    missing = [product_id for product_id, _ in top if product_id not in names]
+    if missing:
+        names.update(db.session.query(Product.id, Product.name).filter(Product.id.in_(missing)).all())
+    return [{'name': names.get(product_id), 'total_sold': sold} for product_id, sold in top]
+
+@coalesce('analytics.low_stock')
+def low_stock_data():
+    snapshot = columnar()
+    if snapshot is not None:
+        return snapshot.low_stock()
+    result = db.session.execute(LOW_STOCK_SQL)
+    return [{'name': row[0], 'sku': row[1], 'stock': row[2]} for row in result]
+
+@coalesce('analytics.stock_value')
+def stock_value_data():
+    snapshot = columnar()
+    if snapshot is not None:
+        total_value = snapshot.stock_value()
+    else:
+        total_value = db.session.execute(STOCK_VALUE_SQL).scalar() or 0
+    return {'total_stock_value': float(total_value), 'method': valuation_method()}
+
+@coalesce('analytics.recent_products')
+def recent_products_data():
+    result = db.session.execute(RECENT_PRODUCTS_SQL)
+    return [{'name': row[0], 'sku': row[1], 'price': float(row[2]), 'supplier': row[3]} for row in result]
+
+@coalesce('analytics.stock_by_category')
+def stock_by_category_data():
+    snapshot = columnar()
+    if snapshot is not None:
+        return snapshot.stock_by_category()
+    result = db.session.execute(STOCK_BY_CATEGORY_SQL)
+    return [{
+        'category': row[0],
+        'product_count': int(row[1]),
+        'total_units': int(row[2] or 0),
+        'total_value': float(row[3] or 0)
+    } for row in result]
+
+@coalesce('analytics.products_by_supplier')
+def products_by_supplier_data():
+    snapshot = columnar()
+    if snapshot is not None:
+        return snapshot.products_by_supplier()
+    result = db.session.execute(PRODUCTS_BY_SUPPLIER_SQL)
+    return [{
+        'supplier': row[0],
+        'product_count': int(row[1]),
+        'total_stock': int(row[2] or 0)
+    } for row in result]
+
+
 @analytics_bp.route('/api/analytics/top-selling', methods=['GET'])
 @token_required
 def top_selling(current_user):
-    # Raw SQL to get top selling products (most OUT quantity)
-    sql = text("""
-        SELECT p.name, SUM(t.quantity) as total_sold
-        FROM inventory_transactions t
-        JOIN products p ON t.product_id = p.id
-        WHERE t.transaction_type = 'OUT'
-        GROUP BY p.id, p.name
-        ORDER BY total_sold DESC
-        LIMIT 10
-    """)
-    
-    result = db.session.execute(sql)
-    data = [{'name': row[0], 'total_sold': int(row[1])} for row in result]
-    return jsonify(data), 200
+    return jsonify(top_selling_data()), 200
 
 @analytics_bp.route('/api/analytics/low-stock', methods=['GET'])
 @token_required
 def low_stock(current_user):
-    # Raw SQL to calculate stock and filter by threshold (e.g., < 20)
-    # PostgreSQL requires repeating the aggregate expression in HAVING, or using a subquery/CTE.
-    sql = text("""
-        SELECT p.name, p.sku, 
-               (COALESCE(SUM(CASE WHEN t.transaction_type = 'IN' THEN t.quantity ELSE 0 END), 0) - 
-                COALESCE(SUM(CASE WHEN t.transaction_type = 'OUT' THEN t.quantity ELSE 0 END), 0)) as current_stock
-        FROM products p
-        LEFT JOIN inventory_transactions t ON p.id = t.product_id
-        WHERE p.is_active = TRUE
-        GROUP BY p.id, p.name, p.sku
-        HAVING (COALESCE(SUM(CASE WHEN t.transaction_type = 'IN' THEN t.quantity ELSE 0 END), 0) - 
-                COALESCE(SUM(CASE WHEN t.transaction_type = 'OUT' THEN t.quantity ELSE 0 END), 0)) < 20
-        ORDER BY current_stock ASC
-    """)
-    
-    result = db.session.execute(sql)
-    data = [{'name': row[0], 'sku': row[1], 'stock': row[2]} for row in result]
-    return jsonify(data), 200
+    return jsonify(low_stock_data()), 200
 
 @analytics_bp.route('/api/analytics/stock-value', methods=['GET'])
 @token_required
 def stock_value(current_user):
-    # Raw SQL for total value
-    sql = text("""
-        SELECT SUM(
-            (COALESCE(in_sum, 0) - COALESCE(out_sum, 0)) * p.unit_price
-        ) as total_value
-        FROM products p
-        LEFT JOIN (
-            SELECT product_id, SUM(quantity) as in_sum 
-            FROM inventory_transactions 
-            WHERE transaction_type = 'IN' 
-            GROUP BY product_id
-        ) in_t ON p.id = in_t.product_id
-        LEFT JOIN (
-            SELECT product_id, SUM(quantity) as out_sum 
-            FROM inventory_transactions 
-            WHERE transaction_type = 'OUT' 
-            GROUP BY product_id
-        ) out_t ON p.id = out_t.product_id
-    """)
-    
-    result = db.session.execute(sql)
-    total_value = result.scalar() or 0
-    return jsonify({'total_stock_value': float(total_value)}), 200
+    return jsonify(stock_value_data()), 200
+
 @analytics_bp.route('/api/analytics/recent-products', methods=['GET'])
 @token_required
 def recent_products(current_user):
-    sql = text("""
-        SELECT p.name, p.sku, p.unit_price, s.name as supplier
-        FROM products p
-        JOIN suppliers s ON p.supplier_id = s.id
-        WHERE p.is_active = TRUE
-        ORDER BY p.id DESC
-        LIMIT 5
-    """)
-    
-    result = db.session.execute(sql)
-    data = [{'name': row[0], 'sku': row[1], 'price': float(row[2]), 'supplier': row[3]} for row in result]
-    return jsonify(data), 200
+    return jsonify(recent_products_data()), 200
 
 @analytics_bp.route('/api/analytics/stock-by-category', methods=['GET'])
 @token_required
 def stock_by_category(current_user):
-    sql = text("""
-        SELECT 
-            p.category,
-            COUNT(DISTINCT p.id) as product_count,
-            SUM(COALESCE(in_sum, 0) - COALESCE(out_sum, 0)) as total_units,
-            SUM((COALESCE(in_sum, 0) - COALESCE(out_sum, 0)) * p.unit_price) as total_value
-        FROM products p
-        LEFT JOIN (
-            SELECT product_id, SUM(quantity) as in_sum 
-            FROM inventory_transactions 
-            WHERE transaction_type = 'IN' 
-            GROUP BY product_id
-        ) in_t ON p.id = in_t.product_id
-        LEFT JOIN (
-            SELECT product_id, SUM(quantity) as out_sum 
-            FROM inventory_transactions 
-            WHERE transaction_type = 'OUT' 
-            GROUP BY product_id
-        ) out_t ON p.id = out_t.product_id
-        WHERE p.is_active = TRUE
-        GROUP BY p.category
-        ORDER BY total_value DESC
-    """)
-    
-    result = db.session.execute(sql)
-    data = [{
-        'category': row[0],
-        'product_count': int(row[1]),
-        'total_units': int(row[2] or 0),
-        'total_value': float(row[3] or 0)
-    } for row in result]
-    return jsonify(data), 200
+    return jsonify(stock_by_category_data()), 200
 
 @analytics_bp.route('/api/analytics/products-by-supplier', methods=['GET'])
 @token_required
 def products_by_supplier(current_user):
-    sql = text("""
-        SELECT 
-            s.name as supplier_name,
-            COUNT(p.id) as product_count,
-            SUM(COALESCE(in_sum, 0) - COALESCE(out_sum, 0)) as total_stock
-        FROM suppliers s
-        LEFT JOIN products p ON s.id = p.supplier_id AND p.is_active = TRUE
-        LEFT JOIN (
-            SELECT product_id, SUM(quantity) as in_sum 
-            FROM inventory_transactions 
-            WHERE transaction_type = 'IN' 
-            GROUP BY product_id
-        ) in_t ON p.id = in_t.product_id
-        LEFT JOIN (
-            SELECT product_id, SUM(quantity) as out_sum 
-            FROM inventory_transactions 
-            WHERE transaction_type = 'OUT' 
-            GROUP BY product_id
-        ) out_t ON p.id = out_t.product_id
-        GROUP BY s.id, s.name
-        HAVING COUNT(p.id) > 0
-        ORDER BY product_count DESC
-    """)
-    
-    result = db.session.execute(sql)
-    data = [{
-        'supplier': row[0],
-        'product_count': int(row[1]),
-        'total_stock': int(row[2] or 0)
-    } for row in result]
-    return jsonify(data), 200
+    return jsonify(products_by_supplier_data()), 200
 
-@analytics_bp.route('/api/analytics/stock-movement/<int:product_id>', methods=['GET'])
-@token_required
-def stock_movement(current_user, product_id):
-    sql = text("""
-        SELECT 
-            t.id,
-            t.transaction_date,
-            t.transaction_type,
-            t.quantity,
-            t.notes,
-            SUM(CASE 
-                WHEN t2.transaction_type = 'IN' THEN t2.quantity 
-                ELSE -t2.quantity 
-            END) as running_stock
-        FROM inventory_transactions t
-        LEFT JOIN inventory_transactions t2 ON t2.product_id = t.product_id 
-            AND t2.transaction_date <= t.transaction_date
-            AND (t2.transaction_date < t.transaction_date OR t2.id <= t.id)
-        WHERE t.product_id = :product_id
-        GROUP BY t.id, t.transaction_date, t.transaction_type, t.quantity, t.notes
-        ORDER BY t.transaction_date ASC, t.id ASC
-    """)
-    
-    result = db.session.execute(sql, {'product_id': product_id})
-    data = [{
+@coalesce('analytics.stock_movement')
+def stock_movement_data(product_id):
+    # Archived history replays first; the live ledger's running stock already
+    # includes the carried-forward opening balance, so that row is hidden.
+    data = []
+    running = 0
+    for trans_id, when, quantity, notes in archived_movements(product_id):
+        running += quantity
+        data.append({
+            'id': trans_id,
+            'date': when.isoformat(),
+            'type': 'IN' if quantity > 0 else 'OUT',
+            'quantity': abs(quantity),
+            'notes': notes,
+            'running_stock': running
+        })
+
+    result = db.session.execute(STOCK_MOVEMENT_SQL, {'product_id': product_id})
+    data += [{
         'id': row[0],
         'date': row[1].isoformat(),
         'type': row[2],
         'quantity': int(row[3]),
         'notes': row[4],
         'running_stock': int(row[5] or 0)
-    } for row in result]
-    return jsonify(data), 200
+    } for row in result if not (data and row[6])]
+    return data
+
+@analytics_bp.route('/api/analytics/stock-movement/<int:product_id>', methods=['GET'])
+@token_required
+def stock_movement(current_user, product_id):
+    return jsonify(stock_movement_data(product_id)), 200
+
+@coalesce('analytics.stock_as_of')
+def stock_as_of_data(at):
+    return stock_as_of(at)
+
+@analytics_bp.route('/api/analytics/stock-as-of', methods=['GET'])
+@token_required
+def get_stock_as_of(current_user):
+    # Every product's balance and value at `at`, from the latest stock
+    # checkpoint plus the movements after it
+    try:
+        at = datetime.fromisoformat(request.args['at'])
+    except (KeyError, ValueError):
+        return jsonify({'message': 'Query parameter at must be an ISO 8601 timestamp'}), 400
+    try:
+        return jsonify(stock_as_of_data(at)), 200
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 409
+
+
+# ==================== BACKGROUND JOBS ====================
+
+REPORT_SECTIONS = [
+    ('top_selling', top_selling_data),
+    ('low_stock', low_stock_data),
+    ('stock_value', stock_value_data),
+    ('recent_products', recent_products_data),
+    ('stock_by_category', stock_by_category_data),
+    ('products_by_supplier', products_by_supplier_data),
+]
+
+@job_runner.job_type('analytics-report', limit=1)
+def analytics_report_job(ctx, params):
+    report = {}
+    for i, (name, compute) in enumerate(REPORT_SECTIONS):
+        ctx.progress(i, len(REPORT_SECTIONS), f'Computing {name}')
+        report[name] = compute()
+    return report
+
+@job_runner.job_type('stock-snapshot', limit=1)
+def stock_snapshot_job(ctx, params):
+    chunk_size = int(params.get('chunk_size', 1000))
+    total = db.session.execute(text("SELECT COUNT(*) FROM products")).scalar() or 0
+    snapshot = []
+    after_id = 0
+    while True:
+        rows = db.session.execute(STOCK_SNAPSHOT_SQL, {'after_id': after_id, 'limit': chunk_size}).all()
+        if not rows:
+            break
+        snapshot.extend({'id': row[0], 'sku': row[1], 'name': row[2], 'stock': int(row[3])} for row in rows)
+        after_id = rows[-1][0]
+        ctx.progress(len(snapshot), total, f'{len(snapshot)} of {total} products')
+    return snapshot
+
+@job_runner.job_type('valuation-audit', limit=1)
+def valuation_audit_job(ctx, params):
+    # Replays the ledger and compares against the maintained valuations;
+    # with {"fix": true} the layers and valuations are rebuilt from the replay.
+    def progress(done, total):
+        ctx.progress(done, total, f'{done} of {total} transactions replayed')
+    return audit_valuation(fix=bool(params.get('fix')), progress=progress)
+
+
+AS_OF_COLUMNS = ['product_id', 'sku', 'name', 'quantity', 'value']
+
+@job_runner.job_type('stock-as-of-export', limit=1)
+def stock_as_of_export_job(ctx, params):
+    if not params.get('at'):
+        raise ValueError('params.at (ISO 8601 timestamp) is required')
+    at = datetime.fromisoformat(params['at'])
+
+    def progress(done):
+        ctx.progress(0, None, f'{done} movements replayed')
+    report = stock_as_of(at, progress=progress)
+    with ctx.open_result('csv', 'text/csv') as f:
+        writer = csv.writer(f)
+        writer.writerow(AS_OF_COLUMNS)
+        for row in report['products']:
+            writer.writerow([row[column] for column in AS_OF_COLUMNS])
+    ctx.progress(1, 1, f"{len(report['products'])} products, total value {report['total_value']:.2f}", force=True)
+    return None
+
+@job_runner.job_type('stock-checkpoint', limit=1)
+def stock_checkpoint_job(ctx, params):
+    at = datetime.fromisoformat(params['at'])
+
+    def progress(done):
+        ctx.progress(0, None, f'{done} movements replayed')
+    summary = build_checkpoint(at, progress=progress)
+    return {'as_of': at.isoformat(), 'method': summary['method'], 'products': summary['products']}
 
+@job_runner.periodic
+def schedule_stock_checkpoint(app):
+    # Queues this month's checkpoint once; a failed one waits for the next
+    # month or a manual `ledger checkpoint`
+    if not app.config['STOCK_CHECKPOINT_MONTHLY']:
+        return None
+    at = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if latest_checkpoint(at, valuation_method(app)) == at:
+        return None
+    if Job.query.filter(Job.job_type == 'stock-checkpoint', Job.created_at >= at).first() is not None:
+        return None
+    return job_runner.submit('stock-checkpoint', {'at': at.isoformat()})
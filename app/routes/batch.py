@@ -0,0 +1,92 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+from flask import Blueprint, request, jsonify, current_app
+from app import db
+from app.auth import token_required, BATCH_USER_KEY
+
+batch_bp = Blueprint('batch', __name__)
+
+_pool_lock = threading.Lock()
+_pool = [None, None]    # executor, pid
+
+def batch_executor(app):
+    # One bounded pool per worker process, rebuilt after fork
+    with _pool_lock:
+        if _pool[0] is None or _pool[1] != os.getpid():
+            _pool[0] = ThreadPoolExecutor(max_workers=app.config['BATCH_WORKERS'], thread_name_prefix='batch')
+            _pool[1] = os.getpid()
+        return _pool[0]
+
+def parse_sub_request(item):
+    # Returns (path, query string) for a {"path": ..., "query": {...}} item, or raises ValueError
+    if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+        raise ValueError('Each request needs a path')
+    parts = urlsplit(item['path'])
+    if parts.scheme or parts.netloc or not parts.path.startswith('/api/') or parts.path.startswith('/api/batch'):
+        raise ValueError(f"Only /api/ paths can be batched: {item['path']}")
+    query = parts.query
+    extra = item.get('query')
+    if extra:
+        if not isinstance(extra, dict):
+            raise ValueError('query must be an object')
+        query = '&'.join(q for q in (query, urlencode(extra, doseq=True)) if q)
+    return parts.path, query
+
+def run_sub_request(app, base_environ, user, path, query):
+    environ = dict(base_environ)
+    environ.update({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_LENGTH': '0',
+        'wsgi.input': io.BytesIO(b''),
+        BATCH_USER_KEY: user,
+    })
+    environ.pop('CONTENT_TYPE', None)
+    environ.pop('HTTP_IDEMPOTENCY_KEY', None)
+    environ.pop('HTTP_X_PROFILE', None)
+    # Each sub-request gets its own request and app context, and so its own DB session
+    with app.request_context(environ):
+        try:
+            response = app.full_dispatch_request()
+        except Exception:
+            app.logger.exception('Batched request to %s failed', path)
+            return 500, {'message': 'Internal server error'}
+        try:
+            # File responses (job results) are read into the batch body like any other
+            response.direct_passthrough = False
+            body = response.get_json(silent=True) if response.is_json else response.get_data(as_text=True)
+            return response.status_code, body
+        finally:
+            response.close()
+
+@batch_bp.route('/api/batch', methods=['POST'])
+@token_required
+def batch(current_user):
+    # Body: {"requests": [{"id": "top", "path": "/api/analytics/top-selling", "query": {...}}, ...]}
+    data = request.get_json() or {}
+    items = data.get('requests')
+    limit = current_app.config['BATCH_MAX_REQUESTS']
+    if not isinstance(items, list) or not items:
+        return jsonify({'message': "'requests' must be a non-empty list"}), 400
+    if len(items) > limit:
+        return jsonify({'message': f'At most {limit} requests per batch'}), 400
+    try:
+        parsed = [parse_sub_request(item) for item in items]
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    # The user is authenticated once; sub-requests get a detached copy of it
+    db.session.expunge(current_user)
+    app = current_app._get_current_object()
+    executor = batch_executor(app)
+    futures = [executor.submit(run_sub_request, app, request.environ, current_user, path, query)
+               for path, query in parsed]
+    results = []
+    for i, (item, future) in enumerate(zip(items, futures)):
+        status, body = future.result()
+        results.append({'id': item.get('id', i), 'path': item['path'], 'status': status, 'body': body})
+    return jsonify({'responses': results}), 200
@@ -0,0 +1,29 @@
+from flask import Blueprint, request, jsonify, current_app
+from app.auth import token_required
+from app.changes import changes_since
+from app.pagination import decode_cursor, encode_cursor
+
+changes_bp = Blueprint('changes', __name__)
+
+@changes_bp.route('/api/changes', methods=['GET'])
+@token_required
+def get_changes(current_user):
+    # Delta sync: rows changed after `since` (the cursor of the previous
+    # page), oldest first. Start without `since` for the whole catalog, then
+    # keep passing the returned cursor; deletions come back as tombstones.
+    limit = request.args.get('limit', current_app.config['CHANGES_PAGE_SIZE'], type=int)
+    if limit < 1 or limit > current_app.config['CHANGES_MAX_PAGE_SIZE']:
+        return jsonify({'message': f"limit must be between 1 and {current_app.config['CHANGES_MAX_PAGE_SIZE']}"}), 400
+    since = 0
+    if request.args.get('since'):
+        try:
+            since = int(decode_cursor(request.args['since'])[0])
+        except (ValueError, TypeError, IndexError):
+            return jsonify({'message': 'Invalid cursor'}), 400
+    
+    feed, last_seq, has_more = changes_since(since, limit)
+    return jsonify({
+        'changes': feed,
+        'cursor': encode_cursor([last_seq]),
+        'has_more': has_more
+    }), 200
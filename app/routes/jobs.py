@@ -0,0 +1,86 @@
+import json
+from flask import Blueprint, request, jsonify, send_file
+from app.models import Job
+from app.auth import is_admin, token_required
+from app.jobs import job_runner, FINISHED_STATUSES
+
+jobs_bp = Blueprint('jobs', __name__)
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'type': job.job_type,
+        'status': job.status,
+        'params': json.loads(job.params or '{}'),
+        'progress': round(job.progress or 0.0, 4),
+        'message': job.message,
+        'cancel_requested': job.cancel_requested,
+        'error': job.error,
+        'has_result': job.status == 'succeeded' and job.result_path is not None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+def visible_jobs(user):
+    # Users see the jobs they submitted; admins also see everyone else's and
+    # the ones the workers queue themselves
+    if is_admin(user):
+        return Job.query
+    return Job.query.filter_by(created_by=user.id)
+
+def get_job_or_404(user, job_id):
+    # Another user's job is reported missing rather than forbidden
+    return visible_jobs(user).filter_by(id=job_id).first_or_404()
+
+@jobs_bp.route('/api/jobs', methods=['POST'])
+@token_required
+def submit_job(current_user):
+    data = request.get_json() or {}
+    job_type = data.get('type')
+    if not job_type:
+        return jsonify({'message': 'Job type is required'}), 400
+    if not job_runner.has_type(job_type):
+        return jsonify({'message': f'Unknown job type: {job_type}'}), 400
+    params = data.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({'message': 'Job params must be an object'}), 400
+
+    job = job_runner.submit(job_type, params, user_id=current_user.id)
+    return jsonify({'message': 'Job queued', 'id': job.id, 'status': job.status}), 202
+
+@jobs_bp.route('/api/jobs', methods=['GET'])
+@token_required
+def list_jobs(current_user):
+    query = visible_jobs(current_user)
+    if request.args.get('status'):
+        query = query.filter_by(status=request.args['status'])
+    if request.args.get('type'):
+        query = query.filter_by(job_type=request.args['type'])
+    jobs = query.order_by(Job.created_at.desc()).limit(100).all()
+    return jsonify([job_to_dict(j) for j in jobs]), 200
+
+@jobs_bp.route('/api/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_job(current_user, job_id):
+    job = get_job_or_404(current_user, job_id)
+    return jsonify(job_to_dict(job)), 200
+
+@jobs_bp.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@token_required
+def cancel_job(current_user, job_id):
+    job = get_job_or_404(current_user, job_id)
+    if job.status in FINISHED_STATUSES:
+        return jsonify({'message': f'Job already {job.status}'}), 409
+    job = job_runner.cancel(job_id)
+    return jsonify({'message': 'Cancellation requested', 'status': job.status}), 202
+
+@jobs_bp.route('/api/jobs/<job_id>/result', methods=['GET'])
+@token_required
+def download_job_result(current_user, job_id):
+    job = get_job_or_404(current_user, job_id)
+    if job.status != 'succeeded' or not job.result_path:
+        return jsonify({'message': 'Job result not available', 'status': job.status}), 409
+    extension = job.result_path.rsplit('.', 1)[-1]
+    return send_file(job.result_path, mimetype=job.result_mimetype, as_attachment=True,
+                     download_name=f'{job.job_type}-{job.id}.{extension}')
@@ -0,0 +1,13 @@
+from flask import Blueprint, current_app, jsonify
+from app.auth import token_required
+from app.metrics import metrics
+from config.logging import log_stats
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/api/metrics', methods=['GET'])
+@token_required
+def get_metrics(current_user):
+    snapshot = metrics().snapshot()
+    snapshot.update(log_stats(current_app))
+    return jsonify(snapshot), 200
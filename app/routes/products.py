@@ -1,7 +1,17 @@
-from flask import Blueprint, request, jsonify
-from app.models import Product, Supplier, InventoryTransaction
+from decimal import Decimal, InvalidOperation
+from flask import Blueprint, request, jsonify, current_app
+from sqlalchemy import and_, or_, func, select, update, delete
+from sqlalchemy.exc import IntegrityError
+from app.models import Product, Supplier, InventoryTransaction, CostLayer, InventoryValuation, StockCheckpoint
 from app import db
 from app.auth import token_required
+from app.catalog import catalog
+from app.changes import track_changes
+from app.idempotency import commit_response, idempotent
+from app.jobs import job_runner
+from app.pagination import COUNT_MODES, count_rows, decode_cursor, encode_cursor, invalidate_counts, page_count
+from app.projections import PRODUCT_FIELDS, PRODUCT_DEFAULT_FIELDS, PRODUCT_JOINS, parse_fields, select_fields, \
+    serialize_rows
 
 products_bp = Blueprint('products', __name__)
 
@@ -12,45 +22,62 @@ def get_products(current_user):
     per_page = request.args.get('per_page', 20, type=int)
     search = request.args.get('q', '', type=str)
     sort_by = request.args.get('sort', 'id', type=str)
+    count_mode = request.args.get('count', current_app.config['PRODUCTS_COUNT_MODE'], type=str)
+    after = request.args.get('after')
     
-    query = Product.query
+    if count_mode not in COUNT_MODES:
+        return jsonify({'message': f"count must be one of: {', '.join(COUNT_MODES)}"}), 400
+    if per_page < 1 or page < 1:
+        return jsonify({'message': 'page and per_page must be positive'}), 400
+    
+    try:
+        fields = parse_fields(request.args.get('fields'), PRODUCT_FIELDS, PRODUCT_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    products = Product.__table__
+    # Cursor keys ride along as extra columns so sparse fieldsets can still page
+    cursor_columns = [products.c.name, products.c.id] if sort_by == 'name' else [products.c.id]
+    query = select_fields(fields, PRODUCT_FIELDS, products, PRODUCT_JOINS, extra=cursor_columns)
     if search:
-        query = query.filter(Product.name.ilike(f'%{search}%') | Product.sku.ilike(f'%{search}%'))
+        query = query.where(products.c.name.ilike(f'%{search}%') | products.c.sku.ilike(f'%{search}%'))
+    total, count_mode = count_rows(query, count_mode, ('products', search))
+    
+    # Keyset pagination: `after` is the cursor of the last row already seen,
+    # so deep pages seek through the index instead of skipping OFFSET rows.
+    if after:
+        try:
+            last = decode_cursor(after)
+            if sort_by == 'name':
+                last_name, last_id = last
+                query = query.where(or_(products.c.name > last_name,
+                                        and_(products.c.name == last_name, products.c.id > int(last_id))))
+            else:
+                query = query.where(products.c.id > int(last[0]))
+        except (ValueError, TypeError):
+            return jsonify({'message': 'Invalid cursor'}), 400
     
     if sort_by == 'name':
-        query = query.order_by(Product.name.asc())
+        query = query.order_by(products.c.name.asc(), products.c.id.asc())
     else:
-        query = query.order_by(Product.id.asc())
-        
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-    products = pagination.items
-    
-    output = []
-    for product in products:
-        # Calculate current stock
-        # Optimization: In a real app, this should be a joined query or cached field
-        stock_in = db.session.query(db.func.sum(InventoryTransaction.quantity))\
-            .filter_by(product_id=product.id, transaction_type='IN').scalar() or 0
-        stock_out = db.session.query(db.func.sum(InventoryTransaction.quantity))\
-            .filter_by(product_id=product.id, transaction_type='OUT').scalar() or 0
-        current_stock = stock_in - stock_out
-        
-        output.append({
-            'id': product.id,
-            'name': product.name,
-            'sku': product.sku,
-            'category': product.category,
-            'supplier': product.supplier.name,
-            'unit_price': float(product.unit_price),
-            'stock': current_stock,
-            'is_active': product.is_active
-        })
-        
+        query = query.order_by(products.c.id.asc())
+    
+    if not after:
+        query = query.offset((page - 1) * per_page)
+    # One extra row tells us whether another page exists without counting
+    rows = db.session.execute(query.limit(per_page + 1)).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    next_cursor = encode_cursor(list(rows[-1][len(fields):])) if has_next else None
+    
     return jsonify({
-        'products': output,
-        'total': pagination.total,
-        'pages': pagination.pages,
-        'current_page': page
+        'products': serialize_rows(rows, fields, PRODUCT_FIELDS),
+        'total': total,
+        'pages': page_count(total, per_page),
+        'current_page': None if after else page,
+        'count_mode': count_mode,
+        'has_next': has_next,
+        'next_cursor': next_cursor
     }), 200
 
 @products_bp.route('/api/products/<int:id>', methods=['GET'])
@@ -75,6 +102,7 @@ def get_product(current_user, id):
 
 @products_bp.route('/api/products', methods=['POST'])
 @token_required
+@idempotent
 def create_product(current_user):
     data = request.get_json()
     # Basic validation
@@ -82,7 +110,7 @@ def create_product(current_user):
     if not all(k in data for k in required):
         return jsonify({'message': 'Missing fields'}), 400
         
-    if Product.query.filter_by(sku=data['sku']).first():
+    if catalog().sku_owner(data['sku']) is not None:
         return jsonify({'message': 'SKU already exists'}), 400
         
     new_product = Product(
@@ -93,7 +121,14 @@ def create_product(current_user):
         unit_price=data['unit_price']
     )
     db.session.add(new_product)
-    db.session.commit()
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # Possibly taken by a write this worker's index has not seen yet
+        db.session.rollback()
+        if Product.query.filter_by(sku=data['sku']).first():
+            return jsonify({'message': 'SKU already exists'}), 400
+        raise
     
     # Optional: Add initial stock if provided
     if 'initial_stock' in data and int(data['initial_stock']) > 0:
@@ -104,9 +139,10 @@ def create_product(current_user):
             notes='Initial stock'
         )
         db.session.add(trans)
-        db.session.commit()
         
-    return jsonify({'message': 'Product created', 'id': new_product.id}), 201
+    response = commit_response({'message': 'Product created', 'id': new_product.id}, 201)
+    invalidate_counts('products')
+    return response
 
 @products_bp.route('/api/products/<int:id>', methods=['PUT'])
 @token_required
@@ -119,11 +155,17 @@ def update_product(current_user, id):
     if 'unit_price' in data: product.unit_price = data['unit_price']
     # SKU update might be restricted in real world, but allowing here
     if 'sku' in data and data['sku'] != product.sku:
-        if Product.query.filter_by(sku=data['sku']).first():
+        if catalog().sku_owner(data['sku']) is not None:
             return jsonify({'message': 'SKU already exists'}), 400
         product.sku = data['sku']
         
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if 'sku' in data and Product.query.filter_by(sku=data['sku']).first():
+            return jsonify({'message': 'SKU already exists'}), 400
+        raise
     return jsonify({'message': 'Product updated'}), 200
 
 @products_bp.route('/api/products/<int:id>/toggle-active', methods=['PATCH'])
@@ -138,8 +180,255 @@ def toggle_product_active(current_user, id):
 @products_bp.route('/api/products/<int:id>', methods=['DELETE'])
 @token_required
 def delete_product(current_user, id):
+    # Small ledgers are deleted inline in one transaction. Larger ones are
+    # archived at once and purged by a background job, so no request holds a
+    # long delete; ?background=1 forces that mode.
     product = Product.query.get_or_404(id)
-    db.session.delete(product)
+    t = InventoryTransaction.__table__
+    movements = db.session.execute(
+        select(func.count()).select_from(t).where(t.c.product_id == product.id)
+    ).scalar()
+    background = request.args.get('background', type=int)
+    if movements <= current_app.config['PRODUCT_DELETE_SYNC_LIMIT'] and not background:
+        purge_product(product.id)
+        return jsonify({'message': 'Product deleted'}), 200
+    
+    product.is_active = False
+    db.session.commit()
+    job = job_runner.submit('product-purge', {'product_id': product.id}, user_id=current_user.id)
+    return jsonify({'message': 'Product archived; purge queued', 'job_id': job.id, 'movements': movements}), 202
+
+def purge_product(product_id, chunk_size=None, progress=None):
+    # Set-based delete of a product and everything keyed to it; no rows are
+    # loaded into the session. With chunk_size the ledger is deleted in
+    # id-ordered batches, each committed on its own.
+    t = InventoryTransaction.__table__
+    if chunk_size:
+        total = db.session.execute(select(func.count()).select_from(t).where(t.c.product_id == product_id)).scalar()
+        done = 0
+        while True:
+            batch = select(t.c.id).where(t.c.product_id == product_id).order_by(t.c.id).limit(chunk_size)
+            deleted = db.session.execute(
+                delete(t).where(t.c.product_id == product_id, t.c.id.in_(batch.scalar_subquery()))
+            ).rowcount
+            db.session.commit()
+            if not deleted:
+                break
+            done += deleted
+            if progress:
+                progress(done, total)
+    else:
+        db.session.execute(delete(t).where(t.c.product_id == product_id))
+    for table in (CostLayer.__table__, InventoryValuation.__table__, StockCheckpoint.__table__):
+        db.session.execute(delete(table).where(table.c.product_id == product_id))
+    db.session.execute(delete(Product.__table__).where(Product.__table__.c.id == product_id))
+    track_changes(db.session, 'product', [product_id], deleted=True)
+    track_changes(db.session, 'stock', [product_id], deleted=True)
     db.session.commit()
-    return jsonify({'message': 'Product deleted'}), 200
+    invalidate_counts('products')
+    catalog().discard([product_id])
+
+@job_runner.job_type('product-purge', limit=1)
+def product_purge_job(ctx, params):
+    product_id = int(params['product_id'])
+    chunk_size = int(params.get('chunk_size', current_app.config['PRODUCT_PURGE_CHUNK_SIZE']))
+    if db.session.get(Product, product_id) is None:
+        raise ValueError(f'Product {product_id} not found')
+    
+    def progress(done, total):
+        ctx.progress(done, total, f'{done} of {total} movements deleted')
+    purge_product(product_id, chunk_size=chunk_size, progress=progress)
+    return {'product_id': product_id, 'deleted': True}
+
+
+# ==================== BULK UPDATES ====================
 
+BULK_CHUNK_SIZE = 1000
+
+def parse_bulk_changes(data):
+    # Returns (column values for UPDATE ... SET, price factor or None), or raises ValueError
+    changes = data.get('set')
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError("'set' must be an object with unit_price, unit_price_percent, category or is_active")
+    unknown = set(changes) - {'unit_price', 'unit_price_percent', 'category', 'is_active'}
+    if unknown:
+        raise ValueError(f"Unknown fields in 'set': {', '.join(sorted(unknown))}")
+    if 'unit_price' in changes and 'unit_price_percent' in changes:
+        raise ValueError('Use either unit_price or unit_price_percent, not both')
+    
+    values = {}
+    factor = None
+    try:
+        if 'unit_price' in changes:
+            values['unit_price'] = Decimal(str(changes['unit_price'])).quantize(Decimal('0.01'))
+            if not values['unit_price'].is_finite() or values['unit_price'] < 0:
+                raise ValueError
+        if 'unit_price_percent' in changes:
+            factor = 1 + Decimal(str(changes['unit_price_percent'])) / 100
+            if not factor.is_finite() or factor < 0:
+                raise ValueError
+    except (InvalidOperation, ValueError):
+        raise ValueError('unit_price must be a non-negative number and unit_price_percent at least -100')
+    if 'category' in changes:
+        if not isinstance(changes['category'], str) or not changes['category'].strip():
+            raise ValueError('category must be a non-empty string')
+        values['category'] = changes['category'].strip()
+    if 'is_active' in changes:
+        if not isinstance(changes['is_active'], bool):
+            raise ValueError('is_active must be true or false')
+        values['is_active'] = changes['is_active']
+    return values, factor
+
+def bulk_targets(data):
+    # Selects (id, unit_price, category, is_active) for the ids or filter in the body
+    products = Product.__table__
+    query = select(products.c.id, products.c.unit_price, products.c.category, products.c.is_active)
+    ids = data.get('ids')
+    criteria = data.get('filter')
+    if (ids is None) == (criteria is None):
+        raise ValueError("Provide either 'ids' or 'filter'")
+    
+    if ids is not None:
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise ValueError("'ids' must be a non-empty list of integers")
+        ids = list(dict.fromkeys(ids))
+        rows = []
+        for start in range(0, len(ids), BULK_CHUNK_SIZE):
+            chunk = ids[start:start + BULK_CHUNK_SIZE]
+            rows += db.session.execute(query.where(products.c.id.in_(chunk))).all()
+        return ids, rows
+    
+    if not isinstance(criteria, dict) or not criteria:
+        raise ValueError("'filter' must be a non-empty object")
+    unknown = set(criteria) - {'category', 'supplier_id', 'is_active', 'q'}
+    if unknown:
+        raise ValueError(f"Unknown filter fields: {', '.join(sorted(unknown))}")
+    if 'category' in criteria:
+        query = query.where(products.c.category == criteria['category'])
+    if 'supplier_id' in criteria:
+        query = query.where(products.c.supplier_id == criteria['supplier_id'])
+    if 'is_active' in criteria:
+        if not isinstance(criteria['is_active'], bool):
+            raise ValueError('is_active must be true or false')
+        query = query.where(products.c.is_active == criteria['is_active'])
+    if criteria.get('q'):
+        search = criteria['q']
+        query = query.where(products.c.name.ilike(f'%{search}%') | products.c.sku.ilike(f'%{search}%'))
+    rows = db.session.execute(query.order_by(products.c.id)).all()
+    return None, rows
+
+def apply_bulk_update(data, values, factor):
+    requested, rows = bulk_targets(data)
+    limit = current_app.config['PRODUCTS_BULK_LIMIT']
+    if len(rows) > limit:
+        raise ValueError(f'{len(rows)} products matched; at most {limit} can be changed per request')
+    
+    products = Product.__table__
+    changed = []
+    outcome = {}
+    for product_id, unit_price, category, is_active in rows:
+        current = {'unit_price': unit_price, 'category': category, 'is_active': is_active}
+        differs = any(current[k] != v for k, v in values.items())
+        if factor is not None and factor != 1 and unit_price:
+            differs = True
+        outcome[product_id] = 'updated' if differs else 'unchanged'
+        if differs:
+            changed.append(product_id)
+    
+    # Every row gets the same SET, so the whole change is one UPDATE per chunk
+    set_values = dict(values)
+    if factor is not None:
+        set_values['unit_price'] = func.round(products.c.unit_price * factor, 2)
+    for start in range(0, len(changed), BULK_CHUNK_SIZE):
+        chunk = changed[start:start + BULK_CHUNK_SIZE]
+        db.session.execute(update(products).where(products.c.id.in_(chunk)).values(**set_values))
+    track_changes(db.session, 'product', changed)
+    
+    order = requested if requested is not None else [row[0] for row in rows]
+    results = [{'id': i, 'status': outcome.get(i, 'not_found')} for i in order]
+    summary = {status: sum(1 for r in results if r['status'] == status)
+               for status in ('updated', 'unchanged', 'not_found')}
+    response = commit_response({'message': f"{summary['updated']} products updated", 'matched': len(rows),
+                                **summary, 'results': results}, 200)
+    catalog().discard(changed)
+    return response
+
+@products_bp.route('/api/products/bulk', methods=['PATCH'])
+@token_required
+@idempotent
+def bulk_update_products(current_user):
+    # Body: {"ids": [...]} or {"filter": {...}}, plus
+    # {"set": {"unit_price" | "unit_price_percent", "category", "is_active"}}
+    data = request.get_json() or {}
+    try:
+        values, factor = parse_bulk_changes(data)
+        return apply_bulk_update(data, values, factor)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 400
+
+@products_bp.route('/api/products/bulk/archive', methods=['PATCH'])
+@token_required
+@idempotent
+def bulk_archive_products(current_user):
+    # Same selection as /bulk; archives (or with {"is_active": true} restores) the matches
+    data = request.get_json() or {}
+    is_active = data.get('is_active', False)
+    if not isinstance(is_active, bool):
+        return jsonify({'message': 'is_active must be true or false'}), 400
+    try:
+        return apply_bulk_update(data, {'is_active': is_active}, None)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 400
+
+
+# ==================== SKU LOOKUP ====================
+
+def lookup_skus(skus, fields):
+    # Exact matches through the unique SKU index, one query per chunk, with
+    # stock computed in the same statement; returns {sku: row}
+    products = Product.__table__
+    query = select_fields(fields, PRODUCT_FIELDS, products, PRODUCT_JOINS, extra=[products.c.sku])
+    found = {}
+    for start in range(0, len(skus), BULK_CHUNK_SIZE):
+        chunk = skus[start:start + BULK_CHUNK_SIZE]
+        for row in db.session.execute(query.where(products.c.sku.in_(chunk))):
+            found[row[-1]] = row
+    return found
+
+@products_bp.route('/api/products/by-sku/<path:sku>', methods=['GET'])
+@token_required
+def get_product_by_sku(current_user, sku):
+    try:
+        fields = parse_fields(request.args.get('fields'), PRODUCT_FIELDS, PRODUCT_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    row = lookup_skus([sku], fields).get(sku)
+    if row is None:
+        return jsonify({'message': 'Product not found'}), 404
+    return jsonify(serialize_rows([row], fields, PRODUCT_FIELDS)[0]), 200
+
+@products_bp.route('/api/products/lookup', methods=['POST'])
+@token_required
+def lookup_products(current_user):
+    # Body: {"skus": [...]}; products come back in request order, unknown
+    # SKUs are listed under not_found
+    data = request.get_json(silent=True) or {}
+    skus = data.get('skus')
+    if not isinstance(skus, list) or not skus or not all(isinstance(s, str) and s for s in skus):
+        return jsonify({'message': "'skus' must be a non-empty list of strings"}), 400
+    skus = list(dict.fromkeys(skus))
+    limit = current_app.config['PRODUCTS_LOOKUP_LIMIT']
+    if len(skus) > limit:
+        return jsonify({'message': f'At most {limit} SKUs can be looked up per request'}), 400
+    try:
+        fields = parse_fields(request.args.get('fields'), PRODUCT_FIELDS, PRODUCT_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    found = lookup_skus(skus, fields)
+    return jsonify({
+        'products': serialize_rows([found[s] for s in skus if s in found], fields, PRODUCT_FIELDS),
+        'not_found': [s for s in skus if s not in found]
+    }), 200
@@ -0,0 +1,29 @@
+import os
+from flask import Blueprint, jsonify, send_file, current_app
+from app.auth import token_required, admin_required
+from app.profiling import CAPTURE_ID, list_captures, profiles_dir
+
+profiles_bp = Blueprint('profiles', __name__)
+
+DOWNLOAD_TYPES = {
+    'pstats': 'application/octet-stream',
+    'collapsed': 'text/plain',
+    'json': 'application/json',
+}
+
+@profiles_bp.route('/api/admin/profiles', methods=['GET'])
+@token_required
+@admin_required
+def get_profiles(current_user):
+    return jsonify(list_captures(current_app)), 200
+
+@profiles_bp.route('/api/admin/profiles/<capture_id>.<kind>', methods=['GET'])
+@token_required
+@admin_required
+def download_profile(current_user, capture_id, kind):
+    if not CAPTURE_ID.match(capture_id) or kind not in DOWNLOAD_TYPES:
+        return jsonify({'message': 'Profile not found'}), 404
+    path = os.path.join(profiles_dir(current_app), f'{capture_id}.{kind}')
+    if not os.path.exists(path):
+        return jsonify({'message': 'Profile not found'}), 404
+    return send_file(path, mimetype=DOWNLOAD_TYPES[kind], as_attachment=True, download_name=f'{capture_id}.{kind}')
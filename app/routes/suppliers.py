@@ -2,26 +2,26 @@ from flask import Blueprint, request, jsonify
 from app.models import Supplier
 from app import db
 from app.auth import token_required
+from app.idempotency import commit_response, idempotent
+from app.projections import SUPPLIER_FIELDS, SUPPLIER_DEFAULT_FIELDS, parse_fields, select_fields, serialize_rows
 
 suppliers_bp = Blueprint('suppliers', __name__)
 
 @suppliers_bp.route('/api/suppliers', methods=['GET'])
 @token_required
 def get_suppliers(current_user):
-    suppliers = Supplier.query.all()
-    output = []
-    for s in suppliers:
-        output.append({
-            'id': s.id,
-            'name': s.name,
-            'contact_email': s.contact_email,
-            'phone': s.phone,
-            'address': s.address
-        })
-    return jsonify(output), 200
+    try:
+        fields = parse_fields(request.args.get('fields'), SUPPLIER_FIELDS, SUPPLIER_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    suppliers = Supplier.__table__
+    query = select_fields(fields, SUPPLIER_FIELDS, suppliers).order_by(suppliers.c.id.asc())
+    rows = db.session.execute(query).all()
+    return jsonify(serialize_rows(rows, fields, SUPPLIER_FIELDS)), 200
 
 @suppliers_bp.route('/api/suppliers', methods=['POST'])
 @token_required
+@idempotent
 def create_supplier(current_user):
     data = request.get_json()
     if not data.get('name'):
@@ -37,5 +37,5 @@ def create_supplier(current_user):
         address=data.get('address')
     )
     db.session.add(new_supplier)
-    db.session.commit()
-    return jsonify({'message': 'Supplier created', 'id': new_supplier.id}), 201
+    db.session.flush()
+    return commit_response({'message': 'Supplier created', 'id': new_supplier.id}, 201)
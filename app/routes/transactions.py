@@ -1,12 +1,23 @@
-from flask import Blueprint, request, jsonify
+import csv
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from flask import Blueprint, request, jsonify, current_app
 from app.models import InventoryTransaction, Product
+from sqlalchemy.exc import IntegrityError
 from app import db
 from app.auth import token_required
+from app.catalog import catalog
+from app.groupcommit import group_committer
+from app.idempotency import commit_response, idempotent
+from app.jobs import job_runner
+from app.projections import TRANSACTION_FIELDS, TRANSACTION_DEFAULT_FIELDS, TRANSACTION_JOINS, parse_fields, \
+    select_fields, serialize_rows
 
 transactions_bp = Blueprint('transactions', __name__)
 
 @transactions_bp.route('/api/transactions', methods=['POST'])
 @token_required
+@idempotent
 def create_transaction(current_user):
     data = request.get_json()
     required = ['product_id', 'quantity', 'transaction_type']
@@ -18,11 +29,35 @@ def create_transaction(current_user):
         
     if int(data['quantity']) <= 0:
         return jsonify({'message': 'Quantity must be positive'}), 400
+    
+    # Receipts may carry their purchase cost; otherwise the list price is used
+    unit_cost = data.get('unit_cost')
+    if unit_cost is not None:
+        try:
+            unit_cost = Decimal(str(unit_cost))
+        except InvalidOperation:
+            return jsonify({'message': 'Invalid unit_cost'}), 400
+        if data['transaction_type'] != 'IN' or not unit_cost.is_finite() or unit_cost < 0:
+            return jsonify({'message': 'unit_cost must be non-negative and only set on IN transactions'}), 400
         
-    # Check if product exists
-    product = Product.query.get(data['product_id'])
+    # Check if product exists (served from the worker's catalog index)
+    try:
+        product = catalog().get(int(data['product_id']))
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Invalid product_id'}), 400
     if not product:
         return jsonify({'message': 'Product not found'}), 404
+    
+    if current_app.config['GROUP_COMMIT']:
+        # Committed with other queued movements; the stock check runs there
+        status, body = group_committer().submit({
+            'product_id': product.id,
+            'quantity': int(data['quantity']),
+            'transaction_type': data['transaction_type'],
+            'notes': data.get('notes'),
+            'unit_cost': unit_cost
+        }, current_app.config['GROUP_COMMIT_TIMEOUT'])
+        return jsonify(body), status
         
     # For OUT transactions, check stock
     if data['transaction_type'] == 'OUT':
@@ -39,33 +74,88 @@ def create_transaction(current_user):
         product_id=data['product_id'],
         quantity=data['quantity'],
         transaction_type=data['transaction_type'],
-        notes=data.get('notes')
+        notes=data.get('notes'),
+        unit_cost=unit_cost
     )
     db.session.add(new_trans)
-    db.session.commit()
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # Deleted by another worker since this worker's index was loaded
+        db.session.rollback()
+        catalog().discard([product.id])
+        return jsonify({'message': 'Product not found'}), 404
     
-    return jsonify({'message': 'Transaction recorded', 'id': new_trans.id}), 201
+    return commit_response({'message': 'Transaction recorded', 'id': new_trans.id}, 201)
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    return datetime.fromisoformat(value) if value else None
 
 @transactions_bp.route('/api/transactions', methods=['GET'])
 @token_required
 def get_transactions(current_user):
     # Optional filters
     product_id = request.args.get('product_id')
+    if product_id is not None:
+        try:
+            product_id = int(product_id)
+        except ValueError:
+            return jsonify({'message': 'Invalid product_id'}), 400
+    try:
+        start = parse_date_arg('start')
+        end = parse_date_arg('end')
+    except ValueError:
+        return jsonify({'message': 'Invalid date, expected ISO 8601'}), 400
     
-    query = InventoryTransaction.query
-    if product_id:
-        query = query.filter_by(product_id=product_id)
-        
-    transactions = query.order_by(InventoryTransaction.transaction_date.desc()).limit(100).all()
+    try:
+        fields = parse_fields(request.args.get('fields'), TRANSACTION_FIELDS, TRANSACTION_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    t = InventoryTransaction.__table__
+    query = select_fields(fields, TRANSACTION_FIELDS, t, TRANSACTION_JOINS)
+    if product_id is not None:
+        query = query.where(t.c.product_id == product_id)
+    # Date bounds let a partitioned ledger prune to the matching months
+    if start:
+        query = query.where(t.c.transaction_date >= start)
+    if end:
+        query = query.where(t.c.transaction_date < end)
     
-    output = []
-    for t in transactions:
-        output.append({
-            'id': t.id,
-            'product_name': t.product.name,
-            'quantity': t.quantity,
-            'type': t.transaction_type,
-            'date': t.transaction_date.isoformat(),
-            'notes': t.notes
-        })
-    return jsonify(output), 200
+    rows = db.session.execute(query.order_by(t.c.transaction_date.desc()).limit(100)).all()
+    return jsonify(serialize_rows(rows, fields, TRANSACTION_FIELDS)), 200
+
+
+# ==================== BACKGROUND JOBS ====================
+
+EXPORT_COLUMNS = ['id', 'product_id', 'sku', 'product_name', 'type', 'quantity', 'date', 'notes']
+
+@job_runner.job_type('transactions-export', limit=1)
+def transactions_export_job(ctx, params):
+    chunk_size = int(params.get('chunk_size', 5000))
+    query = db.session.query(InventoryTransaction, Product.sku, Product.name)\
+        .join(Product, InventoryTransaction.product_id == Product.id)
+    if params.get('product_id'):
+        query = query.filter(InventoryTransaction.product_id == int(params['product_id']))
+    total = query.count()
+
+    written = 0
+    last_id = 0
+    with ctx.open_result('csv', 'text/csv') as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        while True:
+            # Keyset chunks keep every statement short instead of holding one cursor open
+            rows = query.filter(InventoryTransaction.id > last_id)\
+                .order_by(InventoryTransaction.id.asc()).limit(chunk_size).all()
+            if not rows:
+                break
+            for t, sku, name in rows:
+                writer.writerow([t.id, t.product_id, sku, name, t.transaction_type, t.quantity,
+                                 t.transaction_date.isoformat(), t.notes or ''])
+            written += len(rows)
+            last_id = rows[-1][0].id
+            db.session.expunge_all()
+            ctx.progress(written, total, f'{written} of {total} transactions')
+    return None
@@ -0,0 +1,69 @@
+import threading
+from functools import wraps
+from flask import current_app
+from app.metrics import metrics
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+
+    def finish(self):
+        self.done.set()
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution: the first
+    # caller runs the function and the rest wait for its result (or error).
+    # Nothing is cached once the call finishes, so results are never stale.
+    call_class = _Call
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        # Returns (result, shared) where shared is True for callers that waited
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self.call_class()
+        if not leader:
+            call.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.finish()
+
+
+def singleflight():
+    return current_app.extensions.setdefault('singleflight', SingleFlight())
+
+def coalesce(name):
+    # Coalesces concurrent calls with equal positional arguments within a
+    # worker; counts executions and coalesced calls as metrics.
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args):
+            result, shared = singleflight().do((name,) + args, lambda: f(*args))
+            metrics().incr(f"singleflight.{name}.{'coalesced' if shared else 'executed'}")
+            return result
+        return wrapper
+    return decorator
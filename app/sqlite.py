@@ -0,0 +1,96 @@
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from app import db
+
+# Requests with these methods only read, so they never take the write lock
+READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+# POST endpoints that take a request body but only read. A batch only fans
+# out GET sub-requests, each in its own request and session.
+READ_ENDPOINTS = frozenset(('products.lookup_products', 'batch.batch'))
+# Execution option that starts a transaction with BEGIN IMMEDIATE outside a
+# write request, for background writers
+IMMEDIATE_OPTION = 'sqlite_begin_immediate'
+# Pool options that only make sense for a database server
+SERVER_POOL_OPTIONS = ('pool_pre_ping', 'pool_recycle')
+
+
+def is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:') \
+        and not url.database.startswith('file::memory:')
+
+def apply_engine_options(config):
+    # Called before db.init_app. A local file needs no liveness pings or
+    # recycling; the pool itself is kept so each worker thread reuses a
+    # connection with a warm page cache instead of reopening the file.
+    if not config['SQLITE_PROFILE'] or not is_sqlite_file(config['SQLALCHEMY_DATABASE_URI']):
+        return
+    options = {k: v for k, v in config['SQLALCHEMY_ENGINE_OPTIONS'].items() if k not in SERVER_POOL_OPTIONS}
+    connect_args = dict(options.get('connect_args', {}))
+    connect_args['timeout'] = config['SQLITE_BUSY_TIMEOUT_MS'] / 1000
+    options['connect_args'] = connect_args
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+def init_app(app):
+    # Called after db.init_app, once the engines exist
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                enforce_foreign_keys(engine)
+    if not app.config['SQLITE_PROFILE']:
+        return
+    with app.app_context():
+        engines = [engine for engine in db.engines.values() if is_sqlite_file(engine.url)]
+    for engine in engines:
+        configure_engine(engine, app.config)
+    if engines:
+        # A write request's lock is held until its transaction ends, which
+        # must not wait for the app context when that outlives the request
+        app.teardown_request(lambda exc: db.session.remove())
+
+def enforce_foreign_keys(engine):
+    # SQLite only checks foreign keys on connections that ask for it. Without
+    # this a movement for a product another worker just deleted is accepted,
+    # since the write path relies on the IntegrityError to catch it.
+    @event.listens_for(engine, 'connect')
+    def set_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+def configure_engine(engine, config):
+    pragmas = [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        # Negative cache_size is in KiB rather than pages
+        f"PRAGMA cache_size={-int(config['SQLITE_CACHE_SIZE_KB'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+    ]
+    immediate_writes = config['SQLITE_IMMEDIATE_WRITES']
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+        # Elsewhere the driver begins at the first INSERT/UPDATE/DELETE, and
+        # IMMEDIATE makes it take the write lock there
+        if immediate_writes:
+            dbapi_connection.isolation_level = 'IMMEDIATE'
+
+    @event.listens_for(engine, 'begin')
+    def begin(conn):
+        # Write requests take the write lock as soon as their transaction
+        # starts, so the reads they base a write on (stock checks) cannot be
+        # overtaken by another writer, and writers queue on busy_timeout.
+        # Upgrading a deferred transaction whose snapshot is stale fails
+        # with "database is locked" without waiting.
+        if not immediate_writes:
+            return
+        if conn.get_execution_options().get(IMMEDIATE_OPTION) or \
+                (has_request_context() and request.method not in READ_METHODS
+                 and request.endpoint not in READ_ENDPOINTS):
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
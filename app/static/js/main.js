@@ -39,3 +39,13 @@ async function apiCall(url, method = 'GET', body = null) {
     }
     return response;
 }
+
+// Several GET requests in one round trip; resolves to [{status, body}] in order
+async function apiBatch(paths) {
+    const res = await apiCall('/api/batch', 'POST', {
+        requests: paths.map((path, i) => ({ id: i, path }))
+    });
+    if (!res || !res.ok) return paths.map(() => ({ status: res ? res.status : 401, body: null }));
+    const data = await res.json();
+    return data.responses;
+}
@@ -0,0 +1,285 @@
+from datetime import datetime
+from decimal import Decimal
+from flask import current_app, has_app_context
+from sqlalchemy import event, select, insert, update, delete, inspect, text
+from app import db
+from app.changes import track_changes
+from app.models import Product, InventoryTransaction, CostLayer, InventoryValuation
+
+METHODS = ('fifo', 'average')
+PRECISION = Decimal('0.0001')
+ZERO = Decimal(0)
+
+transactions = InventoryTransaction.__table__
+layers_table = CostLayer.__table__
+valuations = InventoryValuation.__table__
+products = Product.__table__
+
+
+def _money(value):
+    return Decimal(value).quantize(PRECISION)
+
+
+class ProductValuation:
+    # In-memory valuation state for one product. The incremental write path
+    # and the audit replay both drive the same receive/issue logic.
+    __slots__ = ('quantity', 'value', 'last_cost', 'layers')
+
+    def __init__(self, quantity=0, value=ZERO, last_cost=None, layers=None):
+        self.quantity = quantity
+        self.value = _money(value)
+        self.last_cost = last_cost
+        # [layer_id, unit_cost, remaining] in FIFO order
+        self.layers = layers if layers is not None else []
+
+    def receive(self, quantity, unit_cost, layer_id=None):
+        unit_cost = _money(unit_cost)
+        self.quantity += quantity
+        self.value = _money(self.value + quantity * unit_cost)
+        self.last_cost = unit_cost
+        self.layers.append([layer_id, unit_cost, quantity])
+
+    def issue(self, quantity, method):
+        # Layers are always drawn down FIFO so receipts stay traceable; the
+        # method decides what the issue costs. Returns the touched layers.
+        touched = []
+        fifo_cost = ZERO
+        remaining = quantity
+        for layer in self.layers:
+            if remaining == 0:
+                break
+            if layer[2] <= 0:
+                continue
+            take = min(layer[2], remaining)
+            layer[2] -= take
+            remaining -= take
+            fifo_cost += take * layer[1]
+            touched.append(layer)
+        fallback = self.average_cost() if method == 'average' else (self.last_cost or ZERO)
+        # Issuing more than is on hand is costed at the fallback cost
+        fifo_cost += remaining * fallback
+
+        cost = quantity * self.average_cost() if method == 'average' and self.quantity > 0 else fifo_cost
+        self.quantity -= quantity
+        self.value = _money(self.value - cost) if self.quantity else ZERO
+        self.layers = [layer for layer in self.layers if layer[2] > 0]
+        return touched
+
+    def average_cost(self):
+        if self.quantity > 0:
+            return self.value / self.quantity
+        return self.last_cost or ZERO
+
+    def opening_layers(self):
+        # (quantity, unit_cost) pairs that reproduce this state when received
+        # in order; used to carry the cost basis forward when history is archived.
+        if self.quantity <= 0:
+            return []
+        if sum(layer[2] for layer in self.layers) == self.quantity:
+            return [(layer[2], layer[1]) for layer in self.layers]
+        return [(self.quantity, _money(self.average_cost()))]
+
+
+def valuation_method(app=None):
+    method = (app or current_app).config.get('INVENTORY_VALUATION_METHOD', 'fifo')
+    if method not in METHODS:
+        raise ValueError(f'INVENTORY_VALUATION_METHOD must be one of {METHODS}')
+    return method
+
+def skip_valuation(trans):
+    return bool(trans.is_opening)
+
+
+# ==================== INCREMENTAL MAINTENANCE ====================
+
+def _claim_row(conn, product_id):
+    # Creates the product's valuation row if missing without racing a
+    # concurrent writer, so the row can always be locked before it is read.
+    # Dialect modules are imported here so workers only load the one they use
+    values = {'product_id': product_id, 'quantity': 0, 'total_value': ZERO, 'updated_at': datetime.utcnow()}
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        conn.execute(pg_insert(valuations).values(**values).on_conflict_do_nothing())
+    elif conn.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        conn.execute(sqlite_insert(valuations).values(**values).on_conflict_do_nothing())
+    elif conn.execute(select(valuations.c.product_id).where(valuations.c.product_id == product_id)).first() is None:
+        conn.execute(insert(valuations).values(**values))
+
+def _load_state(conn, product_id, with_layers):
+    _claim_row(conn, product_id)
+    row = conn.execute(
+        select(valuations.c.quantity, valuations.c.total_value, valuations.c.last_unit_cost)
+        .where(valuations.c.product_id == product_id).with_for_update()
+    ).first()
+    state = ProductValuation(row[0], row[1], row[2])
+    if with_layers:
+        state.layers = [list(r) for r in conn.execute(
+            select(layers_table.c.id, layers_table.c.unit_cost, layers_table.c.quantity_remaining)
+            .where(layers_table.c.product_id == product_id, layers_table.c.quantity_remaining > 0)
+            .order_by(layers_table.c.received_at, layers_table.c.id)
+        )]
+    return state
+
+def _save_state(conn, product_id, state, exists=True):
+    values = {
+        'quantity': state.quantity,
+        'total_value': state.value,
+        'last_unit_cost': state.last_cost,
+        'updated_at': datetime.utcnow()
+    }
+    if exists:
+        conn.execute(update(valuations).where(valuations.c.product_id == product_id).values(**values))
+    else:
+        conn.execute(insert(valuations).values(product_id=product_id, **values))
+
+def record_movement(conn, trans, method):
+    state = _load_state(conn, trans.product_id, with_layers=trans.transaction_type == 'OUT')
+    if trans.transaction_type == 'IN':
+        state.receive(trans.quantity, trans.unit_cost)
+        conn.execute(insert(layers_table).values(
+            product_id=trans.product_id,
+            transaction_id=trans.id,
+            received_at=trans.transaction_date or datetime.utcnow(),
+            unit_cost=_money(trans.unit_cost),
+            quantity_received=trans.quantity,
+            quantity_remaining=trans.quantity
+        ))
+    else:
+        for layer_id, _, remaining in state.issue(trans.quantity, method):
+            conn.execute(update(layers_table).where(layers_table.c.id == layer_id)
+                         .values(quantity_remaining=remaining))
+    _save_state(conn, trans.product_id, state)
+
+def _new_movements(session):
+    return [obj for obj in session.new if isinstance(obj, InventoryTransaction) and not skip_valuation(obj)]
+
+@event.listens_for(db.session, 'before_flush')
+def _default_unit_cost(session, flush_context, instances):
+    # Receipts without an explicit cost are valued at the product's list price
+    pending = [t for t in _new_movements(session) if t.transaction_type == 'IN' and t.unit_cost is None]
+    if not pending:
+        return
+    product_ids = {t.product_id for t in pending}
+    prices = dict(session.connection().execute(
+        select(products.c.id, products.c.unit_price).where(products.c.id.in_(product_ids))
+    ).all())
+    for trans in pending:
+        trans.unit_cost = prices.get(trans.product_id, ZERO)
+
+@event.listens_for(db.session, 'after_flush')
+def _maintain_valuation(session, flush_context):
+    movements = _new_movements(session)
+    if not movements or not has_app_context():
+        return
+    method = valuation_method()
+    conn = session.connection()
+    for trans in sorted(movements, key=lambda t: (t.transaction_date or datetime.utcnow(), t.id)):
+        record_movement(conn, trans, method)
+
+
+# ==================== AUDIT / FULL RECOMPUTE ====================
+
+def ensure_schema():
+    # Databases created before cost tracking lack the ledger's unit_cost
+    # column, and those from before the is_opening flag marked opening rows
+    # by their note alone; those rows are flagged once here
+    from app.archive import ARCHIVE_OPENING_NOTE
+    columns = {c['name'] for c in inspect(db.engine).get_columns(transactions.name)}
+    if 'unit_cost' not in columns:
+        db.session.execute(text(f'ALTER TABLE {transactions.name} ADD COLUMN unit_cost NUMERIC(12, 4)'))
+    if 'is_opening' not in columns:
+        db.session.execute(text(
+            f'ALTER TABLE {transactions.name} ADD COLUMN is_opening BOOLEAN NOT NULL DEFAULT FALSE'
+        ))
+        db.session.execute(update(transactions).where(transactions.c.notes == ARCHIVE_OPENING_NOTE)
+                           .values(is_opening=True))
+    db.session.commit()
+
+def replay_ledger(method, chunk_size=5000, progress=None):
+    # Replays the whole ledger in (product, date, id) order and yields
+    # (product_id, state, layers) per product; rows are fetched in keyset chunks.
+    prices = dict(db.session.execute(select(products.c.id, products.c.unit_price)).all())
+    total = db.session.execute(select(db.func.count()).select_from(transactions)).scalar() or 0
+    t = transactions.c
+    last_key = None
+    current, state, layers, seen = None, None, None, 0
+    while True:
+        query = select(t.product_id, t.transaction_date, t.id, t.transaction_type, t.quantity, t.unit_cost)\
+            .order_by(t.product_id, t.transaction_date, t.id).limit(chunk_size)
+        if last_key is not None:
+            pid, when, tid = last_key
+            query = query.where(db.or_(
+                t.product_id > pid,
+                db.and_(t.product_id == pid, db.or_(t.transaction_date > when,
+                                                    db.and_(t.transaction_date == when, t.id > tid)))
+            ))
+        rows = db.session.execute(query).all()
+        if not rows:
+            break
+        for product_id, when, trans_id, trans_type, quantity, unit_cost in rows:
+            if product_id != current:
+                if current is not None:
+                    yield current, state, layers
+                current, state, layers = product_id, ProductValuation(), []
+            if trans_type == 'IN':
+                cost = unit_cost if unit_cost is not None else prices.get(product_id, ZERO)
+                layer = {'transaction_id': trans_id, 'received_at': when, 'unit_cost': _money(cost),
+                         'quantity_received': quantity}
+                layers.append(layer)
+                state.receive(quantity, cost, layer_id=len(layers) - 1)
+            else:
+                state.issue(quantity, method)
+        seen += len(rows)
+        last_key = rows[-1][:3]
+        if progress:
+            progress(seen, total)
+    if current is not None:
+        yield current, state, layers
+
+def audit_valuation(fix=False, progress=None):
+    method = valuation_method()
+    stored = {row[0]: row for row in db.session.execute(
+        select(valuations.c.product_id, valuations.c.quantity, valuations.c.total_value)
+    )}
+    report = {'method': method, 'products_checked': 0, 'mismatches': []}
+    replayed = set()
+    for product_id, state, layers in replay_ledger(method, progress=progress):
+        replayed.add(product_id)
+        report['products_checked'] += 1
+        row = stored.get(product_id)
+        quantity, value = (row[1], _money(row[2])) if row else (0, ZERO)
+        if quantity != state.quantity or abs(value - state.value) > Decimal('0.01'):
+            report['mismatches'].append({
+                'product_id': product_id,
+                'stored_quantity': quantity, 'expected_quantity': state.quantity,
+                'stored_value': float(value), 'expected_value': float(state.value)
+            })
+        if fix:
+            _rewrite_product(product_id, state, layers)
+    for product_id in set(stored) - replayed:
+        row = stored[product_id]
+        if row[1] or row[2]:
+            report['mismatches'].append({
+                'product_id': product_id,
+                'stored_quantity': row[1], 'expected_quantity': 0,
+                'stored_value': float(row[2]), 'expected_value': 0.0
+            })
+        if fix:
+            _rewrite_product(product_id, ProductValuation(), [])
+    if fix:
+        track_changes(db.session, 'stock', [m['product_id'] for m in report['mismatches']])
+        db.session.commit()
+    report['mismatch_count'] = len(report['mismatches'])
+    return report
+
+def _rewrite_product(product_id, state, layers):
+    remaining = {layer[0]: layer[2] for layer in state.layers}
+    db.session.execute(delete(layers_table).where(layers_table.c.product_id == product_id))
+    db.session.execute(delete(valuations).where(valuations.c.product_id == product_id))
+    if layers:
+        db.session.execute(insert(layers_table), [
+            dict(layer, product_id=product_id, quantity_remaining=remaining.get(i, 0))
+            for i, layer in enumerate(layers)
+        ])
+    _save_state(db.session.connection(), product_id, state, exists=False)
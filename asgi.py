@@ -0,0 +1,5 @@
+from app.aio import create_asgi_app
+from run import app as wsgi_app
+
+# Optional async serving mode: uvicorn asgi:app --workers 4
+app = create_asgi_app(wsgi_app)
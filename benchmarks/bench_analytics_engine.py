@@ -0,0 +1,120 @@
+"""Analytics latency of the SQL aggregates vs the in-memory NumPy engine.
+
+Seeds a ledger, then times each dashboard aggregate per call with both
+engines, the NumPy engine's initial load, a refresh that appends a batch of
+new rows, and the snapshot's memory per ledger row. Per-call NumPy times are
+shown both with a refresh on every call and served from a fresh snapshot
+(within ANALYTICS_REFRESH_INTERVAL).
+
+Usage: python benchmarks/bench_analytics_engine.py [--products 10000] [--transactions 1000000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.columnar import ledger_snapshot  # noqa: E402
+from app.models import Product, Supplier, InventoryTransaction, InventoryValuation  # noqa: E402
+from app.routes import analytics  # noqa: E402
+from config import Config  # noqa: E402
+
+SECTIONS = ['top_selling', 'low_stock', 'stock_value', 'stock_by_category', 'products_by_supplier']
+
+
+def make_app(path):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+    return create_app(BenchConfig)
+
+def seed(products, transactions, rng):
+    db.session.execute(Supplier.__table__.insert(), [{'name': f'Supplier {i}'} for i in range(20)])
+    db.session.execute(Product.__table__.insert(), [{
+        'name': f'Product {i}',
+        'sku': f'SKU-{i:08d}',
+        'category': f'Category {i % 25}',
+        'supplier_id': 1 + i % 20,
+        'unit_price': 10 + i % 500,
+        'is_active': i % 10 != 0
+    } for i in range(products)])
+    db.session.execute(InventoryValuation.__table__.insert(), [{
+        'product_id': i + 1, 'quantity': 100, 'total_value': 1000
+    } for i in range(products)])
+    start = datetime(2023, 1, 1)
+    batch = []
+    for i in range(transactions):
+        batch.append({
+            'product_id': rng.randint(1, products),
+            'quantity': rng.randint(1, 20),
+            'transaction_type': 'IN' if rng.random() < 0.55 else 'OUT',
+            'transaction_date': start + timedelta(seconds=i * 30)
+        })
+        if len(batch) == 50000:
+            db.session.execute(InventoryTransaction.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(InventoryTransaction.__table__.insert(), batch)
+    db.session.commit()
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            db.create_all()
+            seed(args.products, args.transactions, rng)
+            print(f'{args.products} products, {args.transactions} ledger rows')
+
+            app.config['ANALYTICS_ENGINE'] = 'numpy'
+            snapshot = ledger_snapshot()
+            start = time.perf_counter()
+            snapshot.refresh(force=True)
+            ledger = snapshot.ledger
+            row_bytes = ledger.product_ids.itemsize + ledger.quantities.itemsize + ledger.timestamps.itemsize
+            print(f'numpy initial load: {(time.perf_counter() - start) * 1000:.0f}ms, {row_bytes} B/row')
+
+            print(f"\n{'aggregate':<24}{'sql ms':>10}{'numpy ms':>10}{'cached ms':>11}")
+            for name in SECTIONS:
+                compute = getattr(analytics, f'{name}_data')
+                app.config['ANALYTICS_ENGINE'] = 'sql'
+                sql_ms = timed(compute, args.repeat)
+                app.config['ANALYTICS_ENGINE'] = 'numpy'
+                snapshot.interval = 0
+                numpy_ms = timed(compute, args.repeat)
+                snapshot.interval = 3600
+                cached_ms = timed(compute, args.repeat)
+                print(f'{name:<24}{sql_ms:>10.1f}{numpy_ms:>10.1f}{cached_ms:>11.1f}')
+
+            db.session.execute(InventoryTransaction.__table__.insert(), [{
+                'product_id': rng.randint(1, args.products), 'quantity': 1, 'transaction_type': 'OUT',
+                'transaction_date': datetime(2030, 1, 1)
+            } for _ in range(1000)])
+            db.session.commit()
+            print(f'\nnumpy refresh after 1000 new rows: {timed(lambda: snapshot.refresh(force=True), 1):.1f}ms')
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
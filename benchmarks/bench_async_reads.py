@@ -0,0 +1,162 @@
+"""Read throughput per worker: gunicorn sync worker vs the async serving mode.
+
+Seeds a database, then serves it with one gunicorn sync worker (run:app) and
+with one uvicorn worker (asgi:app, async driver on the read endpoints) and
+drives each with the same concurrent clients on the analytics, product and
+transaction listing endpoints. Point --database-url at PostgreSQL to measure
+the case the async mode is for: workers waiting on the database.
+
+Usage: python benchmarks/bench_async_reads.py [--clients 32] [--duration 15] [--database-url postgresql://...]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEED = """
+import random, sys
+from datetime import datetime, timedelta
+from werkzeug.security import generate_password_hash
+from app import create_app, db
+from app.models import User, Supplier, Product, InventoryTransaction
+products, transactions = int(sys.argv[1]), int(sys.argv[2])
+rng = random.Random(42)
+app = create_app()
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    db.session.add(User(username='bench', password_hash=generate_password_hash('bench')))
+    db.session.add(Supplier(name='Bench Supplier'))
+    db.session.commit()
+    db.session.execute(Product.__table__.insert(), [{
+        'name': f'Product {i}', 'sku': f'SKU-{i:08d}', 'category': f'Category {i % 25}', 'supplier_id': 1,
+        'unit_price': 10 + i % 500} for i in range(products)])
+    db.session.execute(InventoryTransaction.__table__.insert(), [{
+        'product_id': rng.randint(1, products), 'quantity': rng.randint(1, 20),
+        'transaction_type': 'IN' if rng.random() < 0.6 else 'OUT',
+        'transaction_date': datetime(2024, 1, 1) + timedelta(minutes=i)} for i in range(transactions)])
+    db.session.commit()
+"""
+
+PATHS = [
+    '/api/products?per_page=50&count=none',
+    '/api/transactions',
+    '/api/analytics/stock-by-category',
+    '/api/analytics/low-stock',
+    '/api/analytics/top-selling',
+]
+
+SERVERS = [
+    ('sync', [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app']),
+    ('async', [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', '{port}',
+               '--workers', '1', '--no-access-log', '--log-level', 'warning']),
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_healthy(port, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as res:
+                if res.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('server did not answer in time')
+
+def login(base):
+    req = urllib.request.Request(f'{base}/auth/login', data=json.dumps({'username': 'bench', 'password': 'bench'})
+                                 .encode(), headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req) as res:
+        return json.load(res)['token']
+
+def drive(base, token, clients, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def client(n):
+        i = n
+        mine = []
+        while time.perf_counter() < stop:
+            req = urllib.request.Request(base + PATHS[i % len(PATHS)], headers={'Authorization': f'Bearer {token}'})
+            i += 1
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=30) as res:
+                    res.read()
+                mine.append(time.perf_counter() - start)
+            except OSError:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        'per_sec': len(latencies) / duration,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0,
+        'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0,
+        'errors': errors[0],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=50000)
+    parser.add_argument('--database-url', help='Benchmark this database instead of a throwaway SQLite file.')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        env = dict(os.environ, DATABASE_URL=database_url, AUTO_CREATE_SCHEMA='false', FLASK_ENV='production',
+                   WEB_CONCURRENCY='1', LOG_REQUESTS='false')
+        subprocess.run([sys.executable, '-c', SEED, str(args.products), str(args.transactions)],
+                       cwd=ROOT, env=env, capture_output=True, check=True)
+        print(f'1 worker each, {args.clients} clients, {args.duration:.0f}s per server, '
+              f'{args.products} products, {args.transactions} ledger rows')
+        print(f"{'server':<8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'errors':>8}")
+        for name, command in SERVERS:
+            port = free_port()
+            server = subprocess.Popen([part.format(port=port) for part in command], cwd=ROOT,
+                                      env=dict(env, PORT=str(port)),
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_healthy(port)
+                base = f'http://127.0.0.1:{port}'
+                result = drive(base, login(base), args.clients, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{name:<8}{result['per_sec']:>9.1f}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}"
+                  f"{result['errors']:>8}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Memory footprint and lookup cost of the per-worker catalog index.
+
+Reports the retained memory per 100k products for the `__slots__` index,
+the same data as plain dicts, and identity-mapped ORM objects, then the
+per-lookup latency of the index vs the database queries it replaces.
+
+Usage: python benchmarks/bench_catalog.py [--products 100000] [--lookups 20000]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.catalog import CatalogIndex, SUMMARY_COLUMNS, products  # noqa: E402
+from app.models import Product, Supplier  # noqa: E402
+from config import Config  # noqa: E402
+
+PER = 100000
+
+
+def make_app(path):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+    return create_app(BenchConfig)
+
+def seed(count):
+    supplier = Supplier(name='Bench Supplier')
+    db.session.add(supplier)
+    db.session.flush()
+    db.session.execute(Product.__table__.insert(), [{
+        'name': f'Bench product number {i}',
+        'sku': f'SKU-{i:010d}',
+        'category': 'Bench',
+        'supplier_id': supplier.id,
+        'unit_price': 10 + i % 500,
+        'is_active': True
+    } for i in range(count)])
+    db.session.commit()
+
+def retained(build):
+    # Bytes still allocated after build() returns, with its result kept alive
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, kept
+
+def build_index():
+    index = CatalogIndex(ttl=3600)
+    index.load()
+    return index
+
+def build_dicts():
+    rows = db.session.execute(select(*SUMMARY_COLUMNS)).all()
+    by_id = {r[0]: {'id': r[0], 'sku': r[1], 'name': r[2], 'unit_price': r[3], 'is_active': r[4]} for r in rows}
+    return by_id, {r[1]: r[0] for r in rows}
+
+def build_orm():
+    return db.session.query(Product).all()
+
+def sku_exists(sku):
+    return db.session.execute(select(products.c.id).where(products.c.sku == sku)).first()
+
+def per_lookup(fn, keys):
+    start = time.perf_counter()
+    for key in keys:
+        fn(key)
+    return (time.perf_counter() - start) / len(keys) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=PER)
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            db.create_all()
+            seed(args.products)
+            scale = PER / args.products
+
+            print(f'{args.products} products; memory scaled to {PER} products')
+            print(f"{'structure':<28}{'MB / 100k':>12}{'B / product':>14}")
+            for name, build in [('catalog index (__slots__)', build_index), ('plain dicts', build_dicts),
+                                ('ORM identity map', build_orm)]:
+                size, kept = retained(build)
+                print(f'{name:<28}{size * scale / 1e6:>12.1f}{size / args.products:>14.0f}')
+                del kept
+
+            index = build_index()
+            ids = [random.randint(1, args.products) for _ in range(args.lookups)]
+            skus = [f'SKU-{i - 1:010d}' for i in ids]
+            print(f"\n{'lookup':<28}{'us / call':>12}")
+            print(f"{'index.get(id)':<28}{per_lookup(index.get, ids):>12.2f}")
+            print(f"{'index.sku_owner (free sku)':<28}{per_lookup(index.sku_owner, ['NEW-' + s for s in skus]):>12.2f}")
+            print(f"{'Product.query.get(id)':<28}"
+                  f"{per_lookup(lambda i: (db.session.get(Product, i), db.session.expunge_all()), ids):>12.2f}")
+            print(f"{'SKU existence query':<28}{per_lookup(sku_exists, skus):>12.2f}")
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Catalog sync cost: full re-download vs the delta change feed.
+
+Seeds a catalog and journals it (as `flask init-db` does),
+then changes a few products and records some sales, and compares what a
+client transfers to catch up: every page of `GET /api/products` vs
+`GET /api/changes` from the cursor it held before the changes.
+
+Usage: python benchmarks/bench_change_feed.py [--products 50000] [--changes 200]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.changes import backfill_changes  # noqa: E402
+from app.models import User, Product, Supplier, InventoryTransaction  # noqa: E402
+from config import Config  # noqa: E402
+
+# (path, flag for another page, cursor in the response, cursor parameter)
+FULL = ('/api/products', 'has_next', 'next_cursor', 'after')
+DELTA = ('/api/changes', 'has_more', 'cursor', 'since')
+
+
+def make_app(path):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+        LOG_REQUESTS = False
+    return create_app(BenchConfig)
+
+def seed(products, rng):
+    db.session.add(User(username='bench', password_hash=generate_password_hash('bench')))
+    db.session.add(Supplier(name='Bench Supplier'))
+    db.session.commit()
+    db.session.execute(Product.__table__.insert(), [{
+        'name': f'Product {i}', 'sku': f'SKU-{i:08d}', 'category': f'Category {i % 25}', 'supplier_id': 1,
+        'unit_price': 10 + i % 500
+    } for i in range(products)])
+    db.session.commit()
+    backfill_changes()
+
+def download(client, headers, endpoint, params):
+    path, more_key, cursor_key, cursor_param = endpoint
+    requests, size = 0, 0
+    start = time.perf_counter()
+    while True:
+        res = client.get(path, query_string=params, headers=headers)
+        requests += 1
+        size += len(res.data)
+        cursor = res.json[cursor_key]
+        if not res.json[more_key]:
+            break
+        params = dict(params, **{cursor_param: cursor})
+    return requests, size, (time.perf_counter() - start) * 1000, cursor
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--changes', type=int, default=200, help='Products changed (half priced, half sold).')
+    parser.add_argument('--page-size', type=int, default=500)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            db.create_all()
+            seed(args.products, rng)
+        client = app.test_client()
+        token = client.post('/auth/login', json={'username': 'bench', 'password': 'bench'}).json['token']
+        headers = {'Authorization': f'Bearer {token}'}
+        page = {'per_page': args.page_size, 'count': 'none'}
+        feed = {'limit': args.page_size}
+
+        *_, cursor = download(client, headers, DELTA, feed)
+        with app.app_context():
+            for i, product_id in enumerate(rng.sample(range(1, args.products + 1), args.changes)):
+                if i % 2:
+                    db.session.get(Product, product_id).unit_price += 1
+                else:
+                    db.session.add(InventoryTransaction(product_id=product_id, quantity=5, transaction_type='IN'))
+                db.session.commit()
+
+        print(f'{args.products} products, {args.changes} changed since the last sync')
+        print(f"{'sync':<24}{'requests':>10}{'KiB':>10}{'ms':>10}")
+        for name, endpoint, params in (('full /api/products', FULL, page),
+                                       ('delta /api/changes', DELTA, dict(feed, since=cursor))):
+            requests, size, ms, _ = download(client, headers, endpoint, params)
+            print(f'{name:<24}{requests:>10}{size / 1024:>10.0f}{ms:>10.0f}')
+        with app.app_context():
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Write throughput and latency with and without group commit.
+
+Boots gunicorn with several threaded workers on a fresh database per mode and
+drives it with stress_write_path.py on a write-only mix, then reads the
+workers' group-commit metrics (batch size, added wait) from /api/metrics.
+Metrics are per worker, so the figures are for whichever worker answered.
+
+Usage: python benchmarks/bench_group_commit.py [--workers 2] [--threads 16] [--clients 64] [--duration 15]
+           [--database-url postgresql://...]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STRESS = os.path.join(ROOT, 'benchmarks', 'stress_write_path.py')
+
+SEED = """
+from werkzeug.security import generate_password_hash
+from app import create_app, db
+from app.models import User, Supplier
+app = create_app()
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    db.session.add(User(username='bench', password_hash=generate_password_hash('bench')))
+    db.session.add(Supplier(name='Bench Supplier'))
+    db.session.commit()
+"""
+
+MODES = [
+    ('per-request', {'GROUP_COMMIT': 'false'}),
+    ('group', {'GROUP_COMMIT': 'true'}),
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_healthy(port, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as res:
+                if res.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('gunicorn did not answer in time')
+
+def group_stats(base):
+    req = urllib.request.Request(f'{base}/auth/login', data=json.dumps({'username': 'bench', 'password': 'bench'})
+                                 .encode(), headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req) as res:
+        token = json.load(res)['token']
+    req = urllib.request.Request(f'{base}/api/metrics', headers={'Authorization': f'Bearer {token}'})
+    with urllib.request.urlopen(req) as res:
+        return json.load(res)
+
+def run_mode(tmp, name, overrides, args):
+    database_url = args.database_url or f"sqlite:///{os.path.join(tmp, f'{name}.db')}"
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url, AUTO_CREATE_SCHEMA='false', FLASK_ENV='production',
+               PORT=str(port), WEB_CONCURRENCY=str(args.workers), GUNICORN_THREADS=str(args.threads),
+               LOG_REQUESTS='false', **overrides)
+    subprocess.run([sys.executable, '-c', SEED], cwd=ROOT, env=env, capture_output=True, check=True)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_healthy(port)
+        out = subprocess.run([sys.executable, STRESS, '--url', f'http://127.0.0.1:{port}', '--username', 'bench',
+                              '--password', 'bench', '--database-url', database_url, '--json',
+                              '--clients', str(args.clients), '--duration', str(args.duration),
+                              '--products', str(args.products), '--mix', 'out=50,in=50'],
+                             cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+        stats = group_stats(f'http://127.0.0.1:{port}')
+    finally:
+        server.terminate()
+        server.wait()
+    return json.loads(out.stdout[out.stdout.index('{'):]), stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=16, help='request threads per worker')
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--products', type=int, default=100)
+    parser.add_argument('--database-url', help='Benchmark this database instead of a throwaway SQLite file.')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        print(f'{args.workers} gunicorn workers x {args.threads} threads, {args.clients} clients, '
+              f'{args.duration:.0f}s per mode')
+        print(f"{'mode':<13}{'write/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'5xx':>8}{'oversold':>10}"
+              f"{'lost':>6}{'batch':>7}{'wait ms':>9}")
+        for name, overrides in MODES:
+            report, stats = run_mode(tmp, name, overrides, args)
+            rows = {row['op']: row for row in report['latency']}
+            total = rows['all']
+            writes = sum(rows[op]['requests'] for op in ('in', 'out') if op in rows) / report['seconds']
+            errors = sum(n for status, n in total['statuses'].items()
+                         if status == 'null' or int(status) >= 500)
+            audit = report['audit']
+            batches = stats.get('group_commit.batch_size.count', 0)
+            batch = stats['group_commit.batch_size.sum'] / batches if batches else 1
+            waited = stats.get('group_commit.wait_ms.count', 0)
+            wait_ms = stats['group_commit.wait_ms.sum'] / waited if waited else 0
+            print(f"{name:<13}{writes:>9.1f}{total['p50_ms']:>9.1f}{total['p95_ms']:>9.1f}{total['p99_ms']:>9.1f}"
+                  f"{errors:>8}{audit['oversold_rows']:>10}{audit['lost_updates']:>6}{batch:>7.1f}{wait_ms:>9.1f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Scanner-style SKU lookups: search endpoint vs the exact-SKU fast paths.
+
+Seeds a catalog with a ledger, then resolves the same random SKUs through
+`GET /api/products?q=<sku>` (what scanners used), `GET /api/products/by-sku/`
+and `POST /api/products/lookup` in batches, in-process via the test client,
+and reports the time per SKU and the queries each path issues.
+
+Usage: python benchmarks/bench_sku_lookup.py [--products 50000] [--transactions 500000] [--lookups 500]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.models import User, Product, Supplier, InventoryTransaction  # noqa: E402
+from config import Config  # noqa: E402
+
+
+def make_app(path):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+        LOG_REQUESTS = False
+    return create_app(BenchConfig)
+
+def seed(products, transactions, rng):
+    db.session.add(User(username='bench', password_hash=generate_password_hash('bench')))
+    db.session.add(Supplier(name='Bench Supplier'))
+    db.session.commit()
+    db.session.execute(Product.__table__.insert(), [{
+        'name': f'Product {i}', 'sku': f'{8712345000000 + i}', 'category': 'Bench', 'supplier_id': 1,
+        'unit_price': 10 + i % 500
+    } for i in range(products)])
+    db.session.execute(InventoryTransaction.__table__.insert(), [{
+        'product_id': rng.randint(1, products), 'quantity': rng.randint(1, 20),
+        'transaction_type': 'IN' if rng.random() < 0.6 else 'OUT'
+    } for _ in range(transactions)])
+    db.session.commit()
+
+def timed(engine, fn):
+    queries = [0]
+
+    def count(*args):
+        queries[0] += 1
+    event.listen(engine, 'before_cursor_execute', count)
+    start = time.perf_counter()
+    try:
+        fn()
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    return (time.perf_counter() - start) * 1000, queries[0]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--transactions', type=int, default=500000)
+    parser.add_argument('--lookups', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=100, help='SKUs per POST /api/products/lookup')
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            db.create_all()
+            seed(args.products, args.transactions, rng)
+            engine = db.engine
+        client = app.test_client()
+        token = client.post('/auth/login', json={'username': 'bench', 'password': 'bench'}).json['token']
+        headers = {'Authorization': f'Bearer {token}'}
+        skus = [f'{8712345000000 + rng.randrange(args.products)}' for _ in range(args.lookups)]
+
+        def search():
+            for sku in skus:
+                assert client.get(f'/api/products?q={sku}', headers=headers).json['products']
+
+        def by_sku():
+            for sku in skus:
+                assert client.get(f'/api/products/by-sku/{sku}', headers=headers).status_code == 200
+
+        def batched():
+            for start in range(0, len(skus), args.batch):
+                res = client.post('/api/products/lookup', json={'skus': skus[start:start + args.batch]},
+                                  headers=headers)
+                assert not res.json['not_found']
+
+        print(f'{args.products} products, {args.transactions} ledger rows, {args.lookups} lookups')
+        print(f"{'path':<28}{'ms/SKU':>9}{'queries/SKU':>13}")
+        for name, fn in (('GET /api/products?q=', search), ('GET /api/products/by-sku/', by_sku),
+                         (f'POST lookup ({args.batch}/batch)', batched)):
+            ms, queries = timed(engine, fn)
+            print(f'{name:<28}{ms / len(skus):>9.3f}{queries / len(skus):>13.2f}')
+        with app.app_context():
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
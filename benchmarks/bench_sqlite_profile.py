@@ -0,0 +1,107 @@
+"""Write-path throughput on SQLite with and without the tuned engine profile.
+
+Boots gunicorn with several workers on a fresh SQLite file per profile and
+drives it with stress_write_path.py, so "database is locked" errors, commit
+latency and oversells show up as they would in a single-node deployment.
+
+Usage: python benchmarks/bench_sqlite_profile.py [--workers 4] [--clients 32] [--duration 15]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STRESS = os.path.join(ROOT, 'benchmarks', 'stress_write_path.py')
+
+SEED = """
+from werkzeug.security import generate_password_hash
+from app import create_app, db
+from app.models import User, Supplier
+app = create_app()
+with app.app_context():
+    db.create_all()
+    db.session.add(User(username='bench', password_hash=generate_password_hash('bench')))
+    db.session.add(Supplier(name='Bench Supplier'))
+    db.session.commit()
+"""
+
+PROFILES = [
+    # The previous setup: pysqlite defaults (rollback journal, synchronous=FULL,
+    # deferred transactions) with the server pool options
+    ('default', {'SQLITE_PROFILE': 'false'}),
+    ('tuned', {'SQLITE_PROFILE': 'true'}),
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_healthy(port, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as res:
+                if res.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('gunicorn did not answer in time')
+
+def run_profile(tmp, name, overrides, args):
+    db_path = os.path.join(tmp, f'{name}.db')
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', AUTO_CREATE_SCHEMA='false', FLASK_ENV='production',
+               PORT=str(port), WEB_CONCURRENCY=str(args.workers), **overrides)
+    subprocess.run([sys.executable, '-c', SEED], cwd=ROOT, env=env, capture_output=True, check=True)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_healthy(port)
+        out = subprocess.run([sys.executable, STRESS, '--url', f'http://127.0.0.1:{port}', '--username', 'bench',
+                              '--password', 'bench', '--database-url', f'sqlite:///{db_path}', '--json',
+                              '--clients', str(args.clients), '--duration', str(args.duration),
+                              '--products', str(args.products)],
+                             cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    finally:
+        server.terminate()
+        server.wait()
+    return json.loads(out.stdout[out.stdout.index('{'):])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--products', type=int, default=100)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        print(f'{args.workers} gunicorn workers, {args.clients} clients, {args.duration:.0f}s per profile')
+        print(f"{'profile':<10}{'req/s':>9}{'write/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              f"{'5xx':>8}{'oversold':>10}{'lost':>6}")
+        for name, overrides in PROFILES:
+            report = run_profile(tmp, name, overrides, args)
+            rows = {row['op']: row for row in report['latency']}
+            total = rows['all']
+            writes = sum(rows[op]['requests'] for op in ('in', 'out') if op in rows) / report['seconds']
+            errors = sum(n for status, n in total['statuses'].items()
+                         if status == 'null' or int(status) >= 500)
+            audit = report['audit']
+            print(f"{name:<10}{total['per_sec']:>9.1f}{writes:>9.1f}{total['p50_ms']:>9.1f}{total['p95_ms']:>9.1f}"
+                  f"{total['p99_ms']:>9.1f}{errors:>8}{audit['oversold_rows']:>10}{audit['lost_updates']:>6}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Cold-start cost of a worker: import time and time to first response.
+
+Each sample runs in a fresh interpreter so nothing is already imported. The
+in-process mode times `import app`, `import run` (create_app, plus create_all
+when AUTO_CREATE_SCHEMA is on) and the first request. `--gunicorn` also
+starts a real server with and without preload_app and times the first 200.
+
+Usage: python benchmarks/bench_startup.py [--repeat 5] [--gunicorn] [--workers 4]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+import run
+t2 = time.perf_counter()
+res = run.app.test_client().get('/health')
+t3 = time.perf_counter()
+assert res.status_code == 200
+print(json.dumps({'import_app': t1 - t0, 'import_run': t2 - t1, 'first_response': t3 - t2, 'total': t3 - t0}))
+"""
+
+
+def child_env(db_path, auto_schema, **extra):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', AUTO_CREATE_SCHEMA=auto_schema,
+               FLASK_ENV='production')
+    env.update(extra)
+    return env
+
+def in_process(db_path, auto_schema, repeat):
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=child_env(db_path, auto_schema),
+                             capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def gunicorn_first_response(db_path, preload, workers, timeout=60):
+    port = free_port()
+    env = child_env(db_path, 'false', PORT=str(port), WEB_CONCURRENCY=str(workers),
+                    GUNICORN_PRELOAD='true' if preload else 'false')
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as res:
+                    if res.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError('gunicorn did not answer in time')
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--gunicorn', action='store_true', help='Also time a real gunicorn boot')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'startup.db')
+    try:
+        # Tables must exist before the schema-less boot is measured
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'run', 'init-db'], cwd=ROOT,
+                       env=child_env(db_path, 'false'), capture_output=True, check=True)
+        print(f"{'mode':<24}{'import app':>12}{'import run':>12}{'first resp':>12}{'total':>12}")
+        for label, auto_schema in [('create_all at import', 'true'), ('init-db once', 'false')]:
+            r = in_process(db_path, auto_schema, args.repeat)
+            print(f"{label:<24}{r['import_app'] * 1000:>10.1f}ms{r['import_run'] * 1000:>10.1f}ms"
+                  f"{r['first_response'] * 1000:>10.1f}ms{r['total'] * 1000:>10.1f}ms")
+
+        if args.gunicorn:
+            print(f'\ngunicorn, {args.workers} workers: spawn to first 200')
+            for preload in (False, True):
+                times = [gunicorn_first_response(db_path, preload, args.workers) for _ in range(args.repeat)]
+                print(f"  preload_app={str(preload):<6}{statistics.median(times) * 1000:>10.1f}ms")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""As-of stock report latency with and without stock checkpoints.
+
+Seeds a ledger spread evenly over --months, then times the catalog-wide
+as-of report for a date near the end of the ledger: as a full replay, from a
+monthly checkpoint taken before it, and (for a sample of products) the
+per-product running-stock query it replaces, extrapolated to the catalog.
+
+Usage: python benchmarks/bench_stock_as_of.py [--products 10000] [--transactions 1000000] [--months 24]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.checkpoints import build_checkpoint, stock_as_of  # noqa: E402
+from app.models import Product, Supplier, InventoryTransaction  # noqa: E402
+from app.routes.analytics import STOCK_MOVEMENT_SQL  # noqa: E402
+from config import Config  # noqa: E402
+
+START = datetime(2023, 1, 1)
+
+
+def make_app(path):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+    return create_app(BenchConfig)
+
+def seed(products, transactions, months, rng):
+    db.session.execute(Supplier.__table__.insert(), [{'name': 'Supplier'}])
+    db.session.execute(Product.__table__.insert(), [{
+        'name': f'Product {i}', 'sku': f'SKU-{i:08d}', 'category': 'Bench', 'supplier_id': 1,
+        'unit_price': 10 + i % 500
+    } for i in range(products)])
+    step = months * 30 * 86400 / transactions
+    batch = []
+    for i in range(transactions):
+        incoming = rng.random() < 0.55
+        batch.append({
+            'product_id': rng.randint(1, products),
+            'quantity': rng.randint(1, 20),
+            'transaction_type': 'IN' if incoming else 'OUT',
+            'unit_cost': rng.randint(5, 50) if incoming else None,
+            'transaction_date': START + timedelta(seconds=i * step)
+        })
+        if len(batch) == 50000:
+            db.session.execute(InventoryTransaction.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(InventoryTransaction.__table__.insert(), batch)
+    db.session.commit()
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--sample', type=int, default=50, help='Products timed with the per-product query.')
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        app.config['LEDGER_ARCHIVE_DIR'] = os.path.join(tmp, 'archive')
+        with app.app_context():
+            db.create_all()
+            seed(args.products, args.transactions, args.months, rng)
+            print(f'{args.products} products, {args.transactions} ledger rows over {args.months} months')
+
+            end = START + timedelta(days=args.months * 30)
+            at = end - timedelta(days=10)
+            checkpoint_at = end - timedelta(days=30)
+
+            full, full_ms = timed(lambda: stock_as_of(at))
+            print(f'full replay:           {full_ms:>9.0f}ms')
+            _, build_ms = timed(lambda: build_checkpoint(checkpoint_at))
+            print(f'checkpoint build:      {build_ms:>9.0f}ms')
+            fast, fast_ms = timed(lambda: stock_as_of(at))
+            print(f'from checkpoint:       {fast_ms:>9.0f}ms  ({full_ms / fast_ms:.1f}x)')
+            assert fast['products'] == full['products'], 'checkpointed report differs from the full replay'
+
+            sample = rng.sample(range(1, args.products + 1), min(args.sample, args.products))
+            _, sample_ms = timed(lambda: [db.session.execute(STOCK_MOVEMENT_SQL, {'product_id': p}).all()
+                                          for p in sample])
+            print(f'per-product movement:  {sample_ms / len(sample) * args.products:>9.0f}ms  '
+                  f'(extrapolated from {len(sample)} products)')
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+"""Concurrency stress test for the write path, with a ledger audit at the end.
+
+Many client threads post stock movements and read/update products, with most
+traffic on a few hot SKUs. Afterwards every accepted write is matched against
+the ledger (each one carries a unique note), so the report covers throughput,
+latency percentiles, error and slow-write rates, plus lost updates (accepted
+but missing), phantoms (failed but committed), oversells (running balance
+below zero) and stored totals that drifted from the ledger.
+
+By default the app is served in-process by a threaded Werkzeug server on a
+throwaway SQLite file (or --database-url). --url targets a running server
+instead, e.g. gunicorn; pass --database-url as well for the full ledger audit,
+otherwise only final stock levels from the API are checked.
+
+Usage: python benchmarks/stress_write_path.py [--clients 32] [--duration 20] [--products 200]
+           [--hot 3] [--hot-share 0.8] [--mix out=60,in=20,read=15,update=5]
+           [--url http://127.0.0.1:8000 --username admin --password ...] [--database-url URL]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import bindparam, create_engine, event, text  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+from werkzeug.serving import WSGIRequestHandler, make_server  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.models import User, Supplier  # noqa: E402
+from config import Config  # noqa: E402
+
+OPS = ('out', 'in', 'read', 'update')
+WRITES = ('out', 'in')
+LOCK_MARKERS = ('database is locked', 'deadlock detected', 'could not serialize', 'lock timeout')
+
+
+class Client:
+    # One keep-alive connection per thread; http.client reopens it when the
+    # server closes the connection.
+    def __init__(self, base_url, token=None):
+        parts = urlsplit(base_url)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+        self.token = token
+
+    def call(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.conn.request(method, path, body=payload, headers=headers)
+            res = self.conn.getresponse()
+            raw = res.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            return None, None
+        try:
+            return res.status, json.loads(raw) if raw else None
+        except ValueError:
+            return res.status, None
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def parse_mix(value):
+    weights = dict.fromkeys(OPS, 0)
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in weights:
+            raise argparse.ArgumentTypeError(f'unknown operation {name!r}, expected one of {", ".join(OPS)}')
+        weights[name.strip()] = float(weight)
+    return weights
+
+def start_local_server(database_url):
+    class StressConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+    app = create_app(StressConfig)
+    lock_errors = Counter()
+
+    with app.app_context():
+        db.create_all()
+        if not User.query.filter_by(username='stress').first():
+            db.session.add(User(username='stress', password_hash=generate_password_hash('stress')))
+        if not Supplier.query.filter_by(name='Stress Supplier').first():
+            db.session.add(Supplier(name='Stress Supplier'))
+        db.session.commit()
+
+        # Lock conflicts surface as 500s over HTTP; count them at the source
+        @event.listens_for(db.engine, 'handle_error')
+        def count_lock_errors(context):
+            message = str(context.original_exception).lower()
+            for marker in LOCK_MARKERS:
+                if marker in message:
+                    lock_errors[marker] += 1
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}', lock_errors
+
+def login(base_url, username, password):
+    status, body = Client(base_url).call('POST', '/auth/login', {'username': username, 'password': password})
+    if status != 200:
+        raise SystemExit(f'Login failed ({status}): {body}')
+    return body['token']
+
+def seed_products(client, count, initial_stock, run_id):
+    status, suppliers = client.call('GET', '/api/suppliers')
+    if status != 200 or not suppliers:
+        raise SystemExit('No supplier to attach products to; create one first')
+    products = []
+    for i in range(count):
+        status, body = client.call('POST', '/api/products', {
+            'name': f'Stress product {i}',
+            'sku': f'STRESS-{run_id}-{i:05d}',
+            'category': 'Stress',
+            'supplier_id': suppliers[0]['id'],
+            'unit_price': 10,
+            'initial_stock': initial_stock
+        })
+        if status != 201:
+            raise SystemExit(f'Could not create product ({status}): {body}')
+        products.append(body['id'])
+    return products
+
+
+class Worker(threading.Thread):
+    def __init__(self, number, base_url, token, products, hot, hot_share, mix, deadline, run_id):
+        super().__init__(daemon=True)
+        self.number = number
+        self.client = Client(base_url, token)
+        self.products = products
+        self.hot = products[:hot]
+        self.cold = products[hot:] or products
+        self.hot_share = hot_share
+        self.ops, self.weights = zip(*[(op, w) for op, w in mix.items() if w > 0])
+        self.deadline = deadline
+        self.run_id = run_id
+        self.rng = random.Random(number)
+        self.samples = []
+        # note -> (product_id, type, quantity, outcome) for every write attempted
+        self.writes = {}
+
+    def pick_product(self):
+        if self.hot and self.rng.random() < self.hot_share:
+            return self.rng.choice(self.hot)
+        return self.rng.choice(self.cold)
+
+    def run(self):
+        seq = 0
+        while time.perf_counter() < self.deadline:
+            op = self.rng.choices(self.ops, self.weights)[0]
+            product_id = self.pick_product()
+            seq += 1
+            if op in WRITES:
+                note = f'stress:{self.run_id}:{self.number}:{seq}'
+                quantity = self.rng.randint(1, 3) if op == 'out' else self.rng.randint(1, 5)
+                request = ('POST', '/api/transactions', {'product_id': product_id, 'quantity': quantity,
+                                                         'transaction_type': op.upper(), 'notes': note})
+            elif op == 'read':
+                request = ('GET', f'/api/products/{product_id}', None)
+            else:
+                request = ('PUT', f'/api/products/{product_id}', {'unit_price': self.rng.randint(5, 50)})
+
+            start = time.perf_counter()
+            status, body = self.client.call(*request)
+            elapsed = time.perf_counter() - start
+            self.samples.append((op, status, elapsed))
+            if op in WRITES:
+                if status == 201:
+                    outcome = 'accepted'
+                elif status == 400 and body and body.get('message') == 'Insufficient stock':
+                    outcome = 'rejected'
+                else:
+                    outcome = 'failed'
+                self.writes[note] = (product_id, op.upper(), quantity, outcome)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+def summarize(workers, wall, slow_ms):
+    samples = [s for w in workers for s in w.samples]
+    by_op = defaultdict(list)
+    for op, status, elapsed in samples:
+        by_op[op].append((status, elapsed))
+    rows = []
+    for op in OPS + ('all',):
+        entries = [(s, e) for s, e in (by_op[op] if op != 'all' else [(s, e) for _, s, e in samples])]
+        if not entries:
+            continue
+        latencies = sorted(e for _, e in entries)
+        statuses = Counter(s for s, _ in entries)
+        errors = sum(n for s, n in statuses.items() if s is None or s >= 500)
+        rows.append({
+            'op': op,
+            'requests': len(entries),
+            'per_sec': len(entries) / wall,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'error_rate': errors / len(entries),
+            'slow_rate': sum(1 for e in latencies if e * 1000 > slow_ms) / len(entries),
+            'statuses': dict(statuses),
+        })
+    return rows
+
+def audit_database(database_url, writes, products, initial_stock):
+    # Matches every attempted write to the ledger by its note and replays
+    # each product's ledger in insert order.
+    engine = create_engine(database_url)
+    try:
+        with engine.connect() as conn:
+            ledger = conn.execute(text(
+                'SELECT id, product_id, transaction_type, quantity, notes FROM inventory_transactions '
+                'WHERE product_id IN :ids ORDER BY product_id, id'
+            ).bindparams(bindparam('ids', expanding=True)), {'ids': products}).all()
+            stored = dict(conn.execute(text('SELECT product_id, quantity FROM inventory_valuations')).all())
+    finally:
+        engine.dispose()
+
+    in_ledger = {row.notes for row in ledger if row.notes and row.notes.startswith('stress:')}
+    lost = [note for note, w in writes.items() if w[3] == 'accepted' and note not in in_ledger]
+    phantom = [note for note, w in writes.items() if w[3] != 'accepted' and note in in_ledger]
+    balances = dict.fromkeys(products, 0)
+    oversold_rows = 0
+    oversold_products = set()
+    for row in ledger:
+        balances[row.product_id] += row.quantity if row.transaction_type == 'IN' else -row.quantity
+        if balances[row.product_id] < 0 and row.transaction_type == 'OUT':
+            oversold_rows += 1
+            oversold_products.add(row.product_id)
+    drift = [pid for pid in products if stored.get(pid, 0) != balances[pid]]
+    expected = expected_stock(writes, products, initial_stock)
+    return {
+        'ledger_rows': len(ledger),
+        'lost_updates': len(lost),
+        'phantom_writes': len(phantom),
+        'oversold_rows': oversold_rows,
+        'oversold_products': len(oversold_products),
+        'negative_final_stock': sum(1 for pid in products if balances[pid] < 0),
+        'stock_mismatches': sum(1 for pid in products if balances[pid] != expected[pid]),
+        'stored_total_drift': len(drift),
+    }
+
+def audit_api(client, writes, products, initial_stock):
+    # Without database access only the final stock per product can be checked
+    expected = expected_stock(writes, products, initial_stock)
+    uncertain = defaultdict(int)
+    for product_id, _, quantity, outcome in writes.values():
+        if outcome == 'failed':
+            uncertain[product_id] += quantity
+    mismatches = negative = 0
+    for product_id in products:
+        status, body = client.call('GET', f'/api/products/{product_id}')
+        if status != 200:
+            mismatches += 1
+            continue
+        # A failed write may still have committed, so allow for it
+        if abs(body['stock'] - expected[product_id]) > uncertain[product_id]:
+            mismatches += 1
+        if body['stock'] < 0:
+            negative += 1
+    return {'negative_final_stock': negative, 'stock_mismatches': mismatches}
+
+def expected_stock(writes, products, initial_stock):
+    expected = dict.fromkeys(products, initial_stock)
+    for product_id, trans_type, quantity, outcome in writes.values():
+        if outcome == 'accepted':
+            expected[product_id] += quantity if trans_type == 'IN' else -quantity
+    return expected
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20, help='Seconds of load after seeding.')
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--initial-stock', type=int, default=50)
+    parser.add_argument('--hot', type=int, default=3, help='Number of hot SKUs.')
+    parser.add_argument('--hot-share', type=float, default=0.8, help='Share of requests aimed at hot SKUs.')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('out=60,in=20,read=15,update=5'))
+    parser.add_argument('--slow-ms', type=float, default=250, help='Latency counted as a slow (lock-bound) write.')
+    parser.add_argument('--url', help='Base URL of a running server; default serves the app in-process.')
+    parser.add_argument('--username', default=os.getenv('ADMIN_USERNAME', 'admin'))
+    parser.add_argument('--password', default=os.getenv('ADMIN_PASSWORD'))
+    parser.add_argument('--database-url', help='Database for the local server and the ledger audit.')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:8]
+    tmp = None
+    server = None
+    lock_errors = None
+    database_url = args.database_url
+    if args.url:
+        base_url = args.url.rstrip('/')
+        token = login(base_url, args.username, args.password)
+    else:
+        if not database_url:
+            tmp = tempfile.TemporaryDirectory()
+            database_url = f"sqlite:///{os.path.join(tmp.name, 'stress.db')}"
+        server, base_url, lock_errors = start_local_server(database_url)
+        token = login(base_url, 'stress', 'stress')
+
+    try:
+        setup = Client(base_url, token)
+        products = seed_products(setup, args.products, args.initial_stock, run_id)
+        deadline = time.perf_counter() + args.duration
+        workers = [Worker(i, base_url, token, products, args.hot, args.hot_share, args.mix, deadline, run_id)
+                   for i in range(args.clients)]
+        started = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        wall = time.perf_counter() - started
+
+        writes = {note: w for worker in workers for note, w in worker.writes.items()}
+        outcomes = Counter(w[3] for w in writes.values())
+        if database_url:
+            audit = audit_database(database_url, writes, products, args.initial_stock)
+        else:
+            audit = audit_api(setup, writes, products, args.initial_stock)
+        report = {
+            'clients': args.clients,
+            'seconds': wall,
+            'target': base_url if args.url else database_url.split(':', 1)[0] + ' (in-process)',
+            'latency': summarize(workers, wall, args.slow_ms),
+            'writes': dict(outcomes),
+            'lock_errors': dict(lock_errors) if lock_errors is not None else None,
+            'audit': audit,
+        }
+    finally:
+        if server is not None:
+            server.shutdown()
+        if tmp is not None:
+            tmp.cleanup()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{args.clients} clients for {wall:.1f}s against {report['target']}; "
+          f"{args.hot} hot SKUs take {args.hot_share:.0%} of traffic")
+    print(f"{'op':<8}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'errors':>9}{'slow':>9}")
+    for row in report['latency']:
+        print(f"{row['op']:<8}{row['requests']:>10}{row['per_sec']:>10.1f}{row['p50_ms']:>10.1f}"
+              f"{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['error_rate']:>9.2%}{row['slow_rate']:>9.2%}")
+    print('\nwrites: ' + ', '.join(f'{n} {outcome}' for outcome, n in sorted(outcomes.items())))
+    if lock_errors is not None:
+        print('lock errors: ' + (', '.join(f'{n} {m!r}' for m, n in lock_errors.items()) or 'none'))
+    print('audit: ' + ', '.join(f'{k}={v}' for k, v in audit.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,189 @@
+import atexit
+import json
 import logging
+import os
+import queue
+import random
 import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import current_app, g, has_request_context, request
+from flask.logging import default_handler
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Set on the WSGI environ so batched sub-requests, which copy it, share the id
+REQUEST_ID_KEY = 'inventory.request_id'
+# Attributes every LogRecord has; anything else came in through `extra`
+RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line: the standard fields plus any `extra` ones
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in RECORD_ATTRS)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        elif record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    # Tags records logged while handling a request with its id and route
+    def filter(self, record):
+        if has_request_context() and not hasattr(record, 'request_id'):
+            record.request_id = request.environ.get(REQUEST_ID_KEY)
+            record.route = request.url_rule.rule if request.url_rule else None
+        return True
+
+
+class BlockingStopListener(QueueListener):
+    # Waits for room for the stop marker, so stopping drains a full queue
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class AsyncLogHandler(QueueHandler):
+    # Request threads only put records on a bounded queue; a listener thread
+    # formats and writes them, so a slow stdout consumer never blocks a
+    # request. When the queue is full the record is dropped and counted.
+    # The listener thread does not survive a fork, so it is started lazily
+    # in each process.
+    def __init__(self, target, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.dropped = 0
+        self.sampled_out = 0
+        self._pid = None
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # A queue inherited across fork may hold a lock taken by a thread that no longer exists
+                self.queue = queue.Queue(self.queue.maxsize)
+                self._listener = BlockingStopListener(self.queue, self.target, respect_handler_level=True)
+                self._listener.start()
+                self._pid = os.getpid()
+                atexit.register(self.stop)
+
+    def prepare(self, record):
+        # Keeps `extra` fields and exception text, but nothing unpicklable
+        # or that would be formatted again on the listener thread
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def count_sampled_out(self):
+        with self._lock:
+            self.sampled_out += 1
+
+    def stop(self):
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+    def close(self):
+        self.stop()
+        super().close()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_count' in g:
+        g.query_count += 1
 
 
 def setup_logging(app):
     log_level = logging.INFO if app.config.get('FLASK_ENV') == 'production' else logging.DEBUG
-    
-    formatter = logging.Formatter(
-        '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
-    )
-    
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(log_level)
-    console_handler.setFormatter(formatter)
-    
+
+    # app.logger is shared by every app in the process (the async read app
+    # and the WSGI app), so they share one handler and its counters too.
+    # Flask's own stderr handler would write every record a second time.
+    app.logger.removeHandler(default_handler)
+    handler = next((h for h in app.logger.handlers if isinstance(h, AsyncLogHandler)), None)
+    if handler is None:
+        target = logging.StreamHandler(sys.stdout)
+        target.setLevel(log_level)
+        if app.config['LOG_FORMAT'] == 'json':
+            target.setFormatter(JsonFormatter())
+        else:
+            target.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handler = AsyncLogHandler(target, app.config['LOG_QUEUE_SIZE'])
+        handler.addFilter(RequestContextFilter())
+        app.logger.addHandler(handler)
     app.logger.setLevel(log_level)
-    app.logger.addHandler(console_handler)
-    
+    app.extensions['log_handler'] = handler
+
+    if app.config['LOG_REQUESTS']:
+        app.before_request(_start_request)
+        app.after_request(_log_request)
+
     if not app.debug:
         app.logger.info('Inventory Management System startup')
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.query_count = 0
+    request.environ.setdefault(REQUEST_ID_KEY, request.headers.get('X-Request-ID') or uuid.uuid4().hex)
+
+def _log_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    latency_ms = (time.perf_counter() - started) * 1000
+    request_id = request.environ.get(REQUEST_ID_KEY)
+    response.headers.setdefault('X-Request-ID', request_id)
+
+    # High-volume endpoints can be sampled; failures and slow requests never are
+    config = current_app.config
+    rate = config['LOG_SAMPLE_RATES'].get(request.endpoint, 1.0)
+    if response.status_code < 500 and latency_ms < config['LOG_SLOW_REQUEST_MS'] and random.random() >= rate:
+        handler = current_app.extensions.get('log_handler')
+        if handler is not None:
+            handler.count_sampled_out()
+        return response
+    current_app.logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+        'request_id': request_id,
+        'route': request.url_rule.rule if request.url_rule else None,
+        'method': request.method,
+        'status': response.status_code,
+        'latency_ms': round(latency_ms, 2),
+        'query_count': g.pop('query_count', 0),
+        'sample_rate': rate,
+    })
+    return response
+
+def log_stats(app):
+    handler = app.extensions.get('log_handler')
+    if handler is None:
+        return {}
+    return {'logging.dropped': handler.dropped, 'logging.queued': handler.queue.qsize(),
+            'logging.sampled_out': handler.sampled_out}
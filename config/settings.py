@@ -19,6 +19,129 @@ class Config:
         'pool_recycle': 3600,
         'pool_pre_ping': True
     }
+    
+    # Logs go through a bounded queue to a writer thread; records are dropped
+    # (and counted in /api/metrics) when it is full. LOG_FORMAT: json or text.
+    # LOG_SAMPLE_RATES logs only a share of requests per endpoint, e.g.
+    # "analytics.low_stock=0.1,products.get_products=0.5"; errors and requests
+    # slower than LOG_SLOW_REQUEST_MS are always logged.
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    LOG_REQUESTS = os.getenv('LOG_REQUESTS', 'true').lower() == 'true'
+    LOG_SAMPLE_RATES = {endpoint.strip(): float(rate) for endpoint, _, rate in
+                        (item.partition('=') for item in os.getenv('LOG_SAMPLE_RATES', '').split(',') if item)}
+    LOG_SLOW_REQUEST_MS = float(os.getenv('LOG_SLOW_REQUEST_MS', 1000))
+    
+    # Background jobs run on a per-worker thread pool; limits are per job type.
+    # Only one app per process runs them (the async read app does not).
+    RUN_JOBS = True
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+    JOB_CONCURRENCY_LIMITS = {}
+    JOB_PROGRESS_INTERVAL = 0.5
+    JOB_RESULTS_DIR = os.getenv('JOB_RESULTS_DIR')
+    # Each worker renews a lease on its jobs; jobs whose lease expired were
+    # left by a stopped worker and are requeued (or failed, if running)
+    JOB_HEARTBEAT_INTERVAL = int(os.getenv('JOB_HEARTBEAT_INTERVAL', 10))
+    JOB_LEASE_TIMEOUT = int(os.getenv('JOB_LEASE_TIMEOUT', 60))
+    # Queue a stock checkpoint at the start of each month, so as-of reports
+    # replay at most about a month of movements
+    STOCK_CHECKPOINT_MONTHLY = os.getenv('STOCK_CHECKPOINT_MONTHLY', 'true').lower() == 'true'
+    
+    # Idempotency-Key replay store for create endpoints
+    IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+    IDEMPOTENCY_MAX_KEYS = int(os.getenv('IDEMPOTENCY_MAX_KEYS', 100000))
+    IDEMPOTENCY_PRUNE_INTERVAL = 60
+    # An unfinished claim older than this is taken over by a retry; keep it
+    # above the longest a request can run (GUNICORN_TIMEOUT)
+    IDEMPOTENCY_LEASE_SECONDS = int(os.getenv('IDEMPOTENCY_LEASE_SECONDS', 150))
+    
+    # Product list totals: exact, cached (per-worker TTL), estimate (planner) or none
+    PRODUCTS_COUNT_MODE = os.getenv('PRODUCTS_COUNT_MODE', 'cached')
+    COUNT_CACHE_TTL = int(os.getenv('COUNT_CACHE_TTL', 30))
+    
+    # Most products a single bulk PATCH may change
+    PRODUCTS_BULK_LIMIT = int(os.getenv('PRODUCTS_BULK_LIMIT', 10000))
+    # Most SKUs a single POST /api/products/lookup may resolve
+    PRODUCTS_LOOKUP_LIMIT = int(os.getenv('PRODUCTS_LOOKUP_LIMIT', 1000))
+    
+    # Entries per page of GET /api/changes (default and most a client may ask for)
+    CHANGES_PAGE_SIZE = int(os.getenv('CHANGES_PAGE_SIZE', 500))
+    CHANGES_MAX_PAGE_SIZE = int(os.getenv('CHANGES_MAX_PAGE_SIZE', 5000))
+    
+    # Product deletes with more ledger rows than this run as a chunked background purge
+    PRODUCT_DELETE_SYNC_LIMIT = int(os.getenv('PRODUCT_DELETE_SYNC_LIMIT', 10000))
+    PRODUCT_PURGE_CHUNK_SIZE = int(os.getenv('PRODUCT_PURGE_CHUNK_SIZE', 5000))
+    
+    # Per-worker product index used on the write path; reloaded in full after this many seconds
+    CATALOG_TTL = int(os.getenv('CATALOG_TTL', 300))
+    CATALOG_PRELOAD = os.getenv('CATALOG_PRELOAD', 'true').lower() == 'true'
+    
+    # POST /api/batch: sub-requests per call and the per-worker pool that runs them
+    BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', 20))
+    BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 4))
+    
+    # Users allowed on /api/admin endpoints (comma-separated)
+    ADMIN_USERNAMES = {name.strip() for name in
+                       os.getenv('ADMIN_USERNAMES', os.getenv('ADMIN_USERNAME', '')).split(',') if name.strip()}
+    
+    # Request profiling: admins send `X-Profile: cprofile|sample`, or a share of
+    # all requests is captured. cprofile writes .pstats, sample writes collapsed
+    # stacks for flamegraphs. Captures go to PROFILE_DIR (instance/profiles).
+    PROFILE_HEADER = 'X-Profile'
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_MODE = os.getenv('PROFILE_MODE', 'cprofile')
+    PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', 5))
+    PROFILE_DIR = os.getenv('PROFILE_DIR')
+    PROFILE_MAX_CAPTURES = int(os.getenv('PROFILE_MAX_CAPTURES', 100))
+    
+    # Cold-storage ledger archives (defaults to instance/archive)
+    LEDGER_ARCHIVE_DIR = os.getenv('LEDGER_ARCHIVE_DIR')
+    
+    # Analytics aggregates: sql (queries per call) or numpy (per-worker in-memory
+    # columnar ledger, appended incrementally; needs numpy installed)
+    ANALYTICS_ENGINE = os.getenv('ANALYTICS_ENGINE', 'sql')
+    # Seconds a numpy snapshot is served before the next call refreshes it
+    ANALYTICS_REFRESH_INTERVAL = float(os.getenv('ANALYTICS_REFRESH_INTERVAL', 5))
+    
+    # Stock valuation maintained on every movement: fifo or average
+    INVENTORY_VALUATION_METHOD = os.getenv('INVENTORY_VALUATION_METHOD', 'fifo')
+    
+    # SQLite file databases (single-node deployments): per-connection pragmas,
+    # and write transactions start with BEGIN IMMEDIATE
+    SQLITE_PROFILE = os.getenv('SQLITE_PROFILE', 'true').lower() == 'true'
+    SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'wal')
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'normal')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+    SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_IMMEDIATE_WRITES = os.getenv('SQLITE_IMMEDIATE_WRITES', 'true').lower() == 'true'
+    
+    # Group commit (per worker): POST /api/transactions queues the validated
+    # movement and a flusher commits up to GROUP_COMMIT_MAX_BATCH of them in
+    # one transaction, at most GROUP_COMMIT_MAX_WAIT_MS after the first.
+    # Needs several request threads per worker (GUNICORN_THREADS).
+    GROUP_COMMIT = os.getenv('GROUP_COMMIT', 'false').lower() == 'true'
+    GROUP_COMMIT_MAX_BATCH = int(os.getenv('GROUP_COMMIT_MAX_BATCH', 64))
+    GROUP_COMMIT_MAX_WAIT_MS = float(os.getenv('GROUP_COMMIT_MAX_WAIT_MS', 5))
+    GROUP_COMMIT_TIMEOUT = float(os.getenv('GROUP_COMMIT_TIMEOUT', 10))
+    
+    # Async serving mode (asgi.py): these GET endpoints run on the event loop
+    # over an async driver (asyncpg / aiosqlite unless ASYNC_DATABASE_URL is
+    # set); all other requests go to the regular app on a thread pool.
+    ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL')
+    ASYNC_POOL_SIZE = int(os.getenv('ASYNC_POOL_SIZE', 20))
+    ASYNC_FALLBACK_THREADS = int(os.getenv('ASYNC_FALLBACK_THREADS', 10))
+    ASYNC_READ_ENDPOINTS = os.getenv(
+        'ASYNC_READ_ENDPOINTS',
+        'analytics.top_selling,analytics.low_stock,analytics.stock_value,analytics.recent_products,'
+        'analytics.stock_by_category,analytics.products_by_supplier,analytics.stock_movement,'
+        'analytics.get_stock_as_of,products.get_products,products.get_product_by_sku,transactions.get_transactions,'
+        'changes.get_changes'
+    ).split(',')
+    
+    # Create missing tables when run.py is imported. Deployments turn this off
+    # and run `flask init-db` once instead of on every worker boot.
+    AUTO_CREATE_SCHEMA = os.getenv('AUTO_CREATE_SCHEMA', 'true').lower() == 'true'
 
 
 class DevelopmentConfig(Config):
@@ -0,0 +1,27 @@
+import os
+
+# Used by the Dockerfile and render.yaml: gunicorn -c gunicorn.conf.py run:app
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+# More than one thread switches to the gthread worker (e.g. for GROUP_COMMIT)
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+
+# Import the app once in the master and fork workers from it, so each worker
+# skips the import and create_app cost and shares those pages copy-on-write.
+# Schema setup is not part of boot: set AUTO_CREATE_SCHEMA=false and run
+# `flask --app run init-db` as a release step.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def post_fork(server, worker):
+    # Pooled connections opened in the master (e.g. by AUTO_CREATE_SCHEMA)
+    # must not be shared with the children; close=False leaves them for the
+    # master to close rather than tearing down its sockets from the child.
+    if not preload_app:
+        return
+    from app import db
+    app = server.app.wsgi()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
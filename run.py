@@ -2,10 +2,20 @@ from app import create_app
 
 app = create_app()
 
-with app.app_context():
-    from app.models import db
-    db.create_all()
-    print("✅ Database tables ready")
+if app.config['AUTO_CREATE_SCHEMA']:
+    with app.app_context():
+        from app.models import db
+        db.create_all()
+        print("✅ Database tables ready")
+
+if app.config['CATALOG_PRELOAD']:
+    from sqlalchemy.exc import SQLAlchemyError
+    from app.catalog import warm_catalog
+    try:
+        warm_catalog(app)
+    except SQLAlchemyError as e:
+        # Schema not created yet; the index loads on first use instead
+        app.logger.warning('Catalog index not preloaded: %s', e)
 
 # Add a root route to render the login page or dashboard
 from flask import render_template
@@ -33,6 +33,8 @@ CREATE TABLE IF NOT EXISTS inventory_transactions (
     transaction_type VARCHAR(3) NOT NULL CHECK (transaction_type IN ('IN', 'OUT')),
     transaction_date TIMESTAMP DEFAULT NOW(),
     notes TEXT,
+    unit_cost NUMERIC(12, 4),
+    is_opening BOOLEAN NOT NULL DEFAULT FALSE,
     FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
 );
 
@@ -41,3 +43,103 @@ CREATE INDEX IF NOT EXISTS idx_products_supplier ON products(supplier_id);
 CREATE INDEX IF NOT EXISTS idx_transactions_product ON inventory_transactions(product_id);
 CREATE INDEX IF NOT EXISTS idx_transactions_date ON inventory_transactions(transaction_date);
 CREATE INDEX IF NOT EXISTS idx_transactions_prod_date ON inventory_transactions(product_id, transaction_date);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id VARCHAR(32) PRIMARY KEY,
+    job_type VARCHAR(50) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    params TEXT,
+    progress DOUBLE PRECISION NOT NULL DEFAULT 0,
+    message VARCHAR(255),
+    cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+    result_path VARCHAR(255),
+    result_mimetype VARCHAR(100),
+    error TEXT,
+    created_by INTEGER REFERENCES users(id),
+    created_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    worker VARCHAR(64),
+    heartbeat_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    scope VARCHAR(120) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'in_progress',
+    response_code INTEGER,
+    response_body TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL,
+    CONSTRAINT uq_idempotency_key UNIQUE (user_id, scope, key)
+);
+
+CREATE TABLE IF NOT EXISTS cost_layers (
+    id SERIAL PRIMARY KEY,
+    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    transaction_id INTEGER,
+    received_at TIMESTAMP NOT NULL,
+    unit_cost NUMERIC(12, 4) NOT NULL,
+    quantity_received INTEGER NOT NULL,
+    quantity_remaining INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_cost_layers_open ON cost_layers(product_id, quantity_remaining, received_at);
+
+CREATE TABLE IF NOT EXISTS inventory_valuations (
+    product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    total_value NUMERIC(16, 4) NOT NULL DEFAULT 0,
+    last_unit_cost NUMERIC(12, 4),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS stock_checkpoints (
+    as_of TIMESTAMP NOT NULL,
+    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    method VARCHAR(10) NOT NULL,
+    quantity INTEGER NOT NULL,
+    total_value NUMERIC(16, 4) NOT NULL,
+    last_unit_cost NUMERIC(12, 4),
+    layers TEXT NOT NULL DEFAULT '[]',
+    PRIMARY KEY (as_of, product_id)
+);
+
+CREATE TABLE IF NOT EXISTS archive_files (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL UNIQUE,
+    cutoff TIMESTAMP NOT NULL,
+    rows INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS changes (
+    entity VARCHAR(20) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    seq BIGINT NOT NULL,
+    deleted BOOLEAN NOT NULL DEFAULT FALSE,
+    changed_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (entity, entity_id)
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_changes_seq ON changes(seq);
+
+CREATE TABLE IF NOT EXISTS change_counter (
+    id INTEGER PRIMARY KEY,
+    value BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO change_counter (id, value) VALUES (1, 0) ON CONFLICT DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS change_pending (
+    entity VARCHAR(20) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    deleted BOOLEAN NOT NULL DEFAULT FALSE,
+    changed_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (entity, entity_id)
+);
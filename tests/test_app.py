@@ -1,12 +1,21 @@
+import asyncio
+import json
 import pytest
 import os
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
 from app import create_app, db
-from app.models import User, Product, Supplier, InventoryTransaction
+from app.jobs import job_runner
+from app.models import User, Product, Supplier, InventoryTransaction, IdempotencyKey
 from werkzeug.security import generate_password_hash
+from sqlalchemy import text
 from sqlalchemy.pool import NullPool
 
 @pytest.fixture
-def app():
+def app(tmp_path):
     app = create_app()
     
     test_db_url = os.getenv('DATABASE_URL', 'sqlite:///:memory:')
@@ -17,7 +26,10 @@ def app():
         "TESTING": True,
         "SQLALCHEMY_DATABASE_URI": test_db_url,
         "JWT_SECRET_KEY": "test-secret",
-        "SQLALCHEMY_ENGINE_OPTIONS": {"poolclass": NullPool}
+        "SQLALCHEMY_ENGINE_OPTIONS": {"poolclass": NullPool},
+        "JOB_RESULTS_DIR": str(tmp_path / 'job_results'),
+        # Each test drops its tables; the heartbeat is covered by calling recover()
+        "JOB_HEARTBEAT_INTERVAL": 3600
     })
 
     with app.app_context():
@@ -188,6 +200,82 @@ def test_get_products_with_sort(client, auth_headers):
     res = client.get('/api/products?sort=name', headers=auth_headers)
     assert res.status_code == 200
 
+def create_products(client, auth_headers, names, category='Test'):
+    ids = []
+    for i, name in enumerate(names):
+        res = client.post('/api/products', json={
+            'name': name,
+            'sku': f'{name.upper()}-{i}',
+            'category': category,
+            'supplier_id': 1,
+            'unit_price': 10.00
+        }, headers=auth_headers)
+        ids.append(res.json['id'])
+    return ids
+
+def test_get_products_count_modes(client, auth_headers):
+    create_products(client, auth_headers, ['Alpha', 'Beta', 'Gamma'])
+
+    res = client.get('/api/products?per_page=2&count=exact', headers=auth_headers)
+    assert (res.json['total'], res.json['pages'], res.json['has_next']) == (3, 2, True)
+
+    res = client.get('/api/products?per_page=2&count=none', headers=auth_headers)
+    assert res.json['total'] is None and res.json['pages'] is None
+    assert res.json['count_mode'] == 'none'
+    assert res.json['has_next'] is True
+
+    # SQLite has no planner statistics, so estimates fall back to cached counts
+    res = client.get('/api/products?count=estimate', headers=auth_headers)
+    assert (res.json['total'], res.json['count_mode']) == (3, 'cached')
+
+    assert client.get('/api/products?count=bogus', headers=auth_headers).status_code == 400
+
+def test_get_products_cached_count_invalidated(client, auth_headers):
+    create_products(client, auth_headers, ['Cached'])
+    assert client.get('/api/products', headers=auth_headers).json['total'] == 1
+    create_products(client, auth_headers, ['Fresh'])
+    assert client.get('/api/products', headers=auth_headers).json['total'] == 2
+
+def test_get_products_keyset_pagination(client, auth_headers):
+    create_products(client, auth_headers, ['Delta', 'Alpha', 'Charlie', 'Bravo', 'Echo'])
+
+    for sort in ('id', 'name'):
+        seen = []
+        url = f'/api/products?per_page=2&sort={sort}&count=none'
+        while url:
+            res = client.get(url, headers=auth_headers)
+            assert res.status_code == 200
+            seen += [p['name'] for p in res.json['products']]
+            cursor = res.json['next_cursor']
+            url = f'/api/products?per_page=2&sort={sort}&count=none&after={cursor}' if cursor else None
+        expected = ['Delta', 'Alpha', 'Charlie', 'Bravo', 'Echo'] if sort == 'id' else sorted(seen)
+        assert seen == expected
+
+    assert client.get('/api/products?after=not-a-cursor', headers=auth_headers).status_code == 400
+
+def test_get_products_sparse_fields(client, auth_headers):
+    client.post('/api/products', json={
+        'name': 'Sparse Product',
+        'sku': 'SPARSE-001',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 12.50,
+        'initial_stock': 8
+    }, headers=auth_headers)
+
+    res = client.get('/api/products', headers=auth_headers)
+    assert res.json['products'][0] == {
+        'id': 1, 'name': 'Sparse Product', 'sku': 'SPARSE-001', 'category': 'Test',
+        'supplier': 'Test Supplier', 'unit_price': 12.5, 'stock': 8, 'is_active': True
+    }
+
+    res = client.get('/api/products?fields=sku,stock', headers=auth_headers)
+    assert res.json['products'] == [{'sku': 'SPARSE-001', 'stock': 8}]
+
+    res = client.get('/api/products?fields=sku,bogus', headers=auth_headers)
+    assert res.status_code == 400
+    assert 'bogus' in res.json['message']
+
 def test_get_single_product(client, auth_headers):
     # Create product
     create_res = client.post('/api/products', json={
@@ -205,6 +293,35 @@ def test_get_single_product(client, auth_headers):
     assert res.json['name'] == 'Single Product'
     assert res.json['stock'] == 50
 
+def test_product_lookup_by_sku(client, auth_headers):
+    for i, stock in enumerate((5, 0)):
+        client.post('/api/products', json={
+            'name': f'Scanned {i}',
+            'sku': f'8712345/{i}',
+            'category': 'Test',
+            'supplier_id': 1,
+            'unit_price': 3.00,
+            'initial_stock': stock
+        }, headers=auth_headers)
+
+    res = client.get('/api/products/by-sku/8712345/0', headers=auth_headers)
+    assert res.status_code == 200
+    assert res.json['name'] == 'Scanned 0'
+    assert res.json['stock'] == 5
+    assert client.get('/api/products/by-sku/8712345', headers=auth_headers).status_code == 404
+    res = client.get('/api/products/by-sku/8712345/1?fields=sku,stock', headers=auth_headers)
+    assert res.json == {'sku': '8712345/1', 'stock': 0}
+
+    res = client.post('/api/products/lookup?fields=sku,stock', json={
+        'skus': ['8712345/1', 'MISSING', '8712345/0', '8712345/1']
+    }, headers=auth_headers)
+    assert res.status_code == 200
+    assert res.json['products'] == [{'sku': '8712345/1', 'stock': 0}, {'sku': '8712345/0', 'stock': 5}]
+    assert res.json['not_found'] == ['MISSING']
+
+    assert client.post('/api/products/lookup', json={'skus': []}, headers=auth_headers).status_code == 400
+    assert client.post('/api/products/lookup', json={'skus': [1]}, headers=auth_headers).status_code == 400
+
 def test_update_product(client, auth_headers):
     # Create product
     create_res = client.post('/api/products', json={
@@ -283,6 +400,126 @@ def test_delete_product(client, auth_headers):
     assert res.status_code == 200
     assert 'deleted' in res.json['message'].lower()
 
+def test_delete_product_removes_ledger(app, client, auth_headers):
+    product_id = create_products(client, auth_headers, ['Delete With Ledger'])[0]
+    client.post('/api/transactions', json={'product_id': product_id, 'quantity': 5, 'transaction_type': 'IN'},
+                headers=auth_headers)
+    res = client.delete(f'/api/products/{product_id}', headers=auth_headers)
+    assert res.status_code == 200
+    with app.app_context():
+        for table in ('inventory_transactions', 'cost_layers', 'inventory_valuations'):
+            count = db.session.execute(text(f"SELECT COUNT(*) FROM {table} WHERE product_id = {product_id}")).scalar()
+            assert count == 0, table
+
+
+def test_bulk_update_products_by_ids(client, auth_headers):
+    ids = create_products(client, auth_headers, ['Bulk A', 'Bulk B', 'Bulk C'])
+    res = client.patch('/api/products/bulk', json={
+        'ids': ids + [999999],
+        'set': {'unit_price': 10.00, 'category': 'Seasonal'}
+    }, headers=auth_headers)
+    assert res.status_code == 200
+    assert (res.json['updated'], res.json['unchanged'], res.json['not_found']) == (3, 0, 1)
+    assert res.json['results'][-1] == {'id': 999999, 'status': 'not_found'}
+
+    res = client.patch('/api/products/bulk', json={'ids': ids[:1], 'set': {'category': 'Seasonal'}},
+                       headers=auth_headers)
+    assert res.json['results'] == [{'id': ids[0], 'status': 'unchanged'}]
+
+    res = client.patch('/api/products/bulk', json={
+        'filter': {'category': 'Seasonal'},
+        'set': {'unit_price_percent': -25}
+    }, headers=auth_headers)
+    assert res.json['updated'] == 3
+    assert client.get(f'/api/products/{ids[1]}', headers=auth_headers).json['unit_price'] == 7.5
+
+def test_bulk_archive_products_by_filter(client, auth_headers):
+    create_products(client, auth_headers, ['Winter Coat', 'Winter Hat'], category='Winter')
+    keep = create_products(client, auth_headers, ['Summer Hat'], category='Summer')[0]
+    res = client.patch('/api/products/bulk/archive', json={'filter': {'category': 'Winter'}}, headers=auth_headers)
+    assert res.status_code == 200
+    assert res.json['updated'] == 2
+
+    res = client.get('/api/products?fields=id,category,is_active&per_page=100', headers=auth_headers)
+    active = {p['id']: p['is_active'] for p in res.json['products'] if p['category'] in ('Winter', 'Summer')}
+    assert sum(active.values()) == 1 and active[keep]
+
+def test_bulk_update_products_validation(client, auth_headers):
+    ids = create_products(client, auth_headers, ['Bulk Invalid'])
+    bad_bodies = [
+        {'set': {'category': 'X'}},
+        {'ids': ids, 'filter': {'category': 'Test'}, 'set': {'category': 'X'}},
+        {'ids': ids, 'set': {'sku': 'NEW'}},
+        {'ids': ids, 'set': {'unit_price': -1}},
+        {'ids': ids, 'set': {'unit_price': 1, 'unit_price_percent': 5}},
+        {'ids': ['1'], 'set': {'category': 'X'}},
+        {'filter': {}, 'set': {'category': 'X'}},
+    ]
+    for body in bad_bodies:
+        assert client.patch('/api/products/bulk', json=body, headers=auth_headers).status_code == 400, body
+
+
+def test_catalog_index_tracks_product_writes(app, client, auth_headers):
+    product_id = create_products(client, auth_headers, ['Indexed'])[0]
+    with app.app_context():
+        from app.catalog import catalog
+        index = catalog()
+        assert index.get(product_id).sku == 'INDEXED-0'
+
+    client.put(f'/api/products/{product_id}', json={'sku': 'INDEXED-NEW', 'unit_price': 12.5},
+               headers=auth_headers)
+    assert index.get(product_id).unit_price == Decimal('12.50')
+    assert index.sku_owner('INDEXED-0') is None
+    res = client.post('/api/products', json={'name': 'Dup', 'sku': 'INDEXED-NEW', 'category': 'Test',
+                                             'supplier_id': 1, 'unit_price': 1}, headers=auth_headers)
+    assert res.status_code == 400
+
+    client.delete(f'/api/products/{product_id}', headers=auth_headers)
+    assert index.sku_owner('INDEXED-NEW') is None
+    res = client.post('/api/transactions', json={'product_id': product_id, 'quantity': 1, 'transaction_type': 'IN'},
+                      headers=auth_headers)
+    assert res.status_code == 404
+
+def test_transaction_for_product_deleted_elsewhere(app, client, auth_headers):
+    ids = create_products(client, auth_headers, ['Deleted Elsewhere', 'Batched Elsewhere'])
+    # Deleted by another worker: this worker's index still has both
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(text('DELETE FROM inventory_valuations WHERE product_id IN (:a, :b)'),
+                         {'a': ids[0], 'b': ids[1]})
+            conn.execute(text('DELETE FROM inventory_transactions WHERE product_id IN (:a, :b)'),
+                         {'a': ids[0], 'b': ids[1]})
+            conn.execute(text('DELETE FROM products WHERE id IN (:a, :b)'), {'a': ids[0], 'b': ids[1]})
+
+    res = client.post('/api/transactions', json={'product_id': ids[0], 'quantity': 1, 'transaction_type': 'IN'},
+                      headers=auth_headers)
+    assert res.status_code == 404
+    app.config['GROUP_COMMIT'] = True
+    res = client.post('/api/transactions', json={'product_id': ids[1], 'quantity': 1, 'transaction_type': 'IN'},
+                      headers=auth_headers)
+    assert res.status_code == 404
+    with app.app_context():
+        assert InventoryTransaction.query.filter(InventoryTransaction.product_id.in_(ids)).count() == 0
+
+def test_catalog_index_sees_other_workers(app, client, auth_headers):
+    create_products(client, auth_headers, ['Loaded First'])
+    # Rows written behind this worker's back, as another worker would
+    with app.app_context():
+        db.session.execute(text(
+            "INSERT INTO products (name, sku, category, supplier_id, unit_price, is_active) "
+            "VALUES ('Elsewhere', 'ELSEWHERE-1', 'Test', 1, 3.00, TRUE)"
+        ))
+        db.session.commit()
+        other_id = db.session.execute(text("SELECT id FROM products WHERE sku = 'ELSEWHERE-1'")).scalar()
+
+    res = client.post('/api/transactions', json={'product_id': other_id, 'quantity': 2, 'transaction_type': 'IN'},
+                      headers=auth_headers)
+    assert res.status_code == 201
+    res = client.post('/api/products', json={'name': 'Clash', 'sku': 'ELSEWHERE-1', 'category': 'Test',
+                                             'supplier_id': 1, 'unit_price': 1}, headers=auth_headers)
+    assert res.status_code == 400
+    assert 'SKU' in res.json['message']
+
 
 # ==================== SUPPLIER TESTS ====================
 
@@ -292,6 +529,10 @@ def test_get_suppliers(client, auth_headers):
     assert isinstance(res.json, list)
     assert len(res.json) > 0  # Test Supplier exists
 
+def test_get_suppliers_sparse_fields(client, auth_headers):
+    res = client.get('/api/suppliers?fields=name', headers=auth_headers)
+    assert res.json == [{'name': 'Test Supplier'}]
+
 def test_create_supplier(client, auth_headers):
     res = client.post('/api/suppliers', json={
         'name': 'New Supplier Co',
@@ -391,6 +632,48 @@ def test_transaction_flow(client, auth_headers):
     res = client.get(f'/api/products/{product_id}', headers=auth_headers)
     assert res.json['stock'] == 55
 
+def test_get_transactions_sparse_fields(client, auth_headers):
+    client.post('/api/products', json={
+        'name': 'Sparse Ledger',
+        'sku': 'SPARSE-LEDGER',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 10.00,
+        'initial_stock': 3
+    }, headers=auth_headers)
+
+    res = client.get('/api/transactions', headers=auth_headers)
+    assert set(res.json[0]) == {'id', 'product_name', 'quantity', 'type', 'date', 'notes'}
+    assert res.json[0]['product_name'] == 'Sparse Ledger'
+
+    res = client.get('/api/transactions?fields=sku,quantity&product_id=1', headers=auth_headers)
+    assert res.json == [{'sku': 'SPARSE-LEDGER', 'quantity': 3}]
+
+def add_dated_transactions(app, product_id, dates, quantity=5, transaction_type='IN'):
+    with app.app_context():
+        for d in dates:
+            db.session.add(InventoryTransaction(product_id=product_id, quantity=quantity,
+                                                transaction_type=transaction_type, transaction_date=d))
+        db.session.commit()
+
+def test_get_transactions_date_range(app, client, auth_headers):
+    product_id = client.post('/api/products', json={
+        'name': 'Dated Product',
+        'sku': 'DATED-001',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 10.00
+    }, headers=auth_headers).json['id']
+    add_dated_transactions(app, product_id, [datetime(2024, 1, 15), datetime(2024, 2, 15), datetime(2024, 3, 15)])
+
+    res = client.get('/api/transactions?start=2024-02-01&end=2024-03-01', headers=auth_headers)
+    assert res.status_code == 200
+    assert [t['date'][:10] for t in res.json] == ['2024-02-15']
+    assert client.get('/api/transactions?start=garbage', headers=auth_headers).status_code == 400
+    res = client.get('/api/transactions?product_id=abc', headers=auth_headers)
+    assert res.status_code == 400
+    assert res.json['message'] == 'Invalid product_id'
+
 def test_get_transactions(client, auth_headers):
     # Create product with transactions
     client.post('/api/products', json={
@@ -501,9 +784,1226 @@ def test_analytics_products_by_supplier(client, auth_headers):
     assert res.status_code == 200
     assert isinstance(res.json, list)
 
-# Note: test_analytics_stock_movement skipped - uses PostgreSQL-specific 
-# running total SQL that's incompatible with SQLite test database.
-# The endpoint works correctly in production with PostgreSQL.
+def test_analytics_stock_movement(client, auth_headers):
+    create_res = client.post('/api/products', json={
+        'name': 'Movement Product',
+        'sku': 'MOVE-001',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 10.00,
+        'initial_stock': 30
+    }, headers=auth_headers)
+    product_id = create_res.json['id']
+    client.post('/api/transactions', json={
+        'product_id': product_id,
+        'quantity': 12,
+        'transaction_type': 'OUT'
+    }, headers=auth_headers)
+
+    res = client.get(f'/api/analytics/stock-movement/{product_id}', headers=auth_headers)
+    assert res.status_code == 200
+    assert [m['running_stock'] for m in res.json] == [30, 18]
+
+
+def post_movement(client, headers, product_id, quantity, transaction_type='IN', unit_cost=None):
+    payload = {'product_id': product_id, 'quantity': quantity, 'transaction_type': transaction_type}
+    if unit_cost is not None:
+        payload['unit_cost'] = unit_cost
+    return client.post('/api/transactions', json=payload, headers=headers)
+
+def test_valuation_fifo(app, client, auth_headers):
+    product_id = create_products(client, auth_headers, ['FIFO Product'])[0]
+    post_movement(client, auth_headers, product_id, 10, unit_cost=5)
+    post_movement(client, auth_headers, product_id, 10, unit_cost=8)
+    post_movement(client, auth_headers, product_id, 15, 'OUT')
+
+    res = client.get('/api/analytics/stock-value', headers=auth_headers)
+    assert res.json == {'total_stock_value': 40.0, 'method': 'fifo'}
+    with app.app_context():
+        from app.models import CostLayer
+        layers = CostLayer.query.order_by(CostLayer.id).all()
+        assert [(layer.quantity_remaining, float(layer.unit_cost)) for layer in layers] == [(0, 5.0), (5, 8.0)]
+
+def test_valuation_weighted_average(app, client, auth_headers):
+    app.config['INVENTORY_VALUATION_METHOD'] = 'average'
+    product_id = create_products(client, auth_headers, ['Average Product'], category='Averaged')[0]
+    post_movement(client, auth_headers, product_id, 10, unit_cost=5)
+    post_movement(client, auth_headers, product_id, 10, unit_cost=8)
+    post_movement(client, auth_headers, product_id, 15, 'OUT')
+
+    res = client.get('/api/analytics/stock-value', headers=auth_headers)
+    assert res.json == {'total_stock_value': 32.5, 'method': 'average'}
+    res = client.get('/api/analytics/stock-by-category', headers=auth_headers)
+    averaged = next(row for row in res.json if row['category'] == 'Averaged')
+    assert (averaged['total_units'], averaged['total_value']) == (5, 32.5)
+
+def test_valuation_defaults_to_list_price(client, auth_headers):
+    product_id = create_products(client, auth_headers, ['Priced Product'])[0]
+    price = client.get(f'/api/products/{product_id}', headers=auth_headers).json['unit_price']
+    post_movement(client, auth_headers, product_id, 4)
+    res = client.get('/api/analytics/stock-value', headers=auth_headers)
+    assert res.json['total_stock_value'] == 4 * price
+
+def test_opening_note_does_not_skip_valuation(app, client, auth_headers):
+    # Only the is_opening flag marks carried-forward balances; clients
+    # cannot set it, whatever the note says
+    from app.archive import ARCHIVE_OPENING_NOTE
+    product_id = create_products(client, auth_headers, ['Noted Product'])[0]
+    res = client.post('/api/transactions', json={
+        'product_id': product_id, 'quantity': 3, 'transaction_type': 'IN', 'unit_cost': 4,
+        'notes': ARCHIVE_OPENING_NOTE, 'is_opening': True
+    }, headers=auth_headers)
+    assert res.status_code == 201
+    assert client.get('/api/analytics/stock-value', headers=auth_headers).json['total_stock_value'] == 12.0
+    with app.app_context():
+        assert not db.session.get(InventoryTransaction, res.json['id']).is_opening
+    assert app.test_cli_runner().invoke(args=['valuation', 'check']).exit_code == 0
+
+def test_transaction_invalid_unit_cost(client, auth_headers):
+    product_id = create_products(client, auth_headers, ['Costed Product'])[0]
+    assert post_movement(client, auth_headers, product_id, 1, unit_cost='abc').status_code == 400
+    assert post_movement(client, auth_headers, product_id, 1, unit_cost=-2).status_code == 400
+    post_movement(client, auth_headers, product_id, 5)
+    assert post_movement(client, auth_headers, product_id, 1, 'OUT', unit_cost=3).status_code == 400
+
+def test_valuation_check_detects_and_fixes_drift(app, client, auth_headers):
+    product_id = create_products(client, auth_headers, ['Audited Product'])[0]
+    post_movement(client, auth_headers, product_id, 10, unit_cost=2)
+    post_movement(client, auth_headers, product_id, 4, 'OUT')
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['valuation', 'check'])
+    assert result.exit_code == 0, result.output
+    assert '0 mismatches' in result.output
+
+    with app.app_context():
+        db.session.execute(text("UPDATE inventory_valuations SET total_value = 999"))
+        db.session.commit()
+    result = runner.invoke(args=['valuation', 'check'])
+    assert result.exit_code == 1
+    assert f'Product {product_id}: stored 6 units / 999.0000, expected 6 units / 12.0000' in result.output
+
+    result = runner.invoke(args=['valuation', 'check', '--fix'])
+    assert result.exit_code == 0, result.output
+    res = client.get('/api/analytics/stock-value', headers=auth_headers)
+    assert res.json['total_stock_value'] == 12.0
+    assert '0 mismatches' in runner.invoke(args=['valuation', 'check']).output
+
+
+def test_singleflight_coalesces_concurrent_calls(app):
+    from app.singleflight import SingleFlight
+    flight = SingleFlight()
+    gate = threading.Event()
+    calls = []
+    results = []
+
+    def compute():
+        calls.append(1)
+        gate.wait(5)
+        return {'total': 42}
+
+    def caller():
+        results.append(flight.do(('stock-by-category',), compute))
+
+    threads = [threading.Thread(target=caller) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while len(calls) < 1:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    gate.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(result is results[0][0] for result, _ in results)
+    # Finished calls are not cached
+    assert flight.do(('stock-by-category',), lambda: 'fresh') == ('fresh', False)
+
+def test_analytics_metrics(client, auth_headers):
+    client.get('/api/analytics/stock-by-category', headers=auth_headers)
+    client.get('/api/analytics/stock-by-category', headers=auth_headers)
+    res = client.get('/api/metrics', headers=auth_headers)
+    assert res.status_code == 200
+    assert res.json['singleflight.analytics.stock_by_category.executed'] == 2
+
+
+def analytics_by_engine(app, engine):
+    from app.routes import analytics
+    app.config['ANALYTICS_ENGINE'] = engine
+    app.config['ANALYTICS_REFRESH_INTERVAL'] = 0
+    with app.app_context():
+        return {
+            'top_selling': sorted(analytics.top_selling_data(), key=lambda r: (-r['total_sold'], r['name'])),
+            'low_stock': sorted(analytics.low_stock_data(), key=lambda r: (r['stock'], r['sku'])),
+            'stock_value': analytics.stock_value_data(),
+            'stock_by_category': sorted(analytics.stock_by_category_data(), key=lambda r: r['category']),
+            'products_by_supplier': sorted(analytics.products_by_supplier_data(), key=lambda r: r['supplier']),
+        }
+
+def test_numpy_engine_matches_sql(app, client, auth_headers):
+    with app.app_context():
+        db.session.add(Supplier(name='Second Supplier'))
+        db.session.commit()
+    ids = create_products(client, auth_headers, ['Bolt', 'Nut', 'Washer'], category='Hardware')
+    ids += create_products(client, auth_headers, ['Glue', 'Tape'], category='Adhesives')
+    client.put(f'/api/products/{ids[3]}', json={'unit_price': 4.5}, headers=auth_headers)
+    with app.app_context():
+        db.session.get(Product, ids[4]).supplier_id = 2
+        db.session.commit()
+    for product_id, stock, sold in zip(ids, [50, 10, 30, 25, 5], [7, 3, 12, 0, 1]):
+        client.post('/api/transactions', json={'product_id': product_id, 'quantity': stock, 'transaction_type': 'IN',
+                                               'unit_cost': 2}, headers=auth_headers)
+        if sold:
+            client.post('/api/transactions', json={'product_id': product_id, 'quantity': sold,
+                                                   'transaction_type': 'OUT'}, headers=auth_headers)
+    client.patch(f'/api/products/{ids[2]}/toggle-active', headers=auth_headers)
+
+    expected = analytics_by_engine(app, 'sql')
+    assert [r['supplier'] for r in expected['products_by_supplier']] == ['Second Supplier', 'Test Supplier']
+    assert [r['sku'] for r in expected['low_stock']] == ['TAPE-1', 'NUT-1']
+    assert analytics_by_engine(app, 'numpy') == expected
+
+    # New rows are appended; deleted ones force a full reload
+    client.post('/api/transactions', json={'product_id': ids[1], 'quantity': 4, 'transaction_type': 'OUT'},
+                headers=auth_headers)
+    assert analytics_by_engine(app, 'numpy') == analytics_by_engine(app, 'sql')
+    assert client.delete(f'/api/products/{ids[0]}', headers=auth_headers).status_code == 200
+    numpy_results = analytics_by_engine(app, 'numpy')
+    assert numpy_results == analytics_by_engine(app, 'sql')
+    assert 'Bolt' not in [r['name'] for r in numpy_results['top_selling']]
+
+
+# ==================== ARCHIVE TESTS ====================
+
+def test_archive_old_transactions(app, client, auth_headers, tmp_path):
+    app.config['LEDGER_ARCHIVE_DIR'] = str(tmp_path)
+    product_id = client.post('/api/products', json={
+        'name': 'Archived Product',
+        'sku': 'ARCH-001',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 10.00
+    }, headers=auth_headers).json['id']
+    add_dated_transactions(app, product_id, [datetime(2023, 3, 1)], quantity=100)
+    add_dated_transactions(app, product_id, [datetime(2023, 4, 1)], quantity=30, transaction_type='OUT')
+    add_dated_transactions(app, product_id, [datetime(2023, 5, 1)], quantity=20, transaction_type='OUT')
+    client.post('/api/transactions', json={
+        'product_id': product_id,
+        'quantity': 5,
+        'transaction_type': 'OUT'
+    }, headers=auth_headers)
+
+    result = app.test_cli_runner().invoke(args=['ledger', 'archive', '--before', '2024-01-01'])
+    assert result.exit_code == 0, result.output
+    assert 'Archived 3 transactions across 1 products' in result.output
+
+    with app.app_context():
+        live = InventoryTransaction.query.order_by(InventoryTransaction.transaction_date).all()
+        assert [(t.transaction_type, t.quantity) for t in live] == [('IN', 50), ('OUT', 5)]
+
+        from app.archive import open_archives
+        archive = open_archives()[0]
+        assert isinstance(archive.column('qty'), memoryview)
+        assert archive.column('qty').tolist() == [100, -30, -20]
+        assert archive.product_totals() == {product_id: (100, 50)}
+
+    res = client.get(f'/api/products/{product_id}', headers=auth_headers)
+    assert res.json['stock'] == 45
+    res = client.get('/api/analytics/top-selling', headers=auth_headers)
+    assert res.json == [{'name': 'Archived Product', 'total_sold': 55}]
+    res = client.get(f'/api/analytics/stock-movement/{product_id}', headers=auth_headers)
+    assert [m['running_stock'] for m in res.json] == [100, 70, 50, 45]
+    assert res.json[0]['date'].startswith('2023-03-01')
+
+def test_archive_folds_previous_opening_balance(app, client, auth_headers, tmp_path):
+    app.config['LEDGER_ARCHIVE_DIR'] = str(tmp_path)
+    product_id = client.post('/api/products', json={
+        'name': 'Twice Archived',
+        'sku': 'ARCH-002',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 10.00
+    }, headers=auth_headers).json['id']
+    add_dated_transactions(app, product_id, [datetime(2022, 6, 1)], quantity=40)
+    add_dated_transactions(app, product_id, [datetime(2023, 6, 1)], quantity=15, transaction_type='OUT')
+    runner = app.test_cli_runner()
+    runner.invoke(args=['ledger', 'archive', '--before', '2023-01-01'])
+    runner.invoke(args=['ledger', 'archive', '--before', '2024-01-01'])
+
+    with app.app_context():
+        live = InventoryTransaction.query.all()
+        assert [(t.transaction_type, t.quantity) for t in live] == [('IN', 25)]
+    res = client.get(f'/api/analytics/stock-movement/{product_id}', headers=auth_headers)
+    assert [(m['type'], m['running_stock']) for m in res.json] == [('IN', 40), ('OUT', 25)]
+
+def test_archive_files_are_registered(app, client, auth_headers, tmp_path):
+    from app.archive import register_legacy_archives, write_archive
+    app.config['LEDGER_ARCHIVE_DIR'] = str(tmp_path)
+    product_id = create_products(client, auth_headers, ['Registered Archive'])[0]
+    add_dated_transactions(app, product_id, [datetime(2023, 1, 1)], quantity=30)
+    runner = app.test_cli_runner()
+    runner.invoke(args=['ledger', 'archive', '--before', '2024-01-01'])
+    # Re-archiving with the same cutoff adds a file instead of replacing the first
+    add_dated_transactions(app, product_id, [datetime(2023, 6, 1)], quantity=10, transaction_type='OUT')
+    runner.invoke(args=['ledger', 'archive', '--before', '2024-01-01'])
+    assert len(list(tmp_path.glob('*.ilc'))) == 2
+
+    # A file left by an archive that crashed before its commit is ignored,
+    # unless it predates registration (no unique suffix)
+    with app.app_context():
+        write_archive(str(tmp_path / 'ledger-20240101-0000000001-0000000001-deadbeef.ilc'),
+                      [(999, product_id, 5, datetime(2023, 7, 1), None)], datetime(2024, 1, 1))
+    res = client.get(f'/api/analytics/stock-movement/{product_id}', headers=auth_headers)
+    assert [m['running_stock'] for m in res.json] == [30, 20]
+    with pytest.raises(FileExistsError):
+        write_archive(str(tmp_path / 'ledger-20240101-0000000001-0000000001-deadbeef.ilc'), [], datetime(2024, 1, 1))
+    (tmp_path / 'ledger-20240101-0000000001-0000000001-deadbeef.ilc').rename(
+        tmp_path / 'ledger-20220101-0000000001-0000000001.ilc')
+    with app.app_context():
+        assert register_legacy_archives() == 1
+        assert register_legacy_archives() == 0
+    res = client.get(f'/api/analytics/stock-movement/{product_id}', headers=auth_headers)
+    assert [m['running_stock'] for m in res.json] == [30, 20, 25]
+
+def test_archive_carries_cost_layers_forward(app, client, auth_headers, tmp_path):
+    app.config['LEDGER_ARCHIVE_DIR'] = str(tmp_path)
+    product_id = create_products(client, auth_headers, ['Layered Archive'])[0]
+    with app.app_context():
+        movements = [(datetime(2023, 1, 1), 10, 'IN', 5), (datetime(2023, 2, 1), 10, 'IN', 8),
+                     (datetime(2023, 3, 1), 5, 'OUT', None)]
+        for when, quantity, trans_type, cost in movements:
+            db.session.add(InventoryTransaction(product_id=product_id, quantity=quantity, transaction_type=trans_type,
+                                                transaction_date=when, unit_cost=cost))
+            db.session.commit()
+    result = app.test_cli_runner().invoke(args=['ledger', 'archive', '--before', '2024-01-01'])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        live = InventoryTransaction.query.order_by(InventoryTransaction.id).all()
+        assert [(t.quantity, float(t.unit_cost)) for t in live] == [(5, 5.0), (10, 8.0)]
+    post_movement(client, auth_headers, product_id, 8, 'OUT')
+    res = client.get('/api/analytics/stock-value', headers=auth_headers)
+    assert res.json['total_stock_value'] == 56.0
+    assert '0 mismatches' in app.test_cli_runner().invoke(args=['valuation', 'check']).output
+
+
+# ==================== AS-OF REPORT TESTS ====================
+
+def stock_as_of(client, headers, at):
+    res = client.get(f'/api/analytics/stock-as-of?at={at}', headers=headers)
+    if res.status_code != 200:
+        return res.status_code, res.json
+    return res.json['checkpoint'], [(r['sku'], r['quantity'], r['value']) for r in res.json['products']]
+
+def test_stock_as_of(app, client, auth_headers, tmp_path):
+    app.config['LEDGER_ARCHIVE_DIR'] = str(tmp_path)
+    layered, plain = create_products(client, auth_headers, ['Layered', 'Plain'])
+    with app.app_context():
+        movements = [(layered, datetime(2023, 1, 1), 10, 'IN', 5), (plain, datetime(2023, 1, 15), 4, 'IN', None),
+                     (layered, datetime(2023, 2, 1), 10, 'IN', 8), (layered, datetime(2023, 3, 1), 15, 'OUT', None)]
+        for product_id, when, quantity, trans_type, cost in movements:
+            db.session.add(InventoryTransaction(product_id=product_id, quantity=quantity, transaction_type=trans_type,
+                                                transaction_date=when, unit_cost=cost))
+            db.session.commit()
+
+    assert stock_as_of(client, auth_headers, '2022-12-31') == (None, [('LAYERED-0', 0, 0.0), ('PLAIN-1', 0, 0.0)])
+    assert stock_as_of(client, auth_headers, '2023-01-31') == (None, [('LAYERED-0', 10, 50.0), ('PLAIN-1', 4, 40.0)])
+    assert stock_as_of(client, auth_headers, '2023-03-15') == (None, [('LAYERED-0', 5, 40.0), ('PLAIN-1', 4, 40.0)])
+    res = client.get('/api/analytics/stock-as-of?at=2023-03-15', headers=auth_headers)
+    assert (res.json['total_quantity'], res.json['total_value'], res.json['method']) == (9, 80.0, 'fifo')
+    assert client.get('/api/analytics/stock-as-of', headers=auth_headers).status_code == 400
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['ledger', 'checkpoint', '--at', '2023-02-15'])
+    assert result.exit_code == 0, result.output
+    assert 'Checkpoint 2023-02-15T00:00:00 (fifo): 2 products, built from a full replay' in result.output
+    assert stock_as_of(client, auth_headers, '2023-03-15') == (
+        '2023-02-15T00:00:00', [('LAYERED-0', 5, 40.0), ('PLAIN-1', 4, 40.0)])
+    assert 'cannot be taken in the future' in runner.invoke(args=['ledger', 'checkpoint', '--at', '2999-01-01']).output
+
+    res = client.post('/api/jobs', json={'type': 'stock-as-of-export', 'params': {'at': '2023-03-15'}},
+                      headers=auth_headers)
+    job = wait_for_job(client, auth_headers, res.json['id'])
+    assert job['status'] == 'succeeded', job
+    res = client.get(f"/api/jobs/{job['id']}/result", headers=auth_headers)
+    assert res.data.decode().splitlines() == ['product_id,sku,name,quantity,value',
+                                              f'{layered},LAYERED-0,Layered,5,40.0', f'{plain},PLAIN-1,Plain,4,40.0']
+
+    # History before the archive cutoff is only reachable through a checkpoint taken there
+    result = runner.invoke(args=['ledger', 'archive', '--before', '2023-03-01'])
+    assert 'Checkpoint 2023-03-01T00:00:00: 2 products' in result.output
+    assert stock_as_of(client, auth_headers, '2023-03-15') == (
+        '2023-03-01T00:00:00', [('LAYERED-0', 5, 40.0), ('PLAIN-1', 4, 40.0)])
+    assert stock_as_of(client, auth_headers, '2023-02-15') == (
+        '2023-02-15T00:00:00', [('LAYERED-0', 20, 130.0), ('PLAIN-1', 4, 40.0)])
+    status, body = stock_as_of(client, auth_headers, '2023-01-31')
+    assert status == 409 and 'archived' in body['message']
+
+    # Purging a product removes its checkpoint rows too
+    from app.models import StockCheckpoint
+    client.delete(f'/api/products/{plain}', headers=auth_headers)
+    with app.app_context():
+        assert StockCheckpoint.query.filter_by(product_id=plain).count() == 0
+        assert StockCheckpoint.query.filter_by(product_id=layered).count() == 2
+
+def test_stock_as_of_replays_only_sold_products(app, client, auth_headers):
+    from app.checkpoints import replay_as_of
+    sold, received = create_products(client, auth_headers, ['Sold', 'Received'])
+    with app.app_context():
+        movements = [(sold, datetime(2023, 1, 1), 10, 'IN', 5), (sold, datetime(2023, 1, 2), 10, 'IN', 7),
+                     (sold, datetime(2023, 1, 3), 12, 'OUT', None), (received, datetime(2023, 1, 1), 3, 'IN', 2.5),
+                     (received, datetime(2023, 1, 2), 2, 'IN', None)]
+        for product_id, when, quantity, trans_type, cost in movements:
+            db.session.add(InventoryTransaction(product_id=product_id, quantity=quantity, transaction_type=trans_type,
+                                                transaction_date=when, unit_cost=cost))
+        db.session.commit()
+        replayed = []
+        method, base, states = replay_as_of(datetime(2023, 2, 1), progress=replayed.append)
+        # Only the product with an issue was walked row by row
+        assert replayed == [3]
+        assert (states[sold].quantity, states[sold].value) == (8, Decimal('56.0000'))
+        assert (states[received].quantity, states[received].value) == (5, Decimal('27.5000'))
+
+def test_monthly_stock_checkpoint(app, client, auth_headers):
+    from sqlalchemy import delete
+    from app.checkpoints import latest_checkpoint
+    from app.models import StockCheckpoint
+    from app.routes.analytics import schedule_stock_checkpoint
+    # Jobs the workers queue themselves are only visible to admins
+    app.config['ADMIN_USERNAMES'] = {'admin'}
+    product_id = create_products(client, auth_headers, ['Monthly'])[0]
+    month = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    with app.app_context():
+        db.session.add(InventoryTransaction(product_id=product_id, quantity=6, transaction_type='IN',
+                                            transaction_date=month - timedelta(days=1)))
+        db.session.commit()
+        job = schedule_stock_checkpoint(app)
+        assert job is not None
+        assert schedule_stock_checkpoint(app) is None
+    assert wait_for_job(client, auth_headers, job.id)['status'] == 'succeeded'
+    with app.app_context():
+        assert latest_checkpoint(month, 'fifo') == month
+        assert schedule_stock_checkpoint(app) is None
+        app.config['STOCK_CHECKPOINT_MONTHLY'] = False
+        db.session.execute(delete(StockCheckpoint.__table__))
+        db.session.commit()
+        assert schedule_stock_checkpoint(app) is None
+
+
+# ==================== LEDGER PARTITION TESTS ====================
+
+def test_detach_ledger_periods_sqlite(app, client, auth_headers):
+    product_id = client.post('/api/products', json={
+        'name': 'Partitioned Product',
+        'sku': 'PART-001',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 10.00
+    }, headers=auth_headers).json['id']
+    add_dated_transactions(app, product_id, [datetime(2024, 1, 3)], quantity=50)
+    add_dated_transactions(app, product_id, [datetime(2024, 1, 20)], quantity=10, transaction_type='OUT')
+    add_dated_transactions(app, product_id, [datetime(2024, 3, 9), datetime.utcnow()])
+    runner = app.test_cli_runner()
+
+    def stock_views():
+        return (client.get(f'/api/products/{product_id}', headers=auth_headers).json['stock'],
+                client.get('/api/analytics/low-stock', headers=auth_headers).json,
+                client.get('/api/analytics/stock-value', headers=auth_headers).json)
+    before = stock_views()
+    assert before[0] == 50
+
+    result = runner.invoke(args=['ledger', 'detach-partitions', '--before', '2024-04'])
+    assert result.exit_code == 0, result.output
+    assert '2 periods detached' in result.output
+
+    # The balance is carried forward, one opening row per open cost layer
+    assert stock_views() == before
+    with app.app_context():
+        live = InventoryTransaction.query.order_by(InventoryTransaction.transaction_date).all()
+        assert [(t.transaction_type, t.quantity) for t in live] == [('IN', 40), ('IN', 5), ('IN', 5)]
+        archived = db.session.execute(text('SELECT COUNT(*) FROM inventory_transactions_p2024_01')).scalar()
+        assert archived == 2
+    assert runner.invoke(args=['valuation', 'check']).exit_code == 0
+    assert runner.invoke(args=['ledger', 'reconcile', '--workers', '0']).exit_code == 0
+
+    # A second detach folds the opening rows instead of copying them
+    result = runner.invoke(args=['ledger', 'detach-partitions', '--before', '2024-05'])
+    assert '0 periods detached' in result.output
+    assert stock_views() == before
+    with app.app_context():
+        first = InventoryTransaction.query.order_by(InventoryTransaction.transaction_date).first()
+        assert first.transaction_date == datetime(2024, 5, 1)
+
+    result = runner.invoke(args=['ledger', 'list-partitions'])
+    assert result.output.split() == ['inventory_transactions_p2024_01', 'inventory_transactions_p2024_03']
+
+    result = runner.invoke(args=['ledger', 'drop-periods', '--before', '2024-02'])
+    assert '1 periods dropped' in result.output
+    result = runner.invoke(args=['ledger', 'list-partitions'])
+    assert result.output.split() == ['inventory_transactions_p2024_03']
+    with app.app_context():
+        db.session.execute(text('DROP TABLE inventory_transactions_p2024_03'))
+        db.session.commit()
+
+def test_partition_commands_on_sqlite(app):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['ledger', 'partition-init'])
+    assert result.exit_code != 0
+    assert 'PostgreSQL' in result.output
+    result = runner.invoke(args=['ledger', 'create-partitions'])
+    assert '0 partitions created' in result.output
+    result = runner.invoke(args=['ledger', 'detach-partitions', '--before', 'soon'])
+    assert result.exit_code != 0
+
+
+def test_ledger_reconcile(app, client, auth_headers):
+    ids = [client.post('/api/products', json={
+        'name': f'Reconciled {i}',
+        'sku': f'RECON-{i:03d}',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 10.00,
+        'initial_stock': 20
+    }, headers=auth_headers).json['id'] for i in range(3)]
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['ledger', 'reconcile', '--workers', '0', '--partitions', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Checked 3 transactions for 3 products' in result.output
+
+    # An issue dated before the opening receipt drives the balance negative
+    add_dated_transactions(app, ids[0], [datetime(2020, 1, 1)], quantity=5, transaction_type='OUT')
+    with app.app_context():
+        with db.engine.connect() as conn:
+            # Orphans date from before foreign keys were enforced
+            conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            conn.execute(text("INSERT INTO inventory_transactions (product_id, quantity, transaction_type, "
+                              "transaction_date) VALUES (9999, 4, 'IN', '2024-01-01 00:00:00')"))
+            conn.commit()
+            conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+        db.session.execute(text('UPDATE inventory_valuations SET quantity = 7 WHERE product_id = :id'),
+                           {'id': ids[2]})
+        db.session.commit()
+
+    result = runner.invoke(args=['ledger', 'reconcile', '--workers', '2'])
+    assert result.exit_code == 1, result.output
+    assert f'negative_balances: product_id={ids[0]}' in result.output
+    assert 'orphans: product_id=9999' in result.output
+    assert f'mismatches: product_id={ids[2]}, ledger=20, stored=7' in result.output
+    assert '1 negative_balances, 1 orphans, 0 invalid_rows, 1 mismatches' in result.output
+
+def test_init_db_command(app):
+    with app.app_context():
+        db.drop_all()
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert Product.query.count() == 0
+        assert 'unit_cost' in {c['name'] for c in db.inspect(db.engine).get_columns('inventory_transactions')}
+        # Seeded up front, so the first concurrent readers only UPDATE it
+        from app.models import ChangeCounter
+        assert db.session.get(ChangeCounter, 1).value == 0
+
+
+# ==================== IDEMPOTENCY TESTS ====================
+
+def test_idempotent_transaction_retry(client, auth_headers):
+    create_res = client.post('/api/products', json={
+        'name': 'Retry Product',
+        'sku': 'RETRY-001',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 10.00,
+        'initial_stock': 10
+    }, headers=auth_headers)
+    product_id = create_res.json['id']
+
+    headers = dict(auth_headers, **{'Idempotency-Key': 'sale-42'})
+    body = {'product_id': product_id, 'quantity': 4, 'transaction_type': 'OUT'}
+    first = client.post('/api/transactions', json=body, headers=headers)
+    retry = client.post('/api/transactions', json=body, headers=headers)
+    assert first.status_code == retry.status_code == 201
+    assert retry.json['id'] == first.json['id']
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+
+    res = client.get(f'/api/products/{product_id}', headers=auth_headers)
+    assert res.json['stock'] == 6
+
+def test_idempotency_key_reused_with_different_body(client, auth_headers):
+    headers = dict(auth_headers, **{'Idempotency-Key': 'supplier-1'})
+    assert client.post('/api/suppliers', json={'name': 'Keyed Supplier'}, headers=headers).status_code == 201
+    res = client.post('/api/suppliers', json={'name': 'Other Supplier'}, headers=headers)
+    assert res.status_code == 422
+
+def test_idempotency_replays_client_errors(client, auth_headers):
+    headers = dict(auth_headers, **{'Idempotency-Key': 'bad-product'})
+    first = client.post('/api/products', json={'name': 'Incomplete'}, headers=headers)
+    retry = client.post('/api/products', json={'name': 'Incomplete'}, headers=headers)
+    assert first.status_code == retry.status_code == 400
+    assert retry.json == first.json
+
+def test_idempotency_key_in_progress(app, client, auth_headers):
+    body = b'{"name": "Racing Supplier"}'
+    with app.app_context():
+        db.session.add(IdempotencyKey(
+            user_id=1, scope='POST /api/suppliers', key='racing',
+            request_hash=hashlib.sha256(body).hexdigest(),
+            expires_at=datetime.utcnow() + timedelta(hours=1)
+        ))
+        db.session.commit()
+    headers = dict(auth_headers, **{'Idempotency-Key': 'racing', 'Content-Type': 'application/json'})
+    res = client.post('/api/suppliers', data=body, headers=headers)
+    assert res.status_code == 409
+
+def test_idempotency_stale_claim_taken_over(app, client, auth_headers):
+    # Left in progress by a worker killed mid-request, longer ago than the lease
+    body = b'{"name": "Orphaned Supplier"}'
+    with app.app_context():
+        db.session.add(IdempotencyKey(
+            user_id=1, scope='POST /api/suppliers', key='orphaned',
+            request_hash=hashlib.sha256(body).hexdigest(),
+            created_at=datetime.utcnow() - timedelta(seconds=app.config['IDEMPOTENCY_LEASE_SECONDS'] + 1),
+            expires_at=datetime.utcnow() + timedelta(hours=1)
+        ))
+        db.session.commit()
+    headers = dict(auth_headers, **{'Idempotency-Key': 'orphaned', 'Content-Type': 'application/json'})
+    res = client.post('/api/suppliers', data=body, headers=headers)
+    assert res.status_code == 201
+    replay = client.post('/api/suppliers', data=body, headers=headers)
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+    assert replay.json == res.json
+
+def test_idempotency_lost_claim_rolls_back_write(app):
+    # The response is stored in the write's transaction; once a retry has
+    # taken the claim over, the original request's write is not committed
+    from flask import g
+    from app.idempotency import commit_response
+    with app.test_request_context():
+        key = IdempotencyKey(user_id=1, scope='POST /api/suppliers', key='lost', request_hash='x',
+                             expires_at=datetime.utcnow() + timedelta(hours=1))
+        db.session.add(key)
+        db.session.commit()
+        g.idempotency_claim = (key.id, key.created_at - timedelta(seconds=1))
+        db.session.add(Supplier(name='Lost Supplier'))
+        response, status = commit_response({'message': 'Supplier created'}, 201)
+        assert status == 409
+        assert Supplier.query.filter_by(name='Lost Supplier').first() is None
+        assert db.session.get(IdempotencyKey, key.id).status == 'in_progress'
+
+def test_idempotency_keys_pruned(app, client, auth_headers):
+    app.config['IDEMPOTENCY_MAX_KEYS'] = 1
+    for i in range(3):
+        client.post('/api/suppliers', json={'name': f'Pruned {i}'},
+                    headers=dict(auth_headers, **{'Idempotency-Key': f'prune-{i}'}))
+    with app.app_context():
+        from app.idempotency import prune_keys
+        prune_keys()
+        assert [k.key for k in IdempotencyKey.query.all()] == ['prune-2']
+
+
+# ==================== JOB TESTS ====================
+
+job_gate = threading.Event()
+
+@job_runner.job_type('test-gated', limit=1)
+def gated_job(ctx, params):
+    while not job_gate.wait(0.01):
+        ctx.progress(0, 1, 'waiting', force=True)
+    return {'ok': True}
+
+def wait_for_job(client, headers, job_id, statuses=('succeeded', 'failed', 'cancelled')):
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        res = client.get(f'/api/jobs/{job_id}', headers=headers)
+        if res.json['status'] in statuses:
+            return res.json
+        time.sleep(0.02)
+    raise AssertionError(f'job {job_id} did not reach {statuses}')
+
+def test_job_analytics_report(client, auth_headers):
+    client.post('/api/products', json={
+        'name': 'Report Product',
+        'sku': 'REPORT-001',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 10.00,
+        'initial_stock': 5
+    }, headers=auth_headers)
+
+    res = client.post('/api/jobs', json={'type': 'analytics-report'}, headers=auth_headers)
+    assert res.status_code == 202
+    job = wait_for_job(client, auth_headers, res.json['id'])
+    assert job['status'] == 'succeeded'
+    assert job['progress'] == 1.0
+
+    res = client.get(f"/api/jobs/{job['id']}/result", headers=auth_headers)
+    assert res.status_code == 200
+    assert res.json['stock_value']['total_stock_value'] == 50.0
+    assert res.json['low_stock'][0]['sku'] == 'REPORT-001'
+
+def test_job_transactions_export(client, auth_headers):
+    client.post('/api/products', json={
+        'name': 'Export Product',
+        'sku': 'EXPORT-001',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 10.00,
+        'initial_stock': 5
+    }, headers=auth_headers)
+
+    res = client.post('/api/jobs', json={'type': 'transactions-export', 'params': {'chunk_size': 1}},
+                      headers=auth_headers)
+    job = wait_for_job(client, auth_headers, res.json['id'])
+    assert job['status'] == 'succeeded'
+
+    res = client.get(f"/api/jobs/{job['id']}/result", headers=auth_headers)
+    assert res.mimetype == 'text/csv'
+    lines = res.data.decode().strip().splitlines()
+    assert lines[0].startswith('id,product_id,sku')
+    assert 'EXPORT-001' in lines[1]
+
+def test_job_stock_snapshot(client, auth_headers):
+    client.post('/api/products', json={
+        'name': 'Snapshot Product',
+        'sku': 'SNAP-001',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 10.00,
+        'initial_stock': 7
+    }, headers=auth_headers)
+
+    res = client.post('/api/jobs', json={'type': 'stock-snapshot'}, headers=auth_headers)
+    job = wait_for_job(client, auth_headers, res.json['id'])
+    res = client.get(f"/api/jobs/{job['id']}/result", headers=auth_headers)
+    assert res.json == [{'id': 1, 'sku': 'SNAP-001', 'name': 'Snapshot Product', 'stock': 7}]
+
+def test_job_concurrency_limit_and_cancel(client, auth_headers):
+    job_gate.clear()
+    first = client.post('/api/jobs', json={'type': 'test-gated'}, headers=auth_headers).json['id']
+    second = client.post('/api/jobs', json={'type': 'test-gated'}, headers=auth_headers).json['id']
+    wait_for_job(client, auth_headers, first, statuses=('running',))
+    assert client.get(f'/api/jobs/{second}', headers=auth_headers).json['status'] == 'queued'
+
+    res = client.post(f'/api/jobs/{second}/cancel', headers=auth_headers)
+    assert res.status_code == 202
+    assert res.json['status'] == 'cancelled'
+
+    res = client.post(f'/api/jobs/{first}/cancel', headers=auth_headers)
+    assert res.status_code == 202
+    assert wait_for_job(client, auth_headers, first)['status'] == 'cancelled'
+    assert client.post(f'/api/jobs/{first}/cancel', headers=auth_headers).status_code == 409
+    assert client.get(f'/api/jobs/{first}/result', headers=auth_headers).status_code == 409
+
+def test_job_unknown_type(client, auth_headers):
+    res = client.post('/api/jobs', json={'type': 'nope'}, headers=auth_headers)
+    assert res.status_code == 400
+    res = client.post('/api/jobs', json={}, headers=auth_headers)
+    assert res.status_code == 400
+
+def test_job_product_purge(app, client, auth_headers):
+    app.config['PRODUCT_PURGE_CHUNK_SIZE'] = 2
+    product_id = create_products(client, auth_headers, ['Purged Product'])[0]
+    add_dated_transactions(app, product_id, [datetime(2024, 1, d) for d in range(1, 6)])
+    res = client.delete(f'/api/products/{product_id}?background=1', headers=auth_headers)
+    assert res.status_code == 202
+    assert res.json['movements'] == 5
+
+    job = wait_for_job(client, auth_headers, res.json['job_id'])
+    assert job['status'] == 'succeeded'
+    assert job['progress'] == 1.0
+    assert client.get(f'/api/products/{product_id}', headers=auth_headers).status_code == 404
+    with app.app_context():
+        assert InventoryTransaction.query.filter_by(product_id=product_id).count() == 0
+
+def test_list_jobs(client, auth_headers):
+    job_id = client.post('/api/jobs', json={'type': 'analytics-report'}, headers=auth_headers).json['id']
+    wait_for_job(client, auth_headers, job_id)
+    res = client.get('/api/jobs?type=analytics-report', headers=auth_headers)
+    assert res.status_code == 200
+    assert len(res.json) == 1
+
+def test_jobs_visible_to_owner_and_admins(app, client, auth_headers):
+    app.config['ADMIN_USERNAMES'] = set()
+    job_id = client.post('/api/jobs', json={'type': 'analytics-report'}, headers=auth_headers).json['id']
+    wait_for_job(client, auth_headers, job_id)
+    client.post('/auth/register', json={'username': 'other', 'password': 'password'})
+    token = client.post('/auth/login', json={'username': 'other', 'password': 'password'}).json['token']
+    other = {'Authorization': f'Bearer {token}'}
+
+    assert client.get('/api/jobs', headers=other).json == []
+    assert client.get(f'/api/jobs/{job_id}', headers=other).status_code == 404
+    assert client.get(f'/api/jobs/{job_id}/result', headers=other).status_code == 404
+    assert client.post(f'/api/jobs/{job_id}/cancel', headers=other).status_code == 404
+
+    app.config['ADMIN_USERNAMES'] = {'other'}
+    assert [j['id'] for j in client.get('/api/jobs', headers=other).json] == [job_id]
+    assert client.get(f'/api/jobs/{job_id}/result', headers=other).status_code == 200
+
+def test_jobs_recovered_from_stopped_worker(app, client):
+    from app.jobs import ORPHANED_ERROR
+    from app.models import Job
+    app.config['ADMIN_USERNAMES'] = {'admin'}
+    expired = datetime.utcnow() - timedelta(hours=1)
+    with app.app_context():
+        db.session.add_all([
+            Job(id='orphan-queued', job_type='stock-snapshot', worker='gone:1', heartbeat_at=expired),
+            Job(id='orphan-running', job_type='stock-snapshot', status='running', worker='gone:1',
+                heartbeat_at=expired),
+            Job(id='leased', job_type='stock-snapshot', worker='alive:2', heartbeat_at=datetime.utcnow()),
+        ])
+        db.session.commit()
+
+    # The first request of a new worker recovers what stopped workers left
+    token = client.post('/auth/login', json={'username': 'admin', 'password': 'password'}).json['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    assert wait_for_job(client, headers, 'orphan-queued')['status'] == 'succeeded'
+    job = client.get('/api/jobs/orphan-running', headers=headers).json
+    assert (job['status'], job['error']) == ('failed', ORPHANED_ERROR)
+    assert client.get('/api/jobs/leased', headers=headers).json['status'] == 'queued'
+    with app.app_context():
+        assert job_runner.recover(app) == (0, 0)
+
+
+# ==================== BATCH TESTS ====================
+
+def test_batch_runs_sub_requests(client, auth_headers):
+    product_id = create_products(client, auth_headers, ['Batched'])[0]
+    res = client.post('/api/batch', json={'requests': [
+        {'id': 'value', 'path': '/api/analytics/stock-value'},
+        {'id': 'product', 'path': f'/api/products/{product_id}'},
+        {'id': 'list', 'path': '/api/products?fields=id', 'query': {'per_page': 1}},
+        {'id': 'missing', 'path': '/api/products/999999'},
+    ]}, headers=auth_headers)
+    assert res.status_code == 200
+    responses = {r['id']: r for r in res.json['responses']}
+    assert [r['id'] for r in res.json['responses']] == ['value', 'product', 'list', 'missing']
+    assert responses['value']['status'] == 200 and 'total_stock_value' in responses['value']['body']
+    assert responses['product']['body']['name'] == 'Batched'
+    assert responses['list']['body']['products'] == [{'id': product_id}]
+    assert responses['missing']['status'] == 404
+
+def test_batch_validation(client, auth_headers):
+    assert client.post('/api/batch', json={'requests': []}, headers=auth_headers).status_code == 400
+    for path in ('/api/batch', '/health', 'http://evil.example/api/products'):
+        res = client.post('/api/batch', json={'requests': [{'path': path}]}, headers=auth_headers)
+        assert res.status_code == 400, path
+    res = client.post('/api/batch', json={'requests': [{'path': '/api/products'}] * 21}, headers=auth_headers)
+    assert res.status_code == 400
+    assert client.post('/api/batch', json={'requests': [{'path': '/api/products'}]}).status_code == 401
+
+
+# ==================== SQLITE PROFILE TESTS ====================
+
+def test_sqlite_profile(app, client, auth_headers):
+    from sqlalchemy import event
+    from app.sqlite import is_sqlite_file
+    with app.app_context():
+        if not is_sqlite_file(db.engine.url):
+            pytest.skip('SQLite file databases only')
+        with db.engine.connect() as conn:
+            assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+            assert conn.exec_driver_sql('PRAGMA synchronous').scalar() == 1
+            assert conn.exec_driver_sql('PRAGMA busy_timeout').scalar() == app.config['SQLITE_BUSY_TIMEOUT_MS']
+        assert 'pool_pre_ping' not in app.config['SQLALCHEMY_ENGINE_OPTIONS']
+        engine = db.engine
+
+    statements = []
+
+    def listener(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        product_id = client.post('/api/products', json={
+            'name': 'Locked Product',
+            'sku': 'LOCK-001',
+            'category': 'Test',
+            'supplier_id': 1,
+            'unit_price': 10.00
+        }, headers=auth_headers).json['id']
+        assert statements.count('BEGIN IMMEDIATE') >= 1
+        statements.clear()
+        assert client.get(f'/api/products/{product_id}', headers=auth_headers).status_code == 200
+        assert client.post('/api/products/lookup', json={'skus': ['LOCK-001']}, headers=auth_headers).status_code == 200
+        res = client.post('/api/batch', json={'requests': [{'path': '/api/analytics/low-stock'}]},
+                          headers=auth_headers)
+        assert res.status_code == 200
+        assert 'BEGIN IMMEDIATE' not in statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+
+
+# ==================== LOGGING TESTS ====================
+
+def capture_logs(app):
+    import io
+    import logging
+    from config.logging import JsonFormatter
+    handler = app.extensions['log_handler']
+    handler.stop()
+    buffer = io.StringIO()
+    handler.target = logging.StreamHandler(buffer)
+    handler.target.setFormatter(JsonFormatter())
+    return handler, buffer
+
+def test_request_logs_are_structured(app, client, auth_headers):
+    import json
+    handler, buffer = capture_logs(app)
+    res = client.get('/api/products', headers={**auth_headers, 'X-Request-ID': 'req-123'})
+    assert res.headers['X-Request-ID'] == 'req-123'
+    app.config['LOG_SAMPLE_RATES'] = {'health': 0.0}
+    client.get('/health')
+    handler.stop()
+
+    records = [json.loads(line) for line in buffer.getvalue().splitlines()]
+    entry = next(r for r in records if r.get('request_id') == 'req-123')
+    assert entry['route'] == '/api/products'
+    assert entry['status'] == 200
+    assert entry['query_count'] >= 1
+    assert entry['latency_ms'] > 0
+    assert not [r for r in records if r.get('route') == '/health']
+    assert client.get('/api/metrics', headers=auth_headers).json['logging.sampled_out'] == 1
+
+def test_log_queue_drops_when_full():
+    import logging
+    from config.logging import AsyncLogHandler
+    release = threading.Event()
+
+    class SlowTarget(logging.Handler):
+        def emit(self, record):
+            release.wait(5)
+
+    handler = AsyncLogHandler(SlowTarget(), maxsize=2)
+    logger = logging.getLogger('test.async_log')
+    logger.addHandler(handler)
+    try:
+        for i in range(10):
+            logger.warning('record %d', i)
+        # One record may already be with the blocked writer; the rest overflow
+        assert handler.dropped >= 7
+    finally:
+        release.set()
+        logger.removeHandler(handler)
+        handler.close()
+
+
+# ==================== PROFILING TESTS ====================
+
+def test_admin_profiles_a_request(app, client, auth_headers, tmp_path):
+    import pstats
+    app.config.update({'ADMIN_USERNAMES': {'admin'}, 'PROFILE_DIR': str(tmp_path)})
+    create_products(client, auth_headers, ['Profiled'])
+
+    res = client.get('/api/products', headers={**auth_headers, 'X-Profile': 'cprofile'})
+    assert res.status_code == 200
+    capture_id = res.headers['X-Profile-Id']
+    res = client.get('/api/products/1', headers={**auth_headers, 'X-Profile': 'sample'})
+    sampled_id = res.headers['X-Profile-Id']
+
+    captures = client.get('/api/admin/profiles', headers=auth_headers).json
+    assert [c['id'] for c in captures] == [sampled_id, capture_id]
+    assert captures[1]['endpoint'] == 'products.get_products'
+    assert captures[1]['sql_count'] >= 1
+    assert captures[1]['files'] == ['json', 'pstats']
+    assert captures[0]['files'] == ['collapsed', 'json']
+
+    res = client.get(f'/api/admin/profiles/{capture_id}.pstats', headers=auth_headers)
+    assert res.status_code == 200
+    path = tmp_path / 'download.pstats'
+    path.write_bytes(res.data)
+    assert pstats.Stats(str(path)).total_calls > 0
+    assert client.get(f'/api/admin/profiles/{sampled_id}.collapsed', headers=auth_headers).status_code == 200
+    assert client.get(f'/api/admin/profiles/{capture_id}.collapsed', headers=auth_headers).status_code == 404
+
+def test_profiling_requires_admin(app, client, auth_headers, tmp_path):
+    app.config.update({'ADMIN_USERNAMES': set(), 'PROFILE_DIR': str(tmp_path)})
+    res = client.get('/api/products', headers={**auth_headers, 'X-Profile': 'cprofile'})
+    assert 'X-Profile-Id' not in res.headers
+    assert client.get('/api/admin/profiles', headers=auth_headers).status_code == 403
+
+    # Sampled captures need no header or admin
+    app.config['PROFILE_SAMPLE_RATE'] = 1.0
+    assert 'X-Profile-Id' in client.get('/health').headers
+    app.config['PROFILE_SAMPLE_RATE'] = 0.0
+    assert len(list(tmp_path.glob('*.json'))) == 1
+
+
+# ==================== ASYNC SERVING TESTS ====================
+
+def asgi_request(server, method, path, headers=None, json_body=None):
+    path, _, query = path.partition('?')
+    body = json.dumps(json_body).encode() if json_body is not None else b''
+    headers = dict(headers or {})
+    if body:
+        headers.update({'Content-Type': 'application/json', 'Content-Length': str(len(body))})
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+             'path': path, 'root_path': '', 'query_string': query.encode(), 'server': ('testserver', 80),
+             'client': ('127.0.0.1', 50000), 'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()]}
+    messages = iter([{'type': 'http.request', 'body': body, 'more_body': False}])
+    sent = []
+
+    async def receive():
+        return next(messages, {'type': 'http.disconnect'})
+
+    async def send(message):
+        sent.append(message)
+    return scope, receive, send, sent
+
+def run_asgi(server, requests):
+    # Runs the requests concurrently on one event loop; returns (status, json) per request
+    async def run_all():
+        calls = [asgi_request(server, *request) for request in requests]
+        await asyncio.gather(*(server(scope, receive, send) for scope, receive, send, _ in calls))
+        return [(sent[0]['status'], json.loads(b''.join(m.get('body', b'') for m in sent[1:])))
+                for *_, sent in calls]
+    return asyncio.run(run_all())
+
+def test_async_read_server(app, client, auth_headers):
+    from app.aio import create_asgi_app
+    server = create_asgi_app(app)
+    assert server.read_app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite+aiosqlite://')
+    assert server.serves(asgi_request(server, 'GET', '/api/analytics/low-stock')[0])
+    assert not server.serves(asgi_request(server, 'POST', '/api/products')[0])
+    assert not server.serves(asgi_request(server, 'GET', '/api/jobs')[0])
+    # Jobs stay with the regular app; both apps log through one handler
+    assert 'job_runner' not in server.read_app.extensions
+    assert server.read_app.extensions['log_handler'] is app.extensions['log_handler']
+
+    # Writes go through the regular app on the thread pool
+    [(status, body)] = run_asgi(server, [('POST', '/api/products', auth_headers, {
+        'name': 'Async Product', 'sku': 'ASYNC-1', 'category': 'Async', 'supplier_id': 1,
+        'unit_price': 4, 'initial_stock': 6})])
+    assert status == 201, body
+
+    paths = ['/api/products?fields=id,sku,stock', '/api/transactions?fields=id,quantity',
+             '/api/analytics/low-stock', '/api/analytics/stock-by-category', '/api/analytics/stock-by-category',
+             '/api/analytics/stock-value']
+    results = run_asgi(server, [('GET', path, auth_headers) for path in paths])
+    assert results == [(200, client.get(path, headers=auth_headers).json) for path in paths]
+    assert results[2][1] == [{'name': 'Async Product', 'sku': 'ASYNC-1', 'stock': 6}]
+    assert run_asgi(server, [('GET', '/api/analytics/low-stock', None)])[0][0] == 401
+
+    app.config['ANALYTICS_ENGINE'] = 'numpy'
+    assert not create_asgi_app(app).serves(asgi_request(server, 'GET', '/api/analytics/low-stock')[0])
+
+def test_loop_singleflight_coalesces():
+    from sqlalchemy.util import await_only, greenlet_spawn
+    from app.aio import LoopSingleFlight
+    flight = LoopSingleFlight()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        await_only(asyncio.sleep(0.05))
+        return 'report'
+
+    async def run_all():
+        return await asyncio.gather(*(greenlet_spawn(flight.do, ('key',), compute) for _ in range(4)))
+    assert asyncio.run(run_all()) == [('report', False), ('report', True), ('report', True), ('report', True)]
+    assert len(calls) == 1
+
+
+# ==================== GROUP COMMIT TESTS ====================
+
+def test_group_commit(app, client, auth_headers):
+    product_id = client.post('/api/products', json={
+        'name': 'Grouped Product',
+        'sku': 'GROUP-001',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 10.00
+    }, headers=auth_headers).json['id']
+    app.config.update(GROUP_COMMIT=True, GROUP_COMMIT_MAX_WAIT_MS=50)
+    res = client.post('/api/transactions', json={
+        'product_id': product_id, 'quantity': 10, 'transaction_type': 'IN', 'unit_cost': 4
+    }, headers=auth_headers)
+    assert res.status_code == 201
+    assert db.session.get(InventoryTransaction, res.json['id']).unit_cost == 4
+
+    # Eight concurrent sales of 2 against a stock of 10: the batch accepts
+    # exactly five of them, in queue order
+    statuses = []
+
+    def sell():
+        res = app.test_client().post('/api/transactions', json={
+            'product_id': product_id, 'quantity': 2, 'transaction_type': 'OUT'
+        }, headers=auth_headers)
+        statuses.append(res.status_code)
+    threads = [threading.Thread(target=sell) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(statuses) == [201] * 5 + [400] * 3
+    assert client.get(f'/api/products/{product_id}', headers=auth_headers).json['stock'] == 0
+
+    assert client.post('/api/transactions', json={
+        'product_id': 999999, 'quantity': 1, 'transaction_type': 'IN'
+    }, headers=auth_headers).status_code == 404
+    stats = client.get('/api/metrics', headers=auth_headers).json
+    assert stats['group_commit.batch_size.sum'] == 9
+    assert stats['group_commit.batch_size.count'] < 9
+    assert stats['group_commit.rejected'] == 3
+    assert stats['group_commit.wait_ms.count'] == 9
+
+def test_group_commit_timeout_keeps_idempotency_key(app, client, auth_headers, monkeypatch):
+    from app.groupcommit import GroupCommitter
+    product_id = create_products(client, auth_headers, ['Slow Commit'])[0]
+    app.config.update(GROUP_COMMIT=True, GROUP_COMMIT_TIMEOUT=0.05)
+    release = threading.Event()
+    commit = GroupCommitter._commit
+
+    def slow_commit(self, batch):
+        release.wait(5)
+        return commit(self, batch)
+    monkeypatch.setattr(GroupCommitter, '_commit', slow_commit)
+    headers = dict(auth_headers, **{'Idempotency-Key': 'slow-sale'})
+    payload = {'product_id': product_id, 'quantity': 3, 'transaction_type': 'IN'}
+
+    # Not confirmed in time: without a key the outcome is unknown
+    assert client.post('/api/transactions', json=payload, headers=auth_headers).status_code == 503
+    # With one, a pending answer, and the key stays in progress
+    assert client.post('/api/transactions', json=payload, headers=headers).status_code == 202
+    assert client.post('/api/transactions', json=payload, headers=headers).status_code == 409
+    release.set()
+    deadline = time.time() + 5
+    res = client.post('/api/transactions', json=payload, headers=headers)
+    while res.status_code == 409 and time.time() < deadline:
+        time.sleep(0.02)
+        res = client.post('/api/transactions', json=payload, headers=headers)
+    assert res.status_code == 201 and res.headers['Idempotent-Replayed'] == 'true'
+    assert InventoryTransaction.query.filter_by(product_id=product_id).count() == 2
+    assert db.session.get(InventoryTransaction, res.json['id']).quantity == 3
+
+def test_group_commit_survives_failing_batch(app, client, auth_headers, monkeypatch):
+    from app import groupcommit
+    product_id = create_products(client, auth_headers, ['Failing Batch'])[0]
+    app.config.update(GROUP_COMMIT=True, GROUP_COMMIT_TIMEOUT=5)
+    payload = {'product_id': product_id, 'quantity': 2, 'transaction_type': 'IN'}
+
+    def broken_commit(self, batch):
+        raise RuntimeError('disk full')
+
+    def broken_metrics():
+        raise RuntimeError('metrics unavailable')
+    # The batch fails, and so does its error handling
+    monkeypatch.setattr(groupcommit.GroupCommitter, '_commit', broken_commit)
+    monkeypatch.setattr(groupcommit, 'metrics', broken_metrics)
+    with pytest.raises(RuntimeError, match='metrics unavailable'):
+        client.post('/api/transactions', json=payload, headers=auth_headers)
+    monkeypatch.undo()
+
+    # The flusher is still running
+    res = client.post('/api/transactions', json=payload, headers=auth_headers)
+    assert res.status_code == 201
+    assert client.get(f'/api/products/{product_id}', headers=auth_headers).json['stock'] == 2
+
+
+# ==================== CHANGE FEED TESTS ====================
+
+def test_change_feed(app, client, auth_headers):
+    def sync(cursor=None, **params):
+        if cursor:
+            params['since'] = cursor
+        res = client.get('/api/changes', query_string=params, headers=auth_headers)
+        assert res.status_code == 200
+        return res.json
+
+    product_id = client.post('/api/products', json={
+        'name': 'Synced Product',
+        'sku': 'SYNC-001',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 5.00,
+        'initial_stock': 10
+    }, headers=auth_headers).json['id']
+    first = sync()
+    assert [(c['entity'], c['id']) for c in first['changes']] == [
+        ('supplier', 1), ('product', product_id), ('stock', product_id)]
+    assert first['changes'][0]['data']['name'] == 'Test Supplier'
+    assert first['changes'][1]['data']['sku'] == 'SYNC-001'
+    assert first['changes'][2]['data'] == {'product_id': product_id, 'quantity': 10, 'value': 50.0}
+    seqs = [c['seq'] for c in first['changes']]
+    assert seqs == sorted(seqs)
+    assert not first['has_more']
+    assert sync(first['cursor'])['changes'] == []
+
+    # Only what changed comes back, at its latest state
+    client.put(f'/api/products/{product_id}', json={'unit_price': 6.00}, headers=auth_headers)
+    client.post('/api/transactions', json={
+        'product_id': product_id, 'quantity': 4, 'transaction_type': 'OUT'
+    }, headers=auth_headers)
+    client.patch('/api/products/bulk', json={'ids': [product_id], 'set': {'category': 'Moved'}},
+                 headers=auth_headers)
+    delta = sync(first['cursor'])
+    assert [(c['entity'], c['id']) for c in delta['changes']] == [('stock', product_id), ('product', product_id)]
+    assert delta['changes'][0]['data']['quantity'] == 6
+    assert delta['changes'][1]['data']['unit_price'] == 6.0
+    assert delta['changes'][1]['data']['category'] == 'Moved'
+
+    page = sync(limit=2)
+    assert len(page['changes']) == 2 and page['has_more']
+    assert [c['entity'] for c in sync(page['cursor'])['changes']] == ['product']
+
+    assert client.delete(f'/api/products/{product_id}', headers=auth_headers).status_code == 200
+    tombstones = sync(delta['cursor'])['changes']
+    assert {(c['entity'], c['deleted'], c['data']) for c in tombstones} == {
+        ('product', True, None), ('stock', True, None)}
+
+    assert client.get('/api/changes?since=bogus', headers=auth_headers).status_code == 400
+    assert client.get('/api/changes?limit=0', headers=auth_headers).status_code == 400
+
+def test_change_feed_stamps_after_commit(app, client, auth_headers):
+    from app.changes import stamp_pending
+    from app.pagination import encode_cursor
+    from app.models import Change, ChangeCounter, PendingChange
+    client.get('/api/changes', headers=auth_headers)
+    with app.app_context():
+        before = db.session.get(ChangeCounter, 1).value
+    product_id = create_products(client, auth_headers, ['Pending Product'])[0]
+
+    # The write only recorded its row; no seq was taken inside it
+    with app.app_context():
+        assert db.session.get(ChangeCounter, 1).value == before
+        assert db.session.get(PendingChange, ('product', product_id)) is not None
+        assert db.session.get(Change, ('product', product_id)) is None
+    res = client.get('/api/changes', query_string={'since': encode_cursor([before])}, headers=auth_headers)
+    assert [(c['entity'], c['id'], c['seq']) for c in res.json['changes']] == [('product', product_id, before + 1)]
+    with app.app_context():
+        assert PendingChange.query.count() == 0
+        assert db.session.get(ChangeCounter, 1).value == before + 1
+        assert stamp_pending() == 0
+
+def test_change_counter_seeded_once(app):
+    from app.changes import _lock_counter, seed_counter
+    from app.models import ChangeCounter
+    with app.app_context():
+        db.session.query(ChangeCounter).delete()
+        db.session.commit()
+        # A stamper racing another one's first insert does not fail
+        with db.engine.begin() as conn:
+            seed_counter(conn)
+            assert _lock_counter(conn) == 0
+            seed_counter(conn)
+            assert _lock_counter(conn) == 0
+        assert ChangeCounter.query.count() == 1
+
+def test_change_feed_backfill(app, client, auth_headers):
+    from app.changes import backfill_changes
+    from app.models import Change
+    client.post('/api/products', json={
+        'name': 'Old Product',
+        'sku': 'OLD-001',
+        'category': 'Test',
+        'supplier_id': 1,
+        'unit_price': 5.00,
+        'initial_stock': 3
+    }, headers=auth_headers)
+    with app.app_context():
+        db.session.query(Change).delete()
+        db.session.commit()
+        assert backfill_changes() == 3
+        assert backfill_changes() == 0
+    entities = [c['entity'] for c in client.get('/api/changes', headers=auth_headers).json['changes']]
+    assert sorted(entities) == ['product', 'stock', 'supplier']
 
 
 # ==================== HEALTH CHECK ====================
@@ -0,0 +1,215 @@
+import difflib
+import json
+import os
+import random
+import re
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.pool import NullPool
+from werkzeug.security import generate_password_hash
+from app import create_app, db
+from app.models import User, Supplier, Product, InventoryTransaction
+from config import Config
+
+# Query-plan regression tests: every analytics and listing endpoint is called
+# against a seeded, ANALYZEd ledger, the statements it runs are captured and
+# explained (EXPLAIN QUERY PLAN on SQLite, EXPLAIN on PostgreSQL), and the
+# plans are checked for the expected indexes and for full scans of the
+# ledger. A failure prints the plan diffed against the recorded baseline in
+# tests/query_plans/; UPDATE_QUERY_PLANS=1 rewrites the baselines.
+
+LEDGER = 'inventory_transactions'
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'query_plans')
+PRODUCTS = 2000
+SUPPLIERS = 10
+MOVEMENTS = 50000
+START = datetime(2024, 1, 1)
+
+# Either index serves a per-product lookup; the planner picks by statistics
+BY_PRODUCT = ('idx_transactions_product', 'idx_transactions_prod_date')
+BY_DATE = ('idx_transactions_date',)
+
+# (name, method, path, indexes the plans must use, ledger scans allowed).
+# Each entry of the indexes is a tuple of alternatives. A scan is allowed
+# by naming the index it walks, e.g. the newest-first listing that stops
+# after LIMIT rows.
+CASES = [
+    ('top_selling', 'GET', '/api/analytics/top-selling', [BY_PRODUCT], ()),
+    ('low_stock', 'GET', '/api/analytics/low-stock', [BY_PRODUCT], ()),
+    ('stock_value', 'GET', '/api/analytics/stock-value', [], ()),
+    ('recent_products', 'GET', '/api/analytics/recent-products', [], ()),
+    ('stock_by_category', 'GET', '/api/analytics/stock-by-category', [], ()),
+    ('products_by_supplier', 'GET', '/api/analytics/products-by-supplier', [BY_PRODUCT], ()),
+    ('stock_movement', 'GET', '/api/analytics/stock-movement/7',
+     [BY_PRODUCT, ('idx_transactions_prod_date',)], ()),
+    ('stock_as_of', 'GET', '/api/analytics/stock-as-of?at=2024-01-20', [BY_DATE], ()),
+    ('products', 'GET', '/api/products?count=exact', [BY_PRODUCT], ()),
+    ('products_search', 'GET', '/api/products?q=Product%2012&count=exact', [BY_PRODUCT], ()),
+    ('product', 'GET', '/api/products/7', [BY_PRODUCT], ()),
+    ('product_by_sku', 'GET', '/api/products/by-sku/SKU-00000007', [BY_PRODUCT], ()),
+    ('product_lookup', 'POST', '/api/products/lookup', [BY_PRODUCT], ()),
+    ('transactions', 'GET', '/api/transactions', [BY_DATE], ('idx_transactions_date',)),
+    ('transactions_by_product', 'GET', '/api/transactions?product_id=7', [('idx_transactions_prod_date',)], ()),
+    ('transactions_by_date', 'GET', '/api/transactions?start=2024-01-10&end=2024-01-11',
+     [BY_DATE], ()),
+]
+
+SQL_WORDS = {'as', 'join', 'left', 'inner', 'where', 'on', 'group', 'order', 'limit', 'union', 'cross'}
+
+
+@pytest.fixture(scope='module')
+def plan_app(tmp_path_factory):
+    class PlanConfig(Config):
+        SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL') or \
+            f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}"
+        SQLALCHEMY_ENGINE_OPTIONS = {'poolclass': NullPool}
+        TESTING = True
+        LOG_REQUESTS = False
+        ANALYTICS_ENGINE = 'sql'
+    app = create_app(PlanConfig)
+    rng = random.Random(7)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(username='planner', password_hash=generate_password_hash('planner')))
+        db.session.add_all([Supplier(name=f'Supplier {i}') for i in range(SUPPLIERS)])
+        db.session.commit()
+        db.session.execute(Product.__table__.insert(), [{
+            'name': f'Product {i}', 'sku': f'SKU-{i:08d}', 'category': f'Category {i % 20}',
+            'supplier_id': 1 + i % SUPPLIERS, 'unit_price': 5 + i % 100, 'is_active': i % 10 != 0
+        } for i in range(PRODUCTS)])
+        db.session.execute(InventoryTransaction.__table__.insert(), [{
+            'product_id': rng.randint(1, PRODUCTS), 'quantity': rng.randint(1, 20),
+            'transaction_type': 'IN' if rng.random() < 0.6 else 'OUT',
+            'transaction_date': START + timedelta(minutes=i)
+        } for i in range(MOVEMENTS)])
+        db.session.commit()
+        # Plans follow the statistics, as they do in production
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture(scope='module')
+def plan_headers(plan_app):
+    res = plan_app.test_client().post('/auth/login', json={'username': 'planner', 'password': 'planner'})
+    return {'Authorization': f'Bearer {res.json["token"]}'}
+
+
+def ledger_aliases(statement):
+    aliases = {LEDGER}
+    for alias in re.findall(rf'\b{LEDGER}\s+(?:AS\s+)?(\w+)', statement, re.IGNORECASE):
+        if alias.lower() not in SQL_WORDS:
+            aliases.add(alias)
+    return aliases
+
+def explain(conn, statement, parameters):
+    # Plan lines, indented by depth
+    if conn.dialect.name == 'sqlite':
+        rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+        depth = {0: -1}
+        lines = []
+        for node, parent, _, detail in rows:
+            depth[node] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node] + detail)
+        return lines
+    return [row[0] for row in conn.exec_driver_sql(f'EXPLAIN {statement}', parameters)]
+
+def plan_problems(dialect, statement, plan, allowed_scans):
+    aliases = ledger_aliases(statement)
+    problems = []
+    for line in plan:
+        detail = line.strip()
+        if dialect == 'sqlite':
+            match = re.match(r'SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?', detail)
+            if match and match.group(1) in aliases and match.group(2) not in allowed_scans:
+                problems.append(f'full scan of the ledger: {detail}')
+            # No index fits, so SQLite builds one from a full scan per query
+            match = re.match(r'SEARCH (\w+) USING AUTOMATIC', detail)
+            if match and match.group(1) in aliases:
+                problems.append(f'automatic index built over the ledger: {detail}')
+        elif re.search(rf'Seq Scan on {LEDGER}\w*', detail):
+            problems.append(f'sequential scan of the ledger: {detail}')
+    return problems
+
+def capture(app, method, path, headers):
+    statements = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and LEDGER in statement and statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        client = app.test_client()
+        if method == 'POST':
+            res = client.post(path, json={'skus': ['SKU-00000007', 'SKU-00000042']}, headers=headers)
+        else:
+            res = client.get(path, headers=headers)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert res.status_code == 200, res.get_data(as_text=True)
+    return engine, statements
+
+def load_baseline(dialect):
+    path = os.path.join(BASELINE_DIR, f'{dialect}.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_baseline(dialect, name, plans):
+    baseline = load_baseline(dialect)
+    baseline[name] = plans
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    with open(os.path.join(BASELINE_DIR, f'{dialect}.json'), 'w') as f:
+        json.dump(dict(sorted(baseline.items())), f, indent=2)
+        f.write('\n')
+
+def plan_diff(expected, actual):
+    if expected is None:
+        return 'No recorded baseline; current plan:\n' + '\n'.join(actual)
+    diff = difflib.unified_diff(expected, actual, 'baseline', 'current', lineterm='')
+    return '\n'.join(diff) or 'Plan matches the baseline'
+
+
+@pytest.mark.parametrize('name, method, path, indexes, allowed_scans', CASES, ids=[case[0] for case in CASES])
+def test_query_plan(plan_app, plan_headers, name, method, path, indexes, allowed_scans):
+    engine, statements = capture(plan_app, method, path, plan_headers)
+    dialect = engine.dialect.name
+    plans = []
+    problems = []
+    with engine.connect() as conn:
+        if dialect == 'postgresql':
+            # Small tables are cheaper to read whole, so make the planner
+            # show which index it would use; a Seq Scan then means none fits
+            conn.exec_driver_sql('SET enable_seqscan = off')
+        for statement, parameters in statements:
+            plan = explain(conn, statement, parameters)
+            plans.append(' '.join(statement.split()))
+            plans.extend(plan)
+            problems += plan_problems(dialect, statement, plan, allowed_scans)
+    used = ' '.join(plans)
+    problems += [f"expected index not used: {' or '.join(choices)}" for choices in indexes
+                 if not any(index in used for index in choices)]
+
+    if os.getenv('UPDATE_QUERY_PLANS'):
+        save_baseline(dialect, name, plans)
+    if problems:
+        pytest.fail('\n'.join(problems) + '\n\n' + plan_diff(load_baseline(dialect).get(name), plans),
+                    pytrace=False)
+
+def test_plan_checks_flag_ledger_scans():
+    # The checker itself: a plain scan of an aliased ledger is caught, an
+    # index search or an allowed ordered scan is not
+    statement = 'SELECT * FROM inventory_transactions AS t JOIN products p ON p.id = t.product_id'
+    assert plan_problems('sqlite', statement, ['SCAN t', 'SEARCH p USING INTEGER PRIMARY KEY (rowid=?)'], ())
+    assert not plan_problems('sqlite', statement, ['SEARCH t USING INDEX idx_transactions_product (product_id=?)'], ())
+    assert not plan_problems('sqlite', statement, ['SCAN t USING INDEX idx_transactions_date'],
+                             ('idx_transactions_date',))
+    assert plan_problems('sqlite', statement, ['SEARCH t USING AUTOMATIC COVERING INDEX (product_id=?)'], ())
+    assert plan_problems('postgresql', statement, ['Seq Scan on inventory_transactions t  (cost=0.00..1.00)'], ())
+    assert 'baseline' in plan_diff(['SEARCH t'], ['SCAN t'])